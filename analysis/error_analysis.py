@@ -7,6 +7,9 @@ from collections import Counter
 from tqdm import tqdm
 from entropy import spectral_entropy
 
+sys.path.append('../feature_engineering/')
+from tensor_store import is_store, open_store
+
 import matplotlib
 matplotlib.use('Agg')
 
@@ -44,12 +47,17 @@ def main(args):
   indices = np.arange(y_true.shape[0])
 
   feat_df = pd.read_csv(os.path.join(args.indir, 'features_30.0s.csv'))
-  shape_df = pd.read_csv(os.path.join(args.indir, 'datashape_30.0s.csv'))
-  num_samples = shape_df['num_samples'].values[0]
-  num_timesteps = shape_df['num_timesteps'].values[0]
-  num_channels = shape_df['num_channels'].values[0]
-  rawdata = np.memmap(os.path.join(args.indir, 'rawdata_30.0s.npz'), mode='r', dtype='float32',\
-                      shape=(num_samples, num_timesteps, num_channels))
+  # Use shape and dtype of tensor store if present, else shape file
+  raw_fname = os.path.join(args.indir, 'rawdata_30.0s.npz')
+  if is_store(raw_fname):
+    rawdata = open_store(raw_fname)
+  else:
+    shape_df = pd.read_csv(os.path.join(args.indir, 'datashape_30.0s.csv'))
+    num_samples = shape_df['num_samples'].values[0]
+    num_timesteps = shape_df['num_timesteps'].values[0]
+    num_channels = shape_df['num_channels'].values[0]
+    rawdata = np.memmap(raw_fname, mode='r', dtype='float32',\
+                        shape=(num_samples, num_timesteps, num_channels))
  
   # Get entropy of error scenarios
   spec_entropy = []
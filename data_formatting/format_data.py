@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 import sys,os
+import shutil
+import json
+import hashlib
 import h5py
 import numpy as np
 import math
 import pandas as pd
-from scipy.stats import entropy
-from collections import Counter
+
+sys.path.append('../feature_engineering/')
+from epoch_stats import get_epochs, get_epoch_stats, get_epoch_categ, get_epoch_slices
+from context_feat import get_context_feat
+from lids import get_LIDS
+from manifest import Manifest, get_code_version
+from timestamp_io import read_timestamp
+from tensor_store import create_store, finalize_store
 
 # Get Euclidean Norm minus One
 def get_ENMO(x,y,z):
@@ -20,140 +29,88 @@ def get_tilt_angles(x,y,z):
   angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
   return angle_x, angle_y, angle_z
 
-# Get Locomotor Inactivity During Sleep   
-def get_LIDS(timestamp, ENMO):
-  df = pd.concat((timestamp, pd.Series(ENMO)), axis=1)
-  df.columns = ['timestamp','ENMO']
-  df.set_index('timestamp', inplace=True)
-  
-  df['ENMO_sub'] = np.where(ENMO < 0.02, 0, ENMO-0.02) # assuming ENMO is in g
-  # 10-minute rolling sum
-  ENMO_sub_smooth = df['ENMO_sub'].rolling('600s').sum()
-  df['LIDS_unfiltered'] = 100.0 / (ENMO_sub_smooth + 1.0)
-  # 30-minute rolling average
-  LIDS = df['LIDS_unfiltered'].rolling('1800s').mean().values
-  return LIDS
-  
-def mad(data):
-  out = np.mean(np.absolute(data - np.mean(data)))
-  return out  
-
-def compute_entropy(data, bins=20):
-  bins = int(bins)
-  hist, bin_edges = np.histogram(data, bins=bins)
-  p = hist/float(hist.sum())
-  ent = entropy(p)
-  return ent 
-
-# Get difference of feature with respect to prev or next interval
-def get_diff_feat(feature, direction, time_diff, time_interval=30):
-  window = int(time_diff / float(time_interval))
-  mean_feature = feature.rolling(window).mean().values
-  feature = feature.values.reshape(-1,1)
-  mean_feature = mean_feature.reshape(-1,1)
-  diff = np.zeros(feature.shape)
-  if direction == 'prev':
-    # Compute mean for border conditions
-    for i in range(0,window-1):
-      mean_feature[i] = np.mean(feature[:i+1])
-  else:
-    # Shift mean feature by window
-    mean_feature = np.vstack((mean_feature[window-1:].reshape(-1,1),\
-                              mean_feature[:window-1].reshape(-1,1)))
-    # Compute mean for border conditions
-    for i in range(len(feature)-window+1,len(feature)):
-      mean_feature[i] = np.mean(feature[i:])
-  if direction == 'prev':
-    diff[1:] = feature[1:] - mean_feature[:-1]
-  else:
-    diff[:-1] = mean_feature[1:] - feature[:-1]
-
-  return diff.reshape(-1,)
-    
 # Aggregate statistics of features over a given time interval
-def get_stats(timestamp, feature, time_interval):
-  feat_df = pd.DataFrame(data={'timestamp':timestamp, 'feature':feature})
-  feat_df.set_index('timestamp', inplace=True)
-  feat_mean = feat_df.resample(str(time_interval)+'S').mean()
-  feat_std = feat_df.resample(str(time_interval)+'S').std()
-  feat_min = feat_df.resample(str(time_interval)+'S').min()
-  feat_max = feat_df.resample(str(time_interval)+'S').max()
-  feat_range = feat_max['feature'] - feat_min['feature']
-  feat_mad = feat_df.resample(str(time_interval)+'S').apply(mad)
-  feat_ent1 = feat_df.resample(str(time_interval)+'S')\
-                              .apply(compute_entropy, bins=20)
-  feat_ent2 = feat_df.resample(str(time_interval)+'S')\
-                              .apply(compute_entropy, bins=200)
-  feat_prev30diff = get_diff_feat(feat_mean['feature'], 'prev', 30, time_interval)
-  feat_next30diff = get_diff_feat(feat_mean['feature'], 'next', 30, time_interval)
-  feat_prev60diff = get_diff_feat(feat_mean['feature'], 'prev', 60, time_interval)
-  feat_next60diff = get_diff_feat(feat_mean['feature'], 'next', 60, time_interval)
-  feat_prev120diff = get_diff_feat(feat_mean['feature'], 'prev', 120, time_interval)
-  feat_next120diff = get_diff_feat(feat_mean['feature'], 'next', 120, time_interval)
-  stats = np.vstack((feat_mean['feature'], feat_std['feature'], feat_range, 
-                     feat_mad['feature'], feat_ent1['feature'], feat_ent2['feature'],
-                     feat_prev30diff, feat_next30diff, feat_prev60diff, 
-                     feat_next60diff, feat_prev120diff, feat_next120diff)).T
+def get_stats(timestamp, feature, time_interval, horizons=(30,60,120)):
+  epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+  epoch_stats = get_epoch_stats(feature, epoch_idx, len(epoch_start))
+  # Differences of mean with respect to prev/next intervals for each horizon
+  context = get_context_feat(epoch_stats[:,0], horizons, time_interval)
+  stats = np.hstack((epoch_stats, context))
 
   # return index and stats
-  return np.array(feat_mean.index.values, dtype='str'), stats
+  return np.array(epoch_start, dtype='str'), stats
 
-def get_categ(df, default='NaN'):
-  ctr = Counter(df)
-  for key in ctr:
-    ctr[key] = ctr[key]/float(len(df))
-  dom_categ = ctr.most_common()[0]
-  # If a category occurs more than 70% of time interval,
-  # mark that as dominant category
-  if dom_categ[1] >= 0.7: 
-    dom_categ = dom_categ[0]
-  else:
-    dom_categ = default
-  return dom_categ
-    
 def get_dominant_categ(timestamp, categ, time_interval, default='NaN'):
-  categ_df = pd.DataFrame(data={'timestamp':timestamp, 'category':categ})
-  categ_df.set_index('timestamp', inplace=True)
-  dom_categ = categ_df.resample(str(time_interval)+'S')\
-                               .apply(get_categ, default=default)
-  return np.array(dom_categ['category'])   
+  epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+  return get_epoch_categ(categ, epoch_idx, len(epoch_start), default=default)
 
-def get_tslice(df):
-  tslice = np.array(df['channel'])
-  return tslice
+# Get positions in original timesteps to resample epochs to num_timesteps
+# random - sorted random timesteps (shared by all epochs of a file) including
+#          first and last timestep
+# linear - equally spaced positions with linear interpolation
+# mean   - average over equally sized windows (anti-aliased downsampling)
+def get_resample_positions(in_timesteps, num_timesteps, mode='random'):
+  if mode == 'random':
+    tt = np.zeros((num_timesteps,), dtype=int)
+    tt[1:-1] = np.sort(np.random.randint(1,in_timesteps-1,num_timesteps-2))
+    tt[-1] = in_timesteps-1
+    return tt
+  elif mode == 'linear':
+    return np.linspace(0, in_timesteps-1, num_timesteps)
+  elif mode == 'mean':
+    return np.round(np.linspace(0, in_timesteps, num_timesteps+1)).astype(int)
+  raise ValueError('Unknown resampling mode ' + str(mode))
 
-def get_timeslices(timestamp, channel, time_interval):
-  chan_df = pd.DataFrame(data={'timestamp':timestamp, 'channel':channel})
-  chan_df.set_index('timestamp', inplace=True)
-  chan_slices = chan_df.resample(str(time_interval)+'S').apply(get_tslice)
-  lengths = [tslice.shape[0] for tslice in chan_slices]
-  resize_len = int(np.median(lengths))
-  for tslice in chan_slices:
-    tslice.resize((resize_len), refcheck=False) 
-  return np.stack(chan_slices)
+# Resample all epochs and channels of data (num_samples x timesteps x channels)
+# at given positions in one vectorized operation, writing into out if given
+def resample_timeslices(data, pos, mode='random', out=None):
+  if mode == 'mean':
+    num_timesteps = len(pos) - 1
+  else:
+    num_timesteps = len(pos)
+  if out is None:
+    out = np.zeros((data.shape[0], num_timesteps, data.shape[2]))
+  if mode == 'random': # interpolation at integer timesteps is plain indexing
+    np.take(data, pos, axis=1, out=out)
+  elif mode == 'linear':
+    lo = np.minimum(np.floor(pos).astype(int), data.shape[1]-2)
+    wt = (pos - lo).reshape(1,-1,1)
+    np.take(data, lo, axis=1, out=out)
+    out *= (1.0 - wt)
+    out += data[:,lo+1,:] * wt
+  elif mode == 'mean':
+    lo = np.minimum(pos[:-1], data.shape[1]-1); hi = np.maximum(pos[1:], lo+1)
+    cumsum = np.zeros((data.shape[0], data.shape[1]+1, data.shape[2]))
+    np.cumsum(data, axis=1, out=cumsum[:,1:,:])
+    np.subtract(cumsum[:,hi,:], cumsum[:,lo,:], out=out)
+    out /= (hi - lo).reshape(1,-1,1)
+  return out
 
-def resample_timeslices(data, num_timesteps):
-  # Get resampled timesteps 
-  tt = np.zeros((num_timesteps,), dtype=int)
-  tt[1:-1] = np.sort(np.random.randint(1,data.shape[1]-1,num_timesteps-2))
-  tt[-1] = data.shape[1]-1
-  # Resample data
-  num_channels = data.shape[2]
-  resamp_data = np.zeros((data.shape[0], tt.shape[0], data.shape[2]))
-  for i in range(data.shape[0]):
-    for ch in range(num_channels):  
-      resamp_data[i,:,ch] = np.interp(tt, np.arange(data.shape[1]), data[i,:,ch])
-  return resamp_data
+# Resample raw data to num_timesteps and write it to a chunked HDF5 dataset
+# Epochs are resampled chunk by chunk into a reusable buffer
+def write_resampled(fp, name, data, num_timesteps, mode='random'):
+  pos = get_resample_positions(data.shape[1], num_timesteps, mode)
+  dset = fp.create_dataset(name, shape=(data.shape[0], num_timesteps, data.shape[2]),
+                           dtype=np.float64, compression='gzip', chunks=True)
+  if data.shape[0] == 0:
+    return dset
+  chunk_len = dset.chunks[0]
+  buf = np.zeros((chunk_len, num_timesteps, data.shape[2]))
+  for st_idx in range(0, data.shape[0], chunk_len):
+    end_idx = min(data.shape[0], st_idx+chunk_len)
+    out = buf[:end_idx-st_idx]
+    resample_timeslices(data[st_idx:end_idx], pos, mode=mode, out=out)
+    dset[st_idx:end_idx] = out
+  return dset
 
-def process_file(fname, time_interval, sleep_states, dataset, num_timesteps):
+def process_file(fname, time_interval, sleep_states, dataset):
   fh = h5py.File(fname, 'r')
   filename = os.path.basename(fname)
 
   x = np.array(fh['X'])
   y = np.array(fh['Y'])
   z = np.array(fh['Z'])
-  timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-  timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+  timestamp = read_timestamp(fh)
  
   # Get ENMO and acceleration angles
   ENMO = get_ENMO(x,y,z)
@@ -226,72 +183,140 @@ def process_file(fname, time_interval, sleep_states, dataset, num_timesteps):
   #################  Get raw data  ######################
 
   # Divide raw data and derived features based on time intervals
-  x_slices = get_timeslices(timestamp, x, time_interval)
-  y_slices = get_timeslices(timestamp, y, time_interval)
-  z_slices = get_timeslices(timestamp, z, time_interval)
-  ENMO_slices = get_timeslices(timestamp, ENMO, time_interval)
-  angz_slices = get_timeslices(timestamp, angle_z, time_interval)
-  LIDS_slices = get_timeslices(timestamp, LIDS, time_interval)
- 
+  # Data (num_epochs x num_timesteps x num_channels)
+  slices = get_epoch_slices(timestamp, [x, y, z, ENMO, angle_z, LIDS], time_interval)
 
   # Get raw data slices corresponding to valid labels
-  x_valid = x_slices[np.isin(label_agg, sleep_states)]
-  y_valid = y_slices[np.isin(label_agg, sleep_states)]
-  z_valid = z_slices[np.isin(label_agg, sleep_states)]
-  ENMO_valid = ENMO_slices[np.isin(label_agg, sleep_states)]
-  angz_valid = angz_slices[np.isin(label_agg, sleep_states)]
-  LIDS_valid = LIDS_slices[np.isin(label_agg, sleep_states)]
-  
-  # Reshape data and labels
-  # Data (num_samples x num_timesteps x num_channels)
-  num_samples = x_valid.shape[0]; num_tsteps = x_valid.shape[1]
-  x_valid = x_valid.reshape((num_samples, num_tsteps, 1))
-  y_valid = y_valid.reshape((num_samples, num_tsteps, 1))
-  z_valid = z_valid.reshape((num_samples, num_tsteps, 1))
-  ENMO_valid = ENMO_valid.reshape((num_samples, num_tsteps, 1))
-  angz_valid = angz_valid.reshape((num_samples, num_tsteps, 1))
-  LIDS_valid = LIDS_valid.reshape((num_samples, num_tsteps, 1))
-  raw_data = np.dstack((x_valid, y_valid, z_valid, ENMO_valid, angz_valid, LIDS_valid))
-
-  # Resample raw data to desired number of timesteps
-  raw_data = resample_timeslices(raw_data, num_timesteps)
+  raw_data = slices[np.isin(label_agg, sleep_states)]
 
   return df, raw_data
 
+# Merge per-file feature and raw data shards in the order of given files
+# Raw data is written either as compressed HDF5 file or as uncompressed,
+# memory-mappable tensor store with labels, users and timestamps (memmap)
+# Merged files are written to temporary files and moved in place when complete,
+# so an interrupted merge leaves no truncated output. Returns the merged files.
+def merge_shards(files, sharddir, outdir, time_interval, store_format='h5'):
+  feat_fname = os.path.join(outdir,'features_' + str(time_interval) + 's.csv')
+  raw_fname = os.path.join(outdir, 'rawdata_'+str(time_interval)+'s.h5')
+  with open(feat_fname + '.tmp', 'w') as out_fp:
+    for idx,fname in enumerate(files):
+      with open(os.path.join(sharddir, fname + '.csv'), 'r') as shard_fp:
+        header = shard_fp.readline()
+        if idx == 0:
+          out_fp.write(header)
+        shutil.copyfileobj(shard_fp, out_fp)
+  if store_format == 'memmap':
+    raw_fname = os.path.join(outdir, 'rawdata_'+str(time_interval)+'s.npz')
+    if not merge_store(files, sharddir, feat_fname + '.tmp', raw_fname):
+      raw_fname = None
+  else:
+    for idx,fname in enumerate(files):
+      with h5py.File(os.path.join(sharddir, fname), 'r') as shard_fp:
+        data = shard_fp['data'][:]
+      if idx == 0:
+        with h5py.File(raw_fname + '.tmp', 'w') as fp:
+          fp.create_dataset('data', data=data, compression='gzip', chunks=True,\
+                            maxshape=(None,data.shape[1],data.shape[2]))
+      else:
+        with h5py.File(raw_fname + '.tmp', 'a') as fp:
+          fp['data'].resize((fp['data'].shape[0] + data.shape[0]), axis=0)
+          fp['data'][-data.shape[0]:] = data
+    if files:
+      os.replace(raw_fname + '.tmp', raw_fname)
+    else:
+      raw_fname = None
+  os.replace(feat_fname + '.tmp', feat_fname)
+  return [feat_fname] + ([raw_fname] if raw_fname is not None else [])
+
+# Get key identifying the shards of given files as recorded in the manifest
+# and the merge format, so that merged files are only rebuilt when they change
+def get_merge_key(manifest, files, store_format):
+  entries = [(fname, manifest.entries[fname]['hash']) for fname in files]
+  return hashlib.sha1(json.dumps([entries, manifest.params, manifest.version, store_format]).encode()).hexdigest()
+
+# Merge raw data shards into a tensor store
+def merge_store(files, sharddir, feat_fname, store_fname):
+  shapes = []
+  for fname in files:
+    with h5py.File(os.path.join(sharddir, fname), 'r') as shard_fp:
+      shapes.append(shard_fp['data'].shape)
+  num_samples = sum(shape[0] for shape in shapes)
+  if num_samples == 0: # no files or no valid epochs - an empty file cannot be memory-mapped
+    print('No raw data samples in shards - tensor store not created')
+    return False
+  data = create_store(store_fname, (num_samples,) + shapes[0][1:])
+  offset = 0
+  for fname,shape in zip(files, shapes):
+    with h5py.File(os.path.join(sharddir, fname), 'r') as shard_fp:
+      data[offset:offset+shape[0]] = shard_fp['data'][:]
+    offset += shape[0]
+  meta = pd.read_csv(feat_fname, usecols=['timestamp','label','user','filename'], dtype=str)
+  finalize_store(store_fname, data, channels=['x','y','z','ENMO','angle_z','LIDS'], meta=meta)
+  return True
+
 def main(argv):
   indir = argv[0]
   time_interval = float(argv[1]) # time interval of feature aggregation in seconds
   num_timesteps = int(argv[2]) # number of timesteps in raw data (must not be below 30Hz)
   dataset = argv[3]
   outdir = argv[4]
+  resample_mode = argv[5] if len(argv) > 5 else 'random' # random, linear or mean
+  store_format = argv[6] if len(argv) > 6 else 'h5' # h5 or memmap
   
-  if not os.path.exists(outdir):
-    os.makedirs(outdir)
+  sharddir = os.path.join(outdir, 'shards_' + str(time_interval) + 's')
+  if not os.path.exists(sharddir):
+    os.makedirs(sharddir)
   
   # Sleep states
   sleep_states = ['Wake','NREM 1','NREM 2','NREM 3','REM','Nonwear']
   
-  samp = 0
-  files = os.listdir(indir)
+  # Skip files already processed with same content, parameters and code
+  src_files = [__file__] + [sys.modules[func.__module__].__file__ 
+                            for func in [get_epoch_stats, get_context_feat, get_LIDS, read_timestamp]]
+  manifest = Manifest(os.path.join(sharddir, 'manifest.json'),
+                      params={'time_interval': time_interval, 'num_timesteps': num_timesteps,
+                              'dataset': dataset, 'resample_mode': resample_mode},
+                      version=get_code_version(src_files))
+
+  files = sorted(os.listdir(indir))
+  manifest.prune(files)
   for idx,fname in enumerate(files):
+    if manifest.is_done(os.path.join(indir, fname)):
+      print('Skipping ' + fname + ' - already processed')
+      continue
     print('Processing ' + fname)
     
-    df, data = process_file(os.path.join(indir, fname), time_interval, sleep_states, dataset, num_timesteps)
-    fsamp = data.shape[0]
+    df, data = process_file(os.path.join(indir, fname), time_interval, sleep_states, dataset)
 
-    # Save features to CSV
-    if idx == 0:
-      df.to_csv(os.path.join(outdir,'features_' + str(time_interval) + 's.csv'),
-                sep=',', mode='w', index=False, header=True)
-      with h5py.File(os.path.join(outdir, 'rawdata_'+str(time_interval)+'s.h5'), 'w') as fp:
-        fp.create_dataset('data', data=data, compression='gzip', chunks=True,\
-                          maxshape=(None,data.shape[1],data.shape[2]))
-    else:
-      df.to_csv(os.path.join(outdir,'features_' + str(time_interval) + 's.csv'),
-                sep=',', mode='a', index=False, header=False)
-      with h5py.File(os.path.join(outdir, 'rawdata_'+str(time_interval)+'s.h5'), 'a') as fp:
-        fp['data'].resize((fp['data'].shape[0] + data.shape[0]), axis=0)
-        fp['data'][-data.shape[0]:] = data
+    # Save features and raw data of file to shards
+    # Write to temporary files first so that an interrupted run leaves no partial shard
+    feat_shard = os.path.join(sharddir, fname + '.csv')
+    raw_shard = os.path.join(sharddir, fname)
+    df.to_csv(feat_shard + '.tmp', sep=',', mode='w', index=False, header=True)
+    with h5py.File(raw_shard + '.tmp', 'w') as fp:
+      # Resample raw data to desired number of timesteps
+      write_resampled(fp, 'data', data, num_timesteps, mode=resample_mode)
+    os.replace(feat_shard + '.tmp', feat_shard)
+    os.replace(raw_shard + '.tmp', raw_shard)
+    manifest.update(os.path.join(indir, fname), [feat_shard, raw_shard])
+
+  # Merge shards into features and raw data files
+  # Shards are kept so that later runs only process new or changed files, and
+  # the merge is skipped if the merged files were built from the same shards
+  merge_fname = os.path.join(sharddir, 'merged_' + store_format + '.json')
+  merge_key = get_merge_key(manifest, files, store_format)
+  merged = {}
+  if os.path.exists(merge_fname):
+    with open(merge_fname, 'r') as fp:
+      merged = json.load(fp)
+  if merged.get('key') == merge_key and all(os.path.exists(out) for out in merged['outputs']):
+    print('Skipping merge - shards unchanged')
+    return
+  outputs = merge_shards(files, sharddir, outdir, time_interval, store_format=store_format)
+  with open(merge_fname + '.tmp', 'w') as fp:
+    json.dump({'key': merge_key, 'outputs': outputs}, fp, indent=2)
+  os.replace(merge_fname + '.tmp', merge_fname)
     
 if __name__ == "__main__":
   main(sys.argv[1:])
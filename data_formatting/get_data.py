@@ -3,6 +3,9 @@ import pandas as pd
 import h5py
 import numpy as np
 
+sys.path.append('../feature_engineering/')
+from tensor_store import is_store, open_store, load_store_header, create_store, finalize_store
+
 def main(argv):
   partition_file = argv[0]
   feat_file = argv[1]
@@ -21,11 +24,21 @@ def main(argv):
   feat_df = feat_df.reset_index(drop=True)
   feat_df.to_csv(os.path.join(outdir, fname), index=False)  
 
+  fname = os.path.basename(rawdata_file)
+  batchsz = 1000
+  if is_store(rawdata_file): # Write partition as tensor store
+    rawdata = open_store(rawdata_file)
+    header = load_store_header(rawdata_file)
+    out_fname = os.path.join(outdir, 'all_'+partition+'_'+fname)
+    data = create_store(out_fname, (len(indices),) + rawdata.shape[1:], dtype=rawdata.dtype)
+    for st_idx in range(0, len(indices), batchsz):
+      data[st_idx:st_idx+batchsz] = rawdata[indices[st_idx:st_idx+batchsz]]
+    finalize_store(out_fname, data, channels=header['channels'], meta=feat_df)
+    return
+
   fp = h5py.File(rawdata_file, 'r')
   rawdata = fp['data']
 
-  fname = os.path.basename(rawdata_file)
-  batchsz = 1000
   nbatches = len(indices)//batchsz
   if len(indices) % batchsz:
     nbatches += 1
@@ -0,0 +1,126 @@
+import numpy as np
+import h5py
+from collections import OrderedDict
+
+# Batch reader for (num_samples x seqlen x channels) arrays and HDF5 datasets
+# Indices of a batch are grouped into runs of consecutive samples and every
+# run is read with a single slice (one hyperslab selection for HDF5) instead
+# of indexing the dataset sample by sample. For chunked HDF5 datasets, the
+# decompressed chunks are kept in a bounded LRU cache so that samples from
+# the same chunk are not decompressed again by later batches.
+# Memory-mapped tensor stores are uncompressed and read without a cache.
+class BatchReader(object):
+  def __init__(self, data, cache_size=256*2**20):
+    'Initialization - cache_size is the maximum size of cached chunks in bytes'
+    self.data = data
+    self.shape = data.shape
+    self.dtype = data.dtype
+    self.chunk_len = None
+    chunks = getattr(data, 'chunks', None)
+    if chunks is not None and cache_size > 0:
+      self.chunk_len = chunks[0]
+      chunk_bytes = self.chunk_len * int(np.prod(self.shape[1:])) * self.dtype.itemsize
+      self.max_chunks = max(1, cache_size // chunk_bytes)
+    self.cache = OrderedDict()
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __getstate__(self):
+    'HDF5 datasets cannot be pickled and memory maps would be copied - store file names instead'
+    state = self.__dict__.copy()
+    state['cache'] = OrderedDict()
+    if isinstance(self.data, h5py.Dataset):
+      state['data'] = ('h5', self.data.file.filename, self.data.name)
+    elif isinstance(self.data, np.memmap):
+      state['data'] = ('memmap', self.data.filename, self.data.offset)
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    if isinstance(self.data, tuple):
+      self.data = self.open_data(*self.data)
+
+  def open_data(self, kind, filename, name):
+    'Open HDF5 dataset or memory map of given file'
+    if kind == 'h5':
+      return h5py.File(filename, 'r')[name]
+    return np.memmap(filename, mode='r', dtype=self.dtype, shape=self.shape, offset=name)
+
+  def reopen(self):
+    'Reopen HDF5 file or memory map, e.g. in a forked worker process, and clear cache'
+    if isinstance(self.data, h5py.Dataset):
+      self.data = self.open_data('h5', self.data.file.filename, self.data.name)
+    elif isinstance(self.data, np.memmap):
+      self.data = self.open_data('memmap', self.data.filename, self.data.offset)
+    self.cache = OrderedDict()
+
+  def get_runs(self, indices):
+    'Split sorted unique indices into runs of consecutive samples'
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(indices)]))
+    return starts, ends
+
+  def read_slice(self, st_idx, end_idx, n_channels, out):
+    'Read consecutive samples directly into out'
+    if hasattr(self.data, 'read_direct') and out.flags['C_CONTIGUOUS']:
+      self.data.read_direct(out, source_sel=np.s_[st_idx:end_idx,:,:n_channels])
+    else:
+      out[...] = self.data[st_idx:end_idx,:,:n_channels]
+
+  def load_chunks(self, chunk_ids):
+    'Read missing chunks, consecutive ones with one slice, and add them to cache'
+    missing = np.array([cid for cid in chunk_ids if cid not in self.cache], dtype=int)
+    if len(missing):
+      starts, ends = self.get_runs(missing)
+      for st,end in zip(starts, ends):
+        first = missing[st]
+        block = self.data[first*self.chunk_len:(missing[end-1]+1)*self.chunk_len]
+        for cid in missing[st:end]:
+          offset = (cid - first) * self.chunk_len
+          chunk = block[offset:offset+self.chunk_len]
+          # Copy so that evicting a chunk frees its memory
+          self.cache[cid] = chunk.copy() if end - st > 1 else chunk
+    for cid in chunk_ids:
+      self.cache.move_to_end(cid)
+    while len(self.cache) > max(self.max_chunks, len(chunk_ids)):
+      self.cache.popitem(last=False)
+
+  def read_sorted(self, indices, n_channels, out):
+    'Read sorted unique indices into out'
+    starts, ends = self.get_runs(indices)
+    if self.chunk_len is None:
+      for st,end in zip(starts, ends):
+        self.read_slice(indices[st], indices[end-1]+1, n_channels, out[st:end])
+      return out
+    chunk_ids = np.unique(indices // self.chunk_len)
+    self.load_chunks(chunk_ids)
+    for st,end in zip(starts, ends):
+      # Split run at chunk boundaries
+      pos = st
+      while pos < end:
+        cid = indices[pos] // self.chunk_len
+        offset = indices[pos] - cid * self.chunk_len
+        num = min(end - pos, self.chunk_len - offset)
+        out[pos:pos+num] = self.cache[cid][offset:offset+num,:,:n_channels]
+        pos += num
+    return out
+
+  def read(self, indices, n_channels=None, out=None):
+    'Read samples at given indices (any order) as (len(indices) x seqlen x n_channels)'
+    indices = np.asarray(indices, dtype=int)
+    if n_channels is None:
+      n_channels = self.shape[2]
+    if out is None:
+      out = np.zeros((len(indices), self.shape[1], n_channels), dtype=self.dtype)
+    if len(indices) == 0:
+      return out
+    if (np.diff(indices) > 0).all():
+      return self.read_sorted(indices, n_channels, out)
+    # Unsorted or repeated indices - read each sample once and gather
+    uniq, inverse = np.unique(indices, return_inverse=True)
+    samples = self.read_sorted(uniq, n_channels,
+                               np.zeros((len(uniq), self.shape[1], n_channels), dtype=out.dtype))
+    out[...] = samples[inverse]
+    return out
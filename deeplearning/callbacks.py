@@ -1,12 +1,15 @@
 import numpy as np
 from sklearn.metrics import precision_recall_fscore_support
 from tensorflow.keras.callbacks import Callback
+from inference import InferenceEngine
 
 # Use custom callback for F1-score, precision and recall
 class Metrics(Callback):
-  def __init__(self, val_data, batch_size=32):
+  def __init__(self, val_data, batch_size=32, inference_batch_size=1024):
     self.validation_data = val_data # validation generator  
     self.batch_size = batch_size
+    self.inference_batch_size = inference_batch_size
+    self.engine = None
     self.val_precision = []
     self.val_recall = []
     self.val_f1 = []
@@ -17,21 +20,12 @@ class Metrics(Callback):
     self.val_f1 = []
  
   # Get predictions given a data generator
+  # Validation samples are read once and cached by the inference engine
   def get_predictions(self, datagen):
-    batches = len(datagen)
-    nsamples = batches * self.batch_size
-    y_true = np.zeros((nsamples,))
-    y_pred = np.zeros((nsamples,))
-    actual_nsamples = 0
-    for batch in range(batches):
-      x, y = datagen[batch]
-      end_idx = batch * self.batch_size + y.shape[0]
-      y_pred[batch * self.batch_size : end_idx] = self.model.predict(x).argmax(axis=1)
-      y_true[batch * self.batch_size : end_idx] = y.argmax(axis=1)
-      actual_nsamples += y.shape[0]
-    y_true = y_true[:actual_nsamples]
-    y_pred = y_pred[:actual_nsamples]
-    return y_true, y_pred
+    if self.engine is None or self.engine.datagen is not datagen:
+      self.engine = InferenceEngine(datagen, batch_size=self.inference_batch_size)
+    y_true, probs = self.engine.predict([self.model])
+    return y_true, probs[0].argmax(axis=1)
 
   def on_epoch_end(self, epoch, logs=None):
     # Get predictions on validation data
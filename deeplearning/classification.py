@@ -30,6 +30,10 @@ from hypermodel import ResnetHyperModel
 from resnet import Resnet
 from tuner import CVTuner
 from datagenerator import DataGenerator
+from sampler import BalancedSampler
+from batch_reader import BatchReader
+from prefetch import PrefetchGenerator
+from inference import InferenceEngine
 from transforms import get_LIDS
 from metrics import macro_f1
 from callbacks import Metrics, BatchRenormScheduler
@@ -38,6 +42,11 @@ from losses import focal_loss, weighted_categorical_crossentropy, train_val_loss
 sys.path.append('../analysis/')
 from analysis import cv_save_classification_result, cv_get_classification_report
 
+sys.path.append('../feature_engineering/')
+from feature_store import load_features
+from running_stats import get_cached_stats
+from tensor_store import is_store, open_store
+
 np.random.seed(2)
 
 # Limit GPU memory allocated
@@ -124,6 +133,12 @@ def main(argv):
   hp_epochs = args.hp_epochs # No. of hyperparameter validation epochs
   lr = args.lr # Learning rate
   batchsize = args.batchsize # Batch size
+  prefetch_workers = args.prefetch_workers # Worker processes for training batches
+  seed = args.seed # Seed for reproducible training batches
+  if prefetch_workers > 0 and seed is None:
+    seed = np.random.randint(2**31)
+  # Sampler of balanced training batches - equal class sizes unless temperature is given
+  sampler = BalancedSampler(num_classes, temperature=args.sampling_temperature)
 
   resultdir = os.path.join(outdir,mode,'lr-{:4f}_batchsize-{:d}'.format(lr, batchsize))
   if not os.path.exists(resultdir):
@@ -135,8 +150,10 @@ def main(argv):
   model_hyperparam['dropout'] = [0.1, 0.2, 0.3]
   model_hyperparam['lr'] = [1e-3, 1e-4]
 
-  # Read data from disk
-  data = pd.read_csv(os.path.join(indir,'all_train_features_30.0s.csv'))
+  # Read data from disk - only the columns needed for partitioning
+  # Rows must stay aligned with the raw data file, so the CSV is used here
+  data = load_features(os.path.join(indir,'all_train_features_30.0s.csv'),
+                       columns=['timestamp','filename','label','user','ENMO_mean','ENMO_std','ENMO_mad'])
   ts = data['timestamp']
   fnames = data['filename']
   labels = data['label']
@@ -160,15 +177,26 @@ def main(argv):
   y = labels[valid_indices]
   groups = users[valid_indices]
 
-  # Read raw data
-  fp = h5py.File(os.path.join(indir, 'all_train_rawdata_30.0s.h5'), 'r')
-  raw_data = fp['data']
+  # Read raw data - memory-mapped tensor store if present, else HDF5 file
+  raw_fname = os.path.join(indir, 'all_train_rawdata_30.0s.npz')
+  if not is_store(raw_fname):
+    raw_fname = os.path.join(indir, 'all_train_rawdata_30.0s.h5')
+  if is_store(raw_fname):
+    raw_data = open_store(raw_fname)
+  else:
+    fp = h5py.File(raw_fname, 'r')
+    raw_data = fp['data']
   [num_samples, seqlen, n_channels] = raw_data.shape
+  # Read batches with contiguous slices and share chunk cache among generators
+  raw_data = BatchReader(raw_data)
 
-  # Read raw data statistics
-  stats = np.load(os.path.join(modeldir, "stats.npz"))
-  mean = stats['mean']
-  std = stats['std']
+  # Read raw data statistics - if not present with the pretrained model, they
+  # are computed for every outer fold over its training samples only (see below)
+  model_stats = os.path.exists(os.path.join(modeldir, "stats.npz"))
+  if model_stats:
+    stats = np.load(os.path.join(modeldir, "stats.npz"))
+    mean = stats['mean']
+    std = stats['std']
 
   # Use nested cross-validation based on users
   # Outer CV
@@ -185,6 +213,13 @@ def main(argv):
     out_fold_users_train = users[out_fold_train_indices]; out_fold_users_test = users[out_fold_test_indices]
     out_fold_ts_test = ts[out_fold_test_indices]
     out_fold_fnames_test = fnames[out_fold_test_indices]
+    if not model_stats:
+      # Statistics over training samples of the fold, so that test users do not
+      # influence normalization - cached in the input directory by fold indices
+      stats = get_cached_stats(raw_fname, 'data', indices=out_fold_train_indices,
+                               n_channels=num_channels+feat_channels, cache_dir=indir, workers=args.stats_workers)
+      mean = stats.mean
+      std = stats.std
 
     # Build a hypermodel for hyperparam search
     hyperModel = ResnetHyperModel(hyperparam=model_hyperparam, seqlen=seqlen,\
@@ -195,7 +230,7 @@ def main(argv):
                     oracle=kerastuner.oracles.Hyperband(objective='val_loss', max_epochs=3),
                     cv=inner_cv_splits, states=states, num_classes=num_classes,
                     seqlen=seqlen, num_channels=num_channels, feat_channels=feat_channels,
-                    mean=mean, std=std)
+                    mean=mean, std=std, sampler=sampler)
     # Use a subset of training data for hyperparam search
 #    train_users = list(set(out_fold_users_train))
 #    random.shuffle(train_users)
@@ -231,25 +266,33 @@ def main(argv):
     train_gen = DataGenerator(out_fold_train_indices, raw_data, labels, states, partition='train',\
                           batch_size=batchsize, seqlen=seqlen, n_channels=num_channels, feat_channels=feat_channels,\
                           n_classes=num_classes, shuffle=True, augment=True, aug_factor=0.75, balance=True,
-                          mean=mean, std=std)
+                          mean=mean, std=std, seed=seed, sampler=sampler, sparse=True)
     val_gen = DataGenerator(out_fold_val_indices, raw_data, labels, states, partition='val',\
                         batch_size=batchsize, seqlen=seqlen, n_channels=num_channels, feat_channels=feat_channels,\
-                        n_classes=num_classes, mean=mean, std=std)
+                        n_classes=num_classes, mean=mean, std=std, sparse=True)
     test_gen = DataGenerator(out_fold_test_indices, raw_data, labels, states, partition='test',\
                         batch_size=batchsize, seqlen=seqlen, n_channels=num_channels, feat_channels=feat_channels,\
-                        n_classes=num_classes, mean=mean, std=std)
+                        n_classes=num_classes, mean=mean, std=std, sparse=True)
 
     # Use callback to compute F-scores over entire validation data
-    metrics_cb = Metrics(val_data=val_gen, batch_size=batchsize)
+    metrics_cb = Metrics(val_data=val_gen, batch_size=batchsize, inference_batch_size=args.inference_batchsize)
     # Use early stopping and model checkpoints to handle overfitting and save best model
     model_checkpt = ModelCheckpoint(os.path.join(resultdir,'fold'+str(out_fold)+'_'+mode+'-{epoch:02d}-{val_f1:.4f}.h5'),\
                                                  monitor='val_f1',\
                                                  mode='max', save_best_only=True)
     batch_renorm_cb = BatchRenormScheduler(len(train_gen))
-    history = model.fit(train_gen, epochs=num_epochs, validation_data=val_gen, 
+    if prefetch_workers > 0: # Generate training batches in worker processes
+      train_data = PrefetchGenerator(train_gen, workers=prefetch_workers, prefetch=args.prefetch)
+      workers = 1
+    else:
+      train_data = train_gen
+      workers = 2
+    history = model.fit(train_data, epochs=num_epochs, validation_data=val_gen, 
                         verbose=1, shuffle=False,
                         callbacks=[batch_renorm_cb, metrics_cb, model_checkpt],
-                        workers=2, max_queue_size=20, use_multiprocessing=False)
+                        workers=workers, max_queue_size=20, use_multiprocessing=False)
+    if prefetch_workers > 0:
+      train_data.close()
 
     # Plot training history
     plot_results(out_fold+1, history.history['loss'], history.history['val_loss'],\
@@ -263,7 +306,8 @@ def main(argv):
     best_model_file, epoch, val_f1 = get_best_model(resultdir, out_fold)
     print('Predicting with model saved at Epoch={:d} with val_f1={:0.4f}'.format(epoch, val_f1))
     model.load_weights(os.path.join(resultdir,best_model_file))
-    probs = model.predict(test_gen)
+    # Stream test samples once in large batches
+    _, probs = InferenceEngine(test_gen, batch_size=args.inference_batchsize).predict_mean([model])
     y_pred = probs.argmax(axis=1)
     y_true = out_fold_y_test
     predictions.append((users[test_indices], data.iloc[test_indices]['timestamp'], 
@@ -293,5 +337,12 @@ if __name__ == "__main__":
   parser.add_argument('--hp_iter', type=int, default=10, help='#hyperparameter iterations')        
   parser.add_argument('--hp_epochs', type=int, default=2, help='#hyperparam validation epochs')        
   parser.add_argument('--batchsize', type=int, default=64, help='batch size range')        
+  # Input pipeline
+  parser.add_argument('--inference_batchsize', type=int, default=1024, help='batch size for validation and test predictions')
+  parser.add_argument('--prefetch_workers', type=int, default=0, help='#worker processes generating training batches (0 - use threads)')
+  parser.add_argument('--prefetch', type=int, default=4, help='#training batches generated ahead')
+  parser.add_argument('--seed', type=int, default=None, help='seed for reproducible training batches')
+  parser.add_argument('--stats_workers', type=int, default=1, help='#worker processes computing raw data statistics')
+  parser.add_argument('--sampling_temperature', type=float, default=None, help='temperature of class sampling for training batches (default - balanced)')
   args = parser.parse_args()
   main(args)
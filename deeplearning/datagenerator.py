@@ -1,3 +1,4 @@
+import sys,os
 import numpy as np
 from tensorflow.keras.utils import Sequence, to_categorical
 import random
@@ -5,17 +6,25 @@ from tqdm import tqdm
 from transforms import jitter, time_warp, rotation, rand_sampling
 from transforms import get_ENMO, get_angle_z, get_LIDS
 from collections import Counter
+from batch_reader import BatchReader
+from sampler import BalancedSampler, group_by_class
+
+sys.path.append('../feature_engineering/')
+from running_stats import RunningStats, get_stats_key
 
 class DataGenerator(Sequence):
   def __init__(self, indices, data, labels, classes, partition=None, batch_size=32, seqlen=100, n_channels=3,
                n_classes=5, feat_channels=0, shuffle=False, augment=False, aug_factor=0.0, balance=False,
-               mean=None, std=None):
+               mean=None, std=None, seed=None, sampler=None, dtype=np.float32, sparse=False,
+               reuse_buffers=False):
     'Initialization'
     self.partition = partition
     self.seqlen = seqlen
     self.batch_size = batch_size
     self.indices = indices
-    self.data = data
+    self.orig_indices = np.array(indices)
+    # Reader for batched reads - can be shared by generators over same data
+    self.reader = data if isinstance(data, BatchReader) else BatchReader(data)
     self.labels = labels
     self.classes = classes
     self.n_channels = n_channels
@@ -27,9 +36,27 @@ class DataGenerator(Sequence):
       self.aug_factor = aug_factor
     self.aug_func = [jitter, time_warp, rotation, rand_sampling]
     self.balance = balance
+    # Sampler of balanced minibatches with class pools built from indices
+    self.sampler = None
+    if self.balance == True:
+      if sampler is None:
+        sampler = BalancedSampler(n_classes)
+      self.sampler = sampler.clone().fit(self.orig_indices, self.labels)
     self.feat_channels = feat_channels
     self.mean = mean
     self.std = std
+    self.dtype = dtype
+    # Return integer labels for sparse losses instead of one-hot labels
+    self.sparse = sparse
+    # If reuse_buffers is set, batches are generated in preallocated arrays that
+    # are overwritten by the next batch - only for consumers that are done with
+    # a batch before requesting the next one (e.g. prefetch worker processes)
+    self.reuse_buffers = reuse_buffers
+    self.buffers = {}
+    # If seed is given, shuffling and every batch are reproducible irrespective
+    # of the order in which batches are generated (e.g. by parallel workers)
+    self.seed = seed
+    self.epoch = -1
     self.on_epoch_end()
 
   def __len__(self):
@@ -39,8 +66,20 @@ class DataGenerator(Sequence):
       nbatches += 1
     return nbatches
 
+  def get_buffer(self, name, shape):
+    'Get array for batch data, preallocated and reused if reuse_buffers is set'
+    if self.reuse_buffers == False:
+      return np.empty(shape, dtype=self.dtype)
+    buf = self.buffers.get(name)
+    if buf is None or buf.shape[0] < shape[0] or buf.shape[1:] != shape[1:]:
+      buf = self.buffers[name] = np.empty(shape, dtype=self.dtype)
+    return buf[:shape[0]]
+
   def __getitem__(self, index):
     'Generate one batch of data'
+    if self.seed is not None:
+      np.random.seed([self.seed, self.epoch, index])
+      random.seed(np.random.randint(2**31))
     if self.augment == True:
       assert self.aug_factor > 0.0
     aug_factor = 1.0 + self.aug_factor
@@ -53,19 +92,9 @@ class DataGenerator(Sequence):
       else:
         end_idx = len(self.indices)
       indices = self.indices[st_idx:end_idx]
-    else: # Balance each minibatch to have same number of classes
-      cls_sz = int((self.batch_size / aug_factor) // self.n_classes)
-      if cls_sz * aug_factor * self.n_classes < self.batch_size:
-        cls_sz += 1
-      # Generate indices with balanced classes
-      indices = []
-      for cls in range(len(self.classes)):
-        cls_idx = self.indices[self.labels[self.indices] == cls]
-        indices.extend(np.random.choice(cls_idx,cls_sz,replace=False))
-      # Choose batch sized indices
-      random.shuffle(indices)
-      indices = np.array(indices[:orig_sz])
-      
+    else: # Balance each minibatch using class pools of sampler
+      indices = self.sampler.sample(orig_sz, index)
+
     # Generate data
     X, y = self.__data_generation__(np.sort(indices))
     return X, y
@@ -75,17 +104,20 @@ class DataGenerator(Sequence):
     # X : (n_samples, *dim, n_channels)
     n_channels = self.n_channels + self.feat_channels
     if self.augment == True:
-      # Initialization
-      X = np.zeros((self.batch_size, self.seqlen, n_channels))
+      # Initialization - every sample is filled below
+      X = self.get_buffer('samples', (self.batch_size, self.seqlen, n_channels))
       y = np.ones((self.batch_size), dtype=int) * -1
   
       # Get number of samples per class after augmentation
-      aug_factor = 1.0 + self.aug_factor
-      cls_sz = self.batch_size // self.n_classes
+      if self.sampler is not None:
+        cls_sz = self.sampler.get_class_sizes(self.batch_size)
+      else:
+        cls_sz = [self.batch_size // self.n_classes] * self.n_classes
+      batch_cls_indices = group_by_class(indices, self.labels, self.n_classes)
       # number of samples from disk for each class
-      samp_sz = [min(cls_sz, len(indices[self.labels[indices] == cls])) for cls in range(self.n_classes)]
+      samp_sz = [min(cls_sz[cls], len(batch_cls_indices[cls])) for cls in range(self.n_classes)]
       # number of samples to be augmented for each class
-      aug_sz = [cls_sz - samp_sz[cls] for cls in range(self.n_classes)]
+      aug_sz = [cls_sz[cls] - samp_sz[cls] for cls in range(self.n_classes)]
       sum_samp = sum(samp_sz) + sum(aug_sz)
       if sum_samp < self.batch_size:
         # Add more augmentation to smallest class
@@ -102,18 +134,16 @@ class DataGenerator(Sequence):
       offset = 0
       for cls in range(self.n_classes):
         # Load data from disk
-        cls_indices = indices[self.labels[indices] == cls][:samp_sz[cls]]
-        for i, idx in enumerate(cls_indices):
-          X[offset+i] = self.data[idx,:,:n_channels]
-          y[offset+i] = self.labels[idx]
+        cls_indices = batch_cls_indices[cls][:samp_sz[cls]]
+        self.reader.read(cls_indices, n_channels, out=X[offset:offset+len(cls_indices)])
+        y[offset:offset+len(cls_indices)] = self.labels[cls_indices]
         # Choose a subset of samples to apply transformations for augmentation
         if aug_sz[cls] > 0:
           N = len(cls_indices)
           aug_indices = np.random.choice(cls_indices, aug_sz[cls], replace=True)
-          aug_x = np.zeros((aug_sz[cls], self.seqlen, self.n_channels))
-          for i,idx in enumerate(aug_indices):
-            y[offset+N+i] = self.labels[idx]
-            aug_x[i,] = self.data[idx,:,:self.n_channels]
+          y[offset+N:offset+N+aug_sz[cls]] = self.labels[aug_indices]
+          aug_x = self.reader.read(aug_indices, self.n_channels,
+                                   out=np.zeros((aug_sz[cls], self.seqlen, self.n_channels)))
           # Apply one or two transformations to x,y,z of the chosen data
           aug_x = random.choice(self.aug_func)(aug_x)
           toss = random.choice([0,1])
@@ -132,39 +162,64 @@ class DataGenerator(Sequence):
       # Shuffle original and augmented data
       idx = np.arange(self.batch_size)
       np.random.shuffle(idx)
-      X = X[idx]
+      X = np.take(X, idx, axis=0, out=self.get_buffer('batch', X.shape))
       y = y[idx]
     else: 
       # Initialization
-      X = np.zeros((len(indices), self.seqlen, n_channels))
-      y = np.ones((len(indices)), dtype=int) * -1
-      for i, idx in enumerate(indices):
-        X[i] = self.data[idx,:,:n_channels]
-        y[i] = self.labels[idx]
+      X = self.get_buffer('batch', (len(indices), self.seqlen, n_channels))
+      self.reader.read(indices, n_channels, out=X)
+      y = np.array(self.labels[indices], dtype=int)
 
-    # Normalize data if mean and std are present
+    # Normalize data in place if mean and std are present
     if self.mean is not None and self.std is not None:
-      X = (X - self.mean) / self.std
+      X -= self.mean
+      X /= self.std
 
+    if self.sparse == True:
+      return X, y
     return X, to_categorical(y, num_classes=self.n_classes)
   
   def on_epoch_end(self):
     'Updates indexes after each epoch'
+    self.set_epoch(self.epoch + 1)
+
+  def set_epoch(self, epoch):
+    'Set epoch and shuffle indices for it'
+    self.epoch = epoch
+    if self.sampler is not None:
+      self.sampler.set_epoch(epoch, self.seed)
     if self.shuffle == True:
-      np.random.shuffle(self.indices)
+      if self.seed is None:
+        np.random.shuffle(self.indices)
+      else:
+        rng = np.random.RandomState([self.seed, epoch])
+        self.indices = self.orig_indices[rng.permutation(len(self.orig_indices))]
 
-  def fit(self, frac=1.0):
+  def fit(self, frac=1.0, cache_dir=None):
     'Get mean and standard deviation for training data'
     assert 'stat' in self.partition
-    samp_sum = np.zeros((self.seqlen, self.n_channels + self.feat_channels))
-    samp_sqsum = np.zeros((self.seqlen, self.n_channels + self.feat_channels))
+    # Load statistics saved by a previous run with same data and parameters
+    cache_file = None
+    data = self.reader.data
+    if cache_dir is not None and hasattr(data, 'file'):
+      key = get_stats_key(data.file.filename, data.name, self.orig_indices, frac=frac,
+                          batch_size=self.batch_size, n_channels=self.n_channels, feat_channels=self.feat_channels,
+                          augment=self.augment, aug_factor=self.aug_factor, balance=self.balance, seed=self.seed)
+      cache_file = os.path.join(cache_dir, 'stats_' + key + '.npz')
+      if os.path.exists(cache_file):
+        stats = RunningStats.load(cache_file)
+        self.mean = stats.mean; self.std = stats.std
+        return self.mean, self.std
+    # Batches must not be normalized while computing statistics
+    self.mean = None; self.std = None
+    stats = RunningStats()
     N = int(frac*len(self)) # Get statistics using just a fraction of data
-    nsamp = N*self.batch_size
     for i in tqdm(range(N)):
       X,y = self[i]
-      samp_sum += X.sum(axis=0)
-      samp_sqsum += (X**2).sum(axis=0)
-    self.mean = samp_sum/nsamp
-    self.std = np.sqrt(samp_sqsum/nsamp - self.mean**2)
+      stats.update(X)
+    if cache_file is not None:
+      stats.save(cache_file)
+    self.mean = stats.mean
+    self.std = stats.std
 
     return self.mean, self.std
@@ -2,7 +2,12 @@ import sys,os
 import numpy as np
 import pandas as pd
 import h5py, math
-from collections import Counter
+
+sys.path.append('../feature_engineering/')
+from epoch_stats import get_epochs, get_epoch_categ, get_epoch_slices
+from timestamp_io import read_timestamp
+from epoch_shards import ShardWriter
+from lids import get_LIDS
 
 # Get Euclidean Norm minus One
 def get_ENMO(x,y,z):
@@ -17,67 +22,24 @@ def get_tilt_angles(x,y,z):
   angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
   return angle_x, angle_y, angle_z
 
-# Get Locomotor Inactivity During Sleep   
-def get_LIDS(timestamp, ENMO):
-  df = pd.concat((timestamp, pd.Series(ENMO)), axis=1)
-  df.columns = ['timestamp','ENMO']
-  df.set_index('timestamp', inplace=True)
-  
-  df['ENMO_sub'] = np.where(ENMO < 0.02, 0, ENMO-0.02) # assuming ENMO is in g
-  # 10-minute rolling sum
-  ENMO_sub_smooth = df['ENMO_sub'].rolling('600s').sum()
-  df['LIDS_unfiltered'] = 100.0 / (ENMO_sub_smooth + 1.0)
-  # 30-minute rolling average
-  LIDS = df['LIDS_unfiltered'].rolling('1800s').mean().values
-  return LIDS
-
-def get_categ(df, default='NaN'):
-  if len(df) == 0:
-    print('zero length')
-    return default
-  ctr = Counter(df)
-  for key in ctr:
-    ctr[key] = ctr[key]/float(len(df))
-  dom_categ = ctr.most_common()[0]
-  if dom_categ[1] >= 0.7: # If a category occurs more than 70% of time interval, mark that as dominant category
-    dom_categ = dom_categ[0]
-  else:
-    dom_categ = default
-  return dom_categ
-    
 def get_dominant_categ(timestamp, categ, time_interval, default='NaN'):
-  categ_df = pd.DataFrame(data={'timestamp':timestamp, 'category':categ})
-  categ_df.set_index('timestamp', inplace=True)
-  dom_categ = categ_df.resample(str(time_interval)+'S').apply(get_categ, default=default)
-  return pd.Series(dom_categ['category'])[1:-1]   
-
-def get_tslice(df):
-  tslice = np.array(df['channel'])
-  return tslice
+  epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+  dom_categ = get_epoch_categ(categ, epoch_idx, len(epoch_start), default=default)
+  return pd.Series(dom_categ, index=pd.DatetimeIndex(epoch_start, name='timestamp'), name='category')[1:-1]
 
-def get_timeslices(timestamp, channel, time_interval):
-  chan_df = pd.DataFrame(data={'timestamp':timestamp, 'channel':channel})
-  chan_df.set_index('timestamp', inplace=True)
-  chan_slices = chan_df.resample(str(time_interval)+'S').apply(get_tslice)
-  lengths = [tslice.shape[0] for tslice in chan_slices]
-  resize_len = int(np.median(lengths))
-  for tslice in chan_slices:
-    tslice.resize((resize_len), refcheck=False) 
-  slices = np.stack(chan_slices)
+# Get raw data of every epoch together with previous and next epochs
+# Returns ((num_epochs-2) x 3*num_timesteps x num_channels)
+def get_timeslices(timestamp, channels, time_interval):
+  slices = get_epoch_slices(timestamp, channels, time_interval)
   # Use previous and next time intervals along with current intervals
-  nsamples, timesteps = slices.shape
-  prevnext_slices = np.zeros((nsamples-2, timesteps*3))
-  for i in range(1, nsamples-2):
-    prevnext_slices[i-1,:timesteps] = slices[i-1] # previous interval
-    prevnext_slices[i-1,timesteps:2*timesteps] = slices[i] # current interval
-    prevnext_slices[i-1,2*timesteps:] = slices[i+1] # next interval
-  return prevnext_slices
+  return np.concatenate((slices[:-2], slices[1:-1], slices[2:]), axis=1)
 
 def main(argv):
   indir = argv[0]
   time_interval = float(argv[1])
   dataset = argv[2]
   outdir = argv[3]
+  out_format = argv[4] if len(argv) > 4 else 'npy' # npy (one file per epoch) or shards (see epoch_shards.py)
  
   if not os.path.exists(outdir):
     os.makedirs(outdir)
@@ -86,6 +48,9 @@ def main(argv):
 
   lbl_fp = open(os.path.join(outdir,'labels.txt'),'w')
   lbl_fp.write('filename\tlabels\tuser\n')
+  # Epochs are written either to one .npy file each, as read by the mcfly
+  # DataGenerator, or to shards that can be unpacked with epoch_shards.py --unpack
+  writer = ShardWriter(outdir) if out_format == 'shards' else None
 
   files = os.listdir(indir)
   for fname in files:
@@ -95,8 +60,7 @@ def main(argv):
     x = np.array(fh['X'])
     y = np.array(fh['Y'])
     z = np.array(fh['Z'])
-    timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-    timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+    timestamp = read_timestamp(fh)
 
     # Get transformations
     ENMO = get_ENMO(x,y,z)
@@ -122,32 +86,13 @@ def main(argv):
           
     # Get data slices and dominant labels/nonwear for given time interval
     label_agg = get_dominant_categ(timestamp, label, time_interval)
-    x_slices = get_timeslices(timestamp, x, time_interval)
-    y_slices = get_timeslices(timestamp, y, time_interval)
-    z_slices = get_timeslices(timestamp, z, time_interval)
-    ENMO_slices = get_timeslices(timestamp, ENMO, time_interval)
-    angz_slices = get_timeslices(timestamp, angz, time_interval)
-    LIDS_slices = get_timeslices(timestamp, LIDS, time_interval)
+    # Data (num_samples x num_timesteps x num_channels)
+    slices = get_timeslices(timestamp, [x, y, z, ENMO, angz, LIDS], time_interval)
     
     # Get only values corresponding to valid labels
-    x_valid = x_slices[label_agg.isin(sleep_states)]
-    y_valid = y_slices[label_agg.isin(sleep_states)]
-    z_valid = z_slices[label_agg.isin(sleep_states)]
-    ENMO_valid = ENMO_slices[label_agg.isin(sleep_states)]
-    angz_valid = angz_slices[label_agg.isin(sleep_states)]
-    LIDS_valid = LIDS_slices[label_agg.isin(sleep_states)]
+    data = slices[label_agg.isin(sleep_states).values]
     label_valid = label_agg[label_agg.isin(sleep_states)]
-
-    # Reshape data and labels
-    # Data (num_samples x num_timesteps x num_channels)
-    num_samples = x_valid.shape[0]; num_timesteps = x_valid.shape[1]
-    x_valid = x_valid.reshape((num_samples, num_timesteps, 1))
-    y_valid = y_valid.reshape((num_samples, num_timesteps, 1))
-    z_valid = z_valid.reshape((num_samples, num_timesteps, 1))
-    ENMO_valid = ENMO_valid.reshape((num_samples, num_timesteps, 1))
-    angz_valid = angz_valid.reshape((num_samples, num_timesteps, 1))
-    LIDS_valid = LIDS_valid.reshape((num_samples, num_timesteps, 1))
-    data = np.dstack((x_valid, y_valid, z_valid, ENMO_valid, angz_valid, LIDS_valid))
+    num_samples = data.shape[0]
     
     # Save data, labels and other info to file    
     # PSGNewcastle2015 data
@@ -165,13 +110,19 @@ def main(argv):
         dataset = 'AMC'
         
     out_fname_path = fname.split('.h5')[0]
+    out_fnames = [out_fname_path + '_' + str(k) for k in range(num_samples)]
+    if writer is not None:
+      # Skip epochs already in shards
+      new_idx = [k for k in range(num_samples) if out_fnames[k] not in writer]
+      writer.write([out_fnames[k] for k in new_idx], data[new_idx])
+    else:
+      for k in range(num_samples):
+        np.save(os.path.join(outdir,out_fnames[k]), data[k])
     for k in range(num_samples):
-      out_fname = out_fname_path + '_' + str(k)
-      if os.path.exists(os.path.join(outdir,out_fname)):
-        continue
-      np.save(os.path.join(outdir,out_fname), data[k])
-      lbl_fp.write('{}\t{}\t{}\n'.format(out_fname,label_valid[k],user))
+      lbl_fp.write('{}\t{}\t{}\n'.format(out_fnames[k],label_valid[k],user))
 
+  if writer is not None:
+    writer.close()
   lbl_fp.close()
 
 if __name__ == "__main__":
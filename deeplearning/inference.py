@@ -0,0 +1,59 @@
+import numpy as np
+
+# Inference engine that streams the samples of a data generator once in large
+# fixed-size batches and evaluates all given models (e.g. fold models or
+# checkpoints) on every batch, so samples are read and normalized once for all
+# models instead of once per model. Normalized batches are kept in memory up
+# to cache_size bytes, so that repeated evaluation (e.g. on validation data
+# after every epoch) does not read the data again.
+class InferenceEngine(object):
+  def __init__(self, datagen, batch_size=1024, cache_size=2*2**30):
+    'Initialization - datagen must not augment or balance batches'
+    assert datagen.augment == False and datagen.balance == False
+    self.datagen = datagen
+    self.batch_size = batch_size
+    self.cache_size = cache_size
+    self.cache = None
+
+  def __len__(self):
+    return len(self.datagen.indices)
+
+  def get_batches(self):
+    'Generate batches of samples and integer labels in order of generator indices'
+    if self.cache is not None:
+      for X, y in self.cache:
+        yield X, y
+      return
+    cache = []; cache_bytes = 0
+    indices = np.asarray(self.datagen.indices)
+    for st_idx in range(0, len(indices), self.batch_size):
+      X, y = self.datagen.__data_generation__(indices[st_idx:st_idx+self.batch_size])
+      y = y if y.ndim == 1 else y.argmax(axis=1)
+      if cache is not None:
+        cache_bytes += X.nbytes
+        if cache_bytes <= self.cache_size:
+          cache.append((X.copy() if self.datagen.reuse_buffers else X, y))
+        else: # data does not fit in cache
+          cache = None
+      yield X, y
+    self.cache = cache
+
+  def predict(self, models):
+    'Get labels and probabilities of every model (num_models x num_samples x num_classes)'
+    y_true = np.zeros((len(self),), dtype=int)
+    probs = None
+    offset = 0
+    for X, y in self.get_batches():
+      y_true[offset:offset+len(y)] = y
+      for i, model in enumerate(models):
+        batch_probs = np.asarray(model.predict_on_batch(X))
+        if probs is None:
+          probs = np.zeros((len(models), len(self), batch_probs.shape[1]), dtype=np.float32)
+        probs[i, offset:offset+len(y)] = batch_probs
+      offset += len(y)
+    return y_true, probs
+
+  def predict_mean(self, models):
+    'Get labels and probabilities averaged over models'
+    y_true, probs = self.predict(models)
+    return y_true, probs.mean(axis=0)
@@ -1,4 +1,8 @@
 import tensorflow.keras.backend as K
+from metrics import get_dense_labels
+
+# Losses accept one-hot labels or integer labels (sparse), which are converted
+# to one-hot on the device instead of in the data generator
 
 def train_val_loss(weights, gamma=2.0, alpha=1.0):
   weights = K.variable(weights)
@@ -6,6 +10,7 @@ def train_val_loss(weights, gamma=2.0, alpha=1.0):
   epsilon = K.epsilon()
   is_training = K.learning_phase()
   def loss(y_true, y_pred): 
+    y_true = get_dense_labels(y_true, y_pred)
     if is_training: # Focal loss during training
       y_pred = K.clip(y_pred, epsilon, 1.0-epsilon)
       ce_loss = y_true * K.log(y_pred)
@@ -30,6 +35,7 @@ def weighted_categorical_crossentropy(weights):
   epsilon = K.epsilon()
 
   def loss(y_true, y_pred):
+    y_true = get_dense_labels(y_true, y_pred)
     y_pred = K.clip(y_pred, epsilon, 1.0-epsilon)
     loss = y_true * K.log(y_pred) * weights
     loss = -K.sum(loss, axis=-1)
@@ -51,6 +57,7 @@ def focal_loss(gamma=2.0, alpha=1.0):
   epsilon = K.epsilon()
 
   def loss(y_true, y_pred):
+    y_true = get_dense_labels(y_true, y_pred)
     y_pred = K.clip(y_pred, epsilon, 1.0-epsilon)
     ce_loss = y_true * K.log(y_pred)
     focal_loss = K.pow(1 - y_pred, gamma) * ce_loss * alpha
@@ -159,6 +159,10 @@ def main(argv):
 
   early_stopping = EarlyStopping(monitor='val_macro_f1', mode='max', verbose=1, patience=2)
 
+  # DataGenerator reads one .npy file per epoch
+  if not os.path.exists(files[0]) and os.path.exists(os.path.join(indir, 'shard_index.csv')):
+    raise ValueError('Epochs in ' + indir + ' are in shards - unpack them to .npy files with ' +
+                     'python ../../feature_engineering/epoch_shards.py ' + indir + ' --unpack')
   seqlen, n_channels = np.load(files[0]).shape
   batch_size = 32
  
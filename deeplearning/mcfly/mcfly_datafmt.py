@@ -2,47 +2,23 @@ import sys,os
 import numpy as np
 import pandas as pd
 import h5py
-from collections import Counter
 
-def get_categ(df, default='NaN'):
-  if len(df) == 0:
-    print('zero length')
-    return default
-  ctr = Counter(df)
-  for key in ctr:
-    ctr[key] = ctr[key]/float(len(df))
-  dom_categ = ctr.most_common()[0]
-  if dom_categ[1] >= 0.7: # If a category occurs more than 70% of time interval, mark that as dominant category
-    dom_categ = dom_categ[0]
-  else:
-    dom_categ = default
-  return dom_categ
-    
-def get_dominant_categ(timestamp, categ, time_interval, default='NaN'):
-  categ_df = pd.DataFrame(data={'timestamp':timestamp, 'category':categ})
-  categ_df.set_index('timestamp', inplace=True)
-  dom_categ = categ_df.resample(str(time_interval)+'S').apply(get_categ, default=default)
-  return pd.Series(dom_categ['category'])   
+sys.path.append('../../feature_engineering/')
+from epoch_stats import get_epochs, get_epoch_categ, get_epoch_slices
+from timestamp_io import read_timestamp
+from epoch_shards import ShardWriter
 
-def get_tslice(df):
-  tslice = np.array(df['channel'])
-  return tslice
-
-def get_timeslices(timestamp, channel, time_interval):
-  chan_df = pd.DataFrame(data={'timestamp':timestamp, 'channel':channel})
-  chan_df.set_index('timestamp', inplace=True)
-  chan_slices = chan_df.resample(str(time_interval)+'S').apply(get_tslice)
-  lengths = [tslice.shape[0] for tslice in chan_slices]
-  resize_len = int(np.median(lengths))
-  for tslice in chan_slices:
-    tslice.resize((resize_len), refcheck=False) 
-  return np.stack(chan_slices)
+def get_dominant_categ(timestamp, categ, time_interval, default='NaN'):
+  epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+  dom_categ = get_epoch_categ(categ, epoch_idx, len(epoch_start), default=default)
+  return pd.Series(dom_categ, index=pd.DatetimeIndex(epoch_start, name='timestamp'), name='category')
 
 def main(argv):
   indir = argv[0]
   time_interval = float(argv[1])
   dataset = argv[2]
   outdir = argv[3]
+  out_format = argv[4] if len(argv) > 4 else 'npy' # npy (one file per epoch) or shards (see epoch_shards.py)
  
   if not os.path.exists(outdir):
     os.makedirs(outdir)
@@ -51,6 +27,9 @@ def main(argv):
 
   lbl_fp = open(os.path.join(outdir,'labels.txt'),'w')
   lbl_fp.write('filename\tlabels\tuser\n')
+  # Epochs are written either to one .npy file each, as read by the mcfly
+  # DataGenerator, or to shards that can be unpacked with epoch_shards.py --unpack
+  writer = ShardWriter(outdir) if out_format == 'shards' else None
 
   files = os.listdir(indir)
   for fname in files:
@@ -60,8 +39,7 @@ def main(argv):
     x = np.array(fh['X'])
     y = np.array(fh['Y'])
     z = np.array(fh['Z'])
-    timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-    timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+    timestamp = read_timestamp(fh)
         
     # Get nonwear for each interval
     nonwear = np.array(fh['Nonwear'])
@@ -82,23 +60,13 @@ def main(argv):
           
     # Get data slices and dominant labels/nonwear for given time interval
     label_agg = get_dominant_categ(timestamp, label, time_interval)
-    x_slices = get_timeslices(timestamp, x, time_interval)
-    y_slices = get_timeslices(timestamp, y, time_interval)
-    z_slices = get_timeslices(timestamp, z, time_interval)
+    # Data (num_samples x num_timesteps x num_channels)
+    slices = get_epoch_slices(timestamp, [x, y, z], time_interval)
 
     # Get only values corresponding to valid labels
-    x_valid = x_slices[label_agg.isin(sleep_states)]
-    y_valid = y_slices[label_agg.isin(sleep_states)]
-    z_valid = z_slices[label_agg.isin(sleep_states)]
+    data = slices[label_agg.isin(sleep_states).values]
     label_valid = label_agg[label_agg.isin(sleep_states)]
-
-    # Reshape data and labels
-    # Data (num_samples x num_timesteps x num_channels)
-    num_samples = x_valid.shape[0]; num_timesteps = x_valid.shape[1]
-    x_valid = x_valid.reshape((num_samples, num_timesteps, 1))
-    y_valid = y_valid.reshape((num_samples, num_timesteps, 1))
-    z_valid = z_valid.reshape((num_samples, num_timesteps, 1))
-    data = np.dstack((x_valid, y_valid, z_valid))
+    num_samples = data.shape[0]
     
     # Save data, labels and other info to file    
     # PSGNewcastle2015 data
@@ -116,11 +84,19 @@ def main(argv):
         dataset = 'AMC'
         
     out_fname_path = fname.split('.h5')[0]
+    out_fnames = [out_fname_path + '_' + str(k) for k in range(num_samples)]
+    if writer is not None:
+      # Skip epochs already in shards
+      new_idx = [k for k in range(num_samples) if out_fnames[k] not in writer]
+      writer.write([out_fnames[k] for k in new_idx], data[new_idx])
+    else:
+      for k in range(num_samples):
+        np.save(os.path.join(outdir,out_fnames[k]), data[k])
     for k in range(num_samples):
-      out_fname = out_fname_path + '_' + str(k)
-      np.save(os.path.join(outdir,out_fname), data[k])
-      lbl_fp.write('{}\t{}\t{}\n'.format(out_fname,label_valid[k],user))
+      lbl_fp.write('{}\t{}\t{}\n'.format(out_fnames[k],label_valid[k],user))
 
+  if writer is not None:
+    writer.close()
   lbl_fp.close()
 
 if __name__ == "__main__":
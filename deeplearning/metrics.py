@@ -55,11 +55,18 @@ def weighted_precision(y_true, y_pred):
 def get_one_hot(y):
   return K.one_hot(K.argmax(y,axis=1), y.shape[1])
 
+# get one-hot rep of integer (sparse) labels - one-hot labels are returned as is
+def get_dense_labels(y_true, y_pred):
+  if K.ndim(y_true) == K.ndim(y_pred) and y_true.shape[-1] == y_pred.shape[-1]:
+    return y_true
+  return K.one_hot(K.cast(K.flatten(y_true), 'int32'), y_pred.shape[-1])
+
 def fbeta(prec, rec, beta=1.0):
   f_score = ((1+beta) * prec * rec)/(beta*prec + rec + K.epsilon())
   return f_score
 
 def micro_f1(y_true, y_pred):
+  y_true = get_dense_labels(y_true, y_pred)
   y_pred = get_one_hot(y_pred)
   prec = micro_precision(y_true, y_pred)
   rec = micro_recall(y_true, y_pred)
@@ -67,6 +74,7 @@ def micro_f1(y_true, y_pred):
   return f1
 
 def macro_f1(y_true, y_pred):
+  y_true = get_dense_labels(y_true, y_pred)
   y_pred = get_one_hot(y_pred)
   prec = macro_precision(y_true, y_pred)
   rec = macro_recall(y_true, y_pred)
@@ -74,6 +82,7 @@ def macro_f1(y_true, y_pred):
   return f1
 
 def weighted_f1(y_true, y_pred):
+  y_true = get_dense_labels(y_true, y_pred)
   y_pred = get_one_hot(y_pred)
   prec = weighted_precision(y_true, y_pred)
   rec = weighted_recall(y_true, y_pred)
@@ -0,0 +1,58 @@
+from multiprocessing import Pool
+from tensorflow.keras.utils import Sequence
+
+# Generator used by worker processes
+worker_gen = None
+
+def init_worker(generator):
+  'Keep a copy of the data generator in every worker process'
+  global worker_gen
+  worker_gen = generator
+  worker_gen.reader.reopen()
+  # Batches are sent to the main process as copies, so buffers can be reused
+  worker_gen.reuse_buffers = True
+
+def get_batch(args):
+  'Generate batch of given epoch in worker process'
+  epoch, index = args
+  if worker_gen.epoch != epoch:
+    worker_gen.set_epoch(epoch)
+  return worker_gen[index]
+
+# Input pipeline that generates batches of a DataGenerator in a pool of worker
+# processes, so that HDF5 reads, augmentation, feature channels and
+# normalization of different batches run in parallel on separate cores.
+# Up to prefetch batches following the requested one are generated ahead.
+# With a seeded DataGenerator, batches are identical to those of the
+# DataGenerator itself. Mean and std must be set (e.g. by fit) beforehand as
+# workers get a copy of the generator when the pipeline is created.
+class PrefetchGenerator(Sequence):
+  def __init__(self, generator, workers=2, prefetch=4):
+    'Initialization'
+    if generator.shuffle == True and generator.seed is None:
+      raise ValueError('Data generator must have a seed to shuffle in worker processes')
+    self.generator = generator
+    self.prefetch = prefetch
+    self.pool = Pool(processes=workers, initializer=init_worker, initargs=(generator,))
+    self.pending = {}
+
+  def __len__(self):
+    return len(self.generator)
+
+  def __getitem__(self, index):
+    'Get batch and schedule generation of the following batches'
+    epoch = self.generator.epoch
+    for idx in range(index, min(len(self), index+self.prefetch+1)):
+      if (epoch, idx) not in self.pending:
+        self.pending[(epoch, idx)] = self.pool.apply_async(get_batch, ((epoch, idx),))
+    return self.pending.pop((epoch, index)).get()
+
+  def on_epoch_end(self):
+    'Shuffle for next epoch and discard batches prefetched for current epoch'
+    self.generator.on_epoch_end()
+    self.pending = {}
+
+  def close(self):
+    'Stop worker processes'
+    self.pool.terminate()
+    self.pool.join()
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Group indices by class label with a single sort instead of one scan per class
+def group_by_class(indices, labels, n_classes):
+  indices = np.asarray(indices)
+  cls_labels = labels[indices]
+  order = np.argsort(cls_labels, kind='stable')
+  bounds = np.searchsorted(cls_labels[order], np.arange(n_classes+1))
+  return [indices[order[bounds[cls]:bounds[cls+1]]] for cls in range(n_classes)]
+
+# Sampler of class-balanced minibatches
+# Per-class index pools are built once and permuted once per epoch, and batch
+# number index takes the next samples of every pool, so a batch is drawn in
+# O(batch) time irrespective of the number of samples and the same batch is
+# drawn for the same epoch and index (e.g. by parallel workers).
+# Classes are sampled equally by default, in proportion to class_weights if
+# given, or in proportion to n_c^(1/temperature) for a class with n_c samples
+# if a temperature is given (1 - natural class distribution, large - equal).
+class BalancedSampler(object):
+  def __init__(self, n_classes, class_weights=None, temperature=None):
+    'Initialization'
+    if class_weights is not None and temperature is not None:
+      raise ValueError('Either class weights or temperature can be used for sampling')
+    self.n_classes = n_classes
+    self.class_weights = class_weights
+    self.temperature = temperature
+    self.pools = None
+
+  def clone(self):
+    'Get unfitted sampler with same parameters'
+    return BalancedSampler(self.n_classes, class_weights=self.class_weights, temperature=self.temperature)
+
+  def fit(self, indices, labels):
+    'Build per-class index pools and class probabilities'
+    self.orig_pools = group_by_class(indices, labels, self.n_classes)
+    self.pools = list(self.orig_pools)
+    cls_count = np.array([len(pool) for pool in self.orig_pools], dtype=float)
+    if self.class_weights is not None:
+      weights = np.array(self.class_weights, dtype=float)
+    elif self.temperature is not None:
+      weights = cls_count ** (1.0/self.temperature)
+    else:
+      weights = np.ones((self.n_classes,))
+    weights[cls_count == 0] = 0.0 # classes without samples cannot be drawn
+    self.probs = weights / weights.sum()
+    return self
+
+  def set_epoch(self, epoch, seed=None):
+    'Permute class pools for given epoch'
+    # Use different random stream than shuffling of generator indices
+    rng = np.random if seed is None else np.random.RandomState([seed, epoch, 1])
+    self.pools = [pool[rng.permutation(len(pool))] for pool in self.orig_pools]
+
+  def get_class_sizes(self, size):
+    'Get number of samples of every class in a batch of given size, rounded down'
+    return np.floor(size * self.probs).astype(int)
+
+  def sample(self, size, index):
+    'Draw indices of batch number index, grouped by class'
+    quota = size * self.probs
+    counts = self.get_class_sizes(size)
+    extra = size - counts.sum()
+    if extra > 0: # remaining samples go to classes chosen in proportion to remainders
+      rem = quota - counts
+      counts[np.random.choice(self.n_classes, extra, replace=False, p=rem/rem.sum())] += 1
+    stride = np.ceil(quota).astype(int)
+    indices = []
+    for cls in range(self.n_classes):
+      pool = self.pools[cls]
+      if counts[cls] > 0:
+        pos = (index * stride[cls] + np.arange(counts[cls])) % len(pool)
+        indices.append(pool[pos])
+    return np.concatenate(indices)
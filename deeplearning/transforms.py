@@ -2,12 +2,43 @@
 # T. T. Um et al., Data augmentation of wearable sensor data for parkinsons disease monitoring 
 # using convolutional neural networks, in Proceedings of the 19th ACM International Conference 
 # on Multimodal Interaction, ser. ICMI 2017. New York, NY, USA: ACM, 2017, pp. 216220.
+import sys
 import math
 import numpy as np
 from scipy.interpolate import CubicSpline      # for warping
 
+sys.path.append('../feature_engineering/')
+from lids import boxcar_sum
+
 # X is a LxMxN timeseries signal with L samples, M timesteps and N channels (easier batch processing for L samples)
 
+# Batched linear interpolation at timesteps 0..num_timesteps-1 - same as
+# np.interp(np.arange(num_timesteps), xp[i], fp[i,:,ch]) for every row i and
+# channel ch, where xp is (rows x K) and increasing along each row and fp is
+# (rows x K x channels). Returns (rows x num_timesteps x channels).
+# The segment of every timestep is found by counting the xp <= timestep with a
+# single bincount over all rows instead of a search per row.
+def interp_timesteps(xp, fp, num_timesteps):
+  nrows, K = xp.shape
+  # xp <= t for integer t if and only if ceil(xp) <= t
+  bins = np.clip(np.ceil(xp), 0, num_timesteps).astype(int)
+  bins += (np.arange(nrows) * (num_timesteps+1)).reshape(-1,1)
+  counts = np.bincount(bins.ravel(), minlength=nrows*(num_timesteps+1))
+  idx = np.cumsum(counts.reshape(nrows, num_timesteps+1), axis=1)[:,:num_timesteps]
+  # Slopes of the K-1 segments plus zero slopes before the first and after the
+  # last xp, so that values outside xp are clamped to first and last value of fp
+  fp = fp.reshape(nrows, K, -1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    slope = np.diff(fp, axis=1) / np.diff(xp, axis=1)[:,:,np.newaxis]
+  zeros = np.zeros((nrows, 1, fp.shape[2]))
+  slope = np.concatenate((zeros, slope, zeros), axis=1)
+  fp_lo = np.concatenate((fp[:,:1], fp), axis=1)
+  xp_lo = np.concatenate((xp[:,:1], xp), axis=1)
+  # Gather segments as rows of the flattened arrays (all channels at once)
+  j = idx + (np.arange(nrows) * (K+1)).reshape(-1,1)
+  t = np.arange(num_timesteps).reshape(1,-1,1) - xp_lo.reshape(-1,1)[j]
+  return slope.reshape(nrows*(K+1), -1)[j] * t + fp_lo.reshape(nrows*(K+1), -1)[j]
+
 # Jitter - adds additive noise
 def jitter(X, sigma=0.05):
   noise = np.random.normal(loc=0, scale=sigma, size=X.shape)
@@ -21,17 +52,13 @@ def scaling(X, sigma=0.1):
   
 # Magnitude warping - changes the magnitude of each sample by convolving 
 # the data window with a smooth curve varying around one 
+# Knots are the same for all samples, so one spline is fit to all samples and channels
 def generate_random_curves(X, sigma=0.2, knot=4):
-  random_curves = np.zeros(X.shape)
-  for i in range(X.shape[0]):
-    xx = (np.ones((X.shape[2],1))*(np.arange(0,X.shape[1], (X.shape[1]-1)/(knot+1)))).transpose()
-    yy = np.random.normal(loc=1.0, scale=sigma, size=(knot+2, X.shape[2]))
-    x_range = np.arange(X.shape[1])
-    cs_x = CubicSpline(xx[:,0], yy[:,0])
-    cs_y = CubicSpline(xx[:,1], yy[:,1])
-    cs_z = CubicSpline(xx[:,2], yy[:,2])
-    random_curves[i,:,:] = np.array([cs_x(x_range),cs_y(x_range),cs_z(x_range)]).transpose()
-  return random_curves
+  xx = np.arange(0,X.shape[1], (X.shape[1]-1)/(knot+1))
+  yy = np.random.normal(loc=1.0, scale=sigma, size=(X.shape[0], knot+2, X.shape[2]))
+  x_range = np.arange(X.shape[1])
+  cs = CubicSpline(xx, yy, axis=1)
+  return cs(x_range)
 
 def magnitude_warp(X, sigma=0.2):
     return X * generate_random_curves(X, sigma)
@@ -42,19 +69,18 @@ def distort_timesteps(X, sigma=0.2):
   tt = generate_random_curves(X, sigma) # Regard these samples around 1 as time intervals
   tt_cum = np.cumsum(tt, axis=1)        # Add intervals to make a cumulative graph
   # Make the last value to have X.shape[1]
-  t_scale = np.array([(X.shape[1]-1)/tt_cum[:,-1,0],(X.shape[1]-1)/tt_cum[:,-1,1],(X.shape[1]-1)/tt_cum[:,-1,2]]).transpose()
-  t_scale = np.matmul(np.ones((X.shape[0],X.shape[1],1)),t_scale.reshape(X.shape[0],1,X.shape[2]))
+  t_scale = (X.shape[1]-1)/tt_cum[:,-1:,:]
   tt_cum = tt_cum*t_scale
   return tt_cum
 
 def time_warp(X, sigma=0.2):
   tt_new = distort_timesteps(X, sigma)
-  X_new = np.zeros(X.shape)
-  for i in range(X.shape[0]):
-    X_new[i,:,0] = np.interp(np.arange(X.shape[1]), tt_new[i,:,0], X[i,:,0])
-    X_new[i,:,1] = np.interp(np.arange(X.shape[1]), tt_new[i,:,1], X[i,:,1])
-    X_new[i,:,2] = np.interp(np.arange(X.shape[1]), tt_new[i,:,2], X[i,:,2])
-  return X_new
+  # Interpolate all samples and channels at once - each channel has its own timesteps
+  L, M, N = X.shape
+  xp = tt_new.transpose(0,2,1).reshape(L*N, M)
+  fp = X.transpose(0,2,1).reshape(L*N, M, 1)
+  X_new = interp_timesteps(xp, fp, M)
+  return X_new.reshape(L, N, M).transpose(0,2,1)
 
 # Rotation - applying arbitrary rotations to the existing data can be used as
 # a way of simulating different sensor placements
@@ -128,11 +154,8 @@ def rand_sample_timesteps(X, nSample=1000):
 def rand_sampling(X, low=0.6, high=0.8):
   nSample = np.random.randint(int(low*X.shape[1]),int(high*X.shape[1]),1)[0]
   tt = rand_sample_timesteps(X, nSample)
-  X_new = np.zeros(X.shape)
-  for i in range(X.shape[0]):
-    X_new[i,:,0] = np.interp(np.arange(X.shape[1]), tt[i], X[i,tt[i],0])
-    X_new[i,:,1] = np.interp(np.arange(X.shape[1]), tt[i], X[i,tt[i],1])
-    X_new[i,:,2] = np.interp(np.arange(X.shape[1]), tt[i], X[i,tt[i],2])
+  # Interpolate all samples and channels at once
+  X_new = interp_timesteps(tt, np.take_along_axis(X, tt[:,:,np.newaxis], axis=1), X.shape[1])
   return X_new
 
 # Get Euclidean Norm minus One
@@ -146,13 +169,14 @@ def get_angle_z(x,y,z):
   angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
   return angle_z
 
-# Get Locomotor Inactivity During Sleep - use convolve instead of rolling sum over intervals 
+# Get Locomotor Inactivity During Sleep - use boxcar sums over timesteps instead of rolling sum over intervals 
+# All samples of the batch are smoothed at once along the time axis
 def get_LIDS(x,y,z):
   enmo = get_ENMO(x,y,z)
   enmo_sub = np.where(enmo < 0.02, 0, enmo-0.02) # assuming ENMO is in g
   win_sz = 21 # use smaller window size instead of 10-min rolling sum
-  enmo_sub_smooth = np.apply_along_axis(lambda row: np.convolve(row, np.ones((win_sz,)), 'same'), axis=-1, arr=enmo_sub)
+  enmo_sub_smooth = boxcar_sum(enmo_sub, win_sz, axis=-1)
   lids = 100.0 / (enmo_sub_smooth + 1.0)
   win_sz = 71 # use larger window size instead of 30-min rolling average
-  lids_smooth = np.apply_along_axis(lambda row: np.convolve(row, np.ones((win_sz,)), 'same'), axis=-1, arr=lids)/float(win_sz)
+  lids_smooth = boxcar_sum(lids, win_sz, axis=-1)/float(win_sz)
   return lids_smooth
@@ -7,7 +7,7 @@ from collections import Counter
 class CVTuner(kerastuner.engine.tuner.Tuner):
 
   def __init__(self, cv=5, states=None, num_classes=None, seqlen=None, num_channels=None,\
-               feat_channels=None, mean=None, std=None, *args, **kwargs):
+               feat_channels=None, mean=None, std=None, sampler=None, *args, **kwargs):
     super(CVTuner, self).__init__(*args, **kwargs)
     self.cv = cv
     self.states = states
@@ -17,6 +17,7 @@ class CVTuner(kerastuner.engine.tuner.Tuner):
     self.feat_channels = feat_channels
     self.mean = mean
     self.std = std
+    self.sampler = sampler # sampler of balanced training batches
     self.ntrial = 0
 
   def run_trial(self, trial, data=None, labels=None, users=None, indices=None, batch_size=32):
@@ -43,10 +44,11 @@ class CVTuner(kerastuner.engine.tuner.Tuner):
       print('Inner CV fold {:d}'.format(fold))
       train_gen = DataGenerator(indices[train_indices], data, labels, self.states, partition='train',\
                                 batch_size=batch_size, seqlen=self.seqlen, n_channels=self.num_channels, feat_channels=self.feat_channels,\
-                                n_classes=self.num_classes, shuffle=True, balance=True, mean=self.mean, std=self.std)
+                                n_classes=self.num_classes, shuffle=True, balance=True, mean=self.mean, std=self.std,\
+                                sampler=self.sampler, sparse=True)
       val_gen = DataGenerator(indices[val_indices], data, labels, self.states, partition='test',\
                               batch_size=batch_size, seqlen=self.seqlen, n_channels=self.num_channels, feat_channels=self.feat_channels,\
-                              n_classes=self.num_classes, mean=self.mean, std=self.std)
+                              n_classes=self.num_classes, mean=self.mean, std=self.std, sparse=True)
       model = self.hypermodel.build(trial.hyperparameters)
       model.fit(train_gen, epochs=epochs, validation_data=val_gen,\
                 verbose=1, shuffle=False, initial_epoch=initial_epoch,
@@ -7,7 +7,6 @@ from collections import Counter
 import joblib
 
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.model_selection import RandomizedSearchCV
 from sklearn.model_selection import GroupKFold, StratifiedKFold
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.pipeline import Pipeline
@@ -19,19 +18,35 @@ from imblearn.over_sampling import SMOTE
 sys.path.append('../analysis/')
 from analysis import cv_save_feat_importances_result, cv_save_classification_result
 
+sys.path.append('../ggir_ext/')
+from rf_ensemble import export_ensemble
+
+from feature_store import load_features
+from fold_scheduler import FoldScheduler, get_array_hash
+from group_resampling import resample_groups
+from hyperparam_search import get_search, fit_search
+from manifest import get_code_version
+
 def main(argv):
   infile = argv[0]
   mode = argv[1] # binary or multiclass or nonwear
   dataset = argv[2]
   outdir = argv[3]
+  num_cores = int(argv[4]) if len(argv) > 4 else os.cpu_count() # core budget for all outer folds
+  fold_jobs = int(argv[5]) if len(argv) > 5 else None # cores per fold - default: equal share of budget
+  search = argv[6] if len(argv) > 6 else 'random' # hyperparameter search: random, halving or warmstart
+  if search not in ['random', 'halving', 'warmstart']:
+    raise ValueError('Unknown search ' + search + ' - use random, halving or warmstart')
+  if mode == 'multiclass' and search == 'halving':
+    # Multiclass labels are one-hot encoded for the search, which successive halving does not support
+    raise ValueError('Halving search requires 1d labels - use random or warmstart search for multiclass')
 
   resultdir = os.path.join(outdir,'models')
   if not os.path.exists(resultdir):
     os.makedirs(resultdir)
 
-  # Read data file and retain data only corresponding to 5 sleep states or nonwear
-  df = pd.read_csv(infile, dtype={'label':object, 'user':object,
-                   'position':object, 'dataset':object})
+  # Read data file (CSV or feature store) and retain data only corresponding to 5 sleep states or nonwear
+  df = load_features(infile)
   if mode == 'binary':
     states = ['Wake', 'Sleep']
     collate_states = ['NREM 1', 'NREM 2', 'NREM 3', 'REM']
@@ -80,13 +95,11 @@ def main(argv):
   scorer = make_scorer(average_precision_score, average='macro')
 
   # Outer CV
-  imbalanced_pred = []; imbalanced_imp = []
-  balanced_pred = []; balanced_imp = []
+  # Outer folds run in parallel processes under a budget of num_cores cores
+  # and every completed fold is saved, so a rerun resumes from completed folds
   outer_cv_splits = 5; inner_cv_splits = 5
   outer_group_kfold = GroupKFold(n_splits=outer_cv_splits)
-  out_fold = 0
-  for train_indices, test_indices in outer_group_kfold.split(X,y,groups):
-    out_fold += 1
+  def process_fold(out_fold, train_indices, test_indices, n_jobs):
     out_fold_X_train = X[train_indices,:]; out_fold_X_test = X[test_indices,:]
     out_fold_y_train = y[train_indices]; out_fold_y_test = y[test_indices]
     out_fold_users_train = groups[train_indices]; out_fold_users_test = groups[test_indices]
@@ -115,40 +128,16 @@ def main(argv):
     # difficult to parallelize
     # So stick only with oversampling techniques
     print('Fold'+str(out_fold)+' - Balanced: SMOTE')
-    smote = SMOTE(random_state=0, n_jobs=-1, sampling_strategy='all')
-    # Resample training data for each user
-    train_users = list(set(out_fold_users_train))
-    out_fold_X_train_resamp, out_fold_y_train_resamp, out_fold_users_train_resamp = None, None, None
-    for i,user in enumerate(train_users):
-      #print('%d/%d - %s' % (i+1,len(train_users),user))
-      user_X = out_fold_X_train_sc[out_fold_users_train == user]
-      user_y = out_fold_y_train[out_fold_users_train == user]
-      if len(set(user_y)) == 1:
-        print('%d/%d: %s has only one class' % (i+1,len(train_users),user))
-        print(Counter(user_y))
-        continue
-      try:
-        user_X_resamp, user_y_resamp = smote.fit_resample(user_X, user_y)
-      except:
-        print('%d/%d: %s failed to fit' % (i+1,len(train_users),user))
-        print(Counter(user_y))
-        continue
-      user_y_resamp = user_y_resamp.reshape(-1,1)
-      user_resamp = np.array([user] * len(user_X_resamp)).reshape(-1,1)
-      if out_fold_X_train_resamp is None:
-        out_fold_X_train_resamp = user_X_resamp
-        out_fold_y_train_resamp = user_y_resamp
-        out_fold_users_train_resamp = user_resamp
-      else:
-        out_fold_X_train_resamp = np.vstack((out_fold_X_train_resamp, user_X_resamp))
-        out_fold_y_train_resamp = np.vstack((out_fold_y_train_resamp, user_y_resamp))
-        out_fold_users_train_resamp = np.vstack((out_fold_users_train_resamp, user_resamp))
+    smote = SMOTE(random_state=0, sampling_strategy='all')
+    # Resample training data for each user, with users resampled in parallel
+    out_fold_X_train_resamp, out_fold_y_train_resamp, out_fold_users_train_resamp = \
+          resample_groups(smote, out_fold_X_train_sc, out_fold_y_train, out_fold_users_train, n_jobs=n_jobs)
     # Shuffle resampled data
     resamp_indices = np.arange(len(out_fold_X_train_resamp))
     np.random.shuffle(resamp_indices)
     out_fold_X_train_resamp = out_fold_X_train_resamp[resamp_indices]
-    out_fold_y_train_resamp = out_fold_y_train_resamp[resamp_indices].reshape(-1)
-    out_fold_users_train_resamp = out_fold_users_train_resamp[resamp_indices].reshape(-1)
+    out_fold_y_train_resamp = out_fold_y_train_resamp[resamp_indices]
+    out_fold_users_train_resamp = out_fold_users_train_resamp[resamp_indices]
 
     inner_group_kfold = GroupKFold(n_splits=inner_cv_splits)
     custom_resamp_cv_indices = []
@@ -165,12 +154,11 @@ def main(argv):
     print('Fold'+str(out_fold)+' - Balanced: Hyperparameter search')
     search_params = {'n_estimators':[100,150,200,300,400,500],
                  'max_depth': [5,10,15,20,None]}
-    cv_clf = RandomizedSearchCV(estimator=clf, param_distributions=search_params,
-                            cv=custom_resamp_cv_indices, scoring=scorer,
-                            n_iter=10, n_jobs=-1, verbose=2)
+    cv_clf = get_search(clf, search_params, custom_resamp_cv_indices, scorer,
+                        n_iter=10, search=search, n_jobs=n_jobs, verbose=2)
     if mode == 'multiclass':
       out_fold_y_train_resamp = encoder.fit_transform(out_fold_y_train_resamp.reshape(-1,1)).todense()
-    cv_clf.fit(out_fold_X_train_resamp, out_fold_y_train_resamp)
+    fit_search(cv_clf, out_fold_X_train_resamp, out_fold_y_train_resamp, name='Fold'+str(out_fold)+' - Balanced:')
     print(cv_clf.best_estimator_)
     joblib.dump([scaler,cv_clf], os.path.join(resultdir,\
                 'fold'+str(out_fold)+'_'+ mode + '_balanced_RF.sav'))
@@ -186,9 +174,22 @@ def main(argv):
       
     print('Fold'+str(out_fold)+' - Balanced', cv_clf.best_params_)
 
-    balanced_pred.append((out_fold_users_test, out_fold_ts_test, out_fold_fnames_test,
-                          out_fold_y_test, out_fold_y_test_pred))
-    balanced_imp.append(cv_clf.best_estimator_.feature_importances_)
+    return {'pred': (out_fold_users_test, out_fold_ts_test, out_fold_fnames_test,
+                     out_fold_y_test, out_fold_y_test_pred),
+            'imp': cv_clf.best_estimator_.feature_importances_}
+
+  # Fold results are kept apart from models, as scripts select models by mode in their name
+  folddir = os.path.join(outdir, 'folds')
+  # Completed folds are reused only if the driver and the modules that compute them are unchanged
+  src_files = [__file__] + [sys.modules[func.__module__].__file__
+                            for func in [resample_groups, get_search, FoldScheduler]]
+  scheduler = FoldScheduler(folddir, mode + '_balanced_RF', core_budget=num_cores, fold_jobs=fold_jobs,
+                            params={'mode': mode, 'feat_cols': feat_cols, 'search': search,
+                                    'data': get_array_hash(X, y, groups),
+                                    'version': get_code_version(src_files)})
+  fold_results = scheduler.run(process_fold, outer_group_kfold.split(X,y,groups))
+  balanced_pred = [result['pred'] for result in fold_results]
+  balanced_imp = [result['imp'] for result in fold_results]
 
   print('############## Balanced classification ##############')
   # Save balanced classification reports
@@ -196,6 +197,14 @@ def main(argv):
                    os.path.join(outdir, mode + '_balanced_feat_imp.csv'))
   cv_save_classification_result(balanced_pred, states,
                    os.path.join(outdir, mode + '_balanced_classification.csv'))
+
+  # Export fold models as compact ensemble for prediction (e.g. by ggir_ext/get_sleep_stage.py)
+  ensembledir = os.path.join(outdir, 'ensemble')
+  if not os.path.exists(ensembledir):
+    os.makedirs(ensembledir)
+  export_ensemble([os.path.join(resultdir, 'fold'+str(fold)+'_'+ mode + '_balanced_RF.sav')
+                   for fold in range(1, outer_cv_splits+1)],
+                  os.path.join(ensembledir, mode + '_RF'), mode, feat_cols=feat_cols, states=states)
     
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# Get mean of feature over windows [lo,hi) from cumulative sums
+# A window containing NaN yields NaN, same as pandas rolling mean
+def window_mean(cumsum, nancount, lo, hi):
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mean = (cumsum[hi] - cumsum[lo]) / (hi - lo).reshape(-1,1)
+  mean[(nancount[hi] - nancount[lo]) > 0] = np.nan
+  return mean
+
+# Get difference of features with respect to mean of prev and next intervals
+# for every given horizon (in seconds) using a single cumulative sum pass
+# features: (num_epochs,) or (num_epochs x num_features) array of epoch means
+# Returns (num_epochs x 2*num_horizons) or (num_epochs x num_features x 2*num_horizons)
+# with columns ordered as prev/next difference for each horizon
+def get_context_feat(features, horizons=(30,60,120), time_interval=30):
+  features = np.asarray(features, dtype=np.float64)
+  squeeze = features.ndim == 1
+  if squeeze:
+    features = features.reshape(-1,1)
+  nepochs, nfeat = features.shape
+
+  isnan = np.isnan(features)
+  cumsum = np.zeros((nepochs+1, nfeat))
+  cumsum[1:] = np.cumsum(np.where(isnan, 0.0, features), axis=0)
+  nancount = np.zeros((nepochs+1, nfeat), dtype=np.int64)
+  nancount[1:] = np.cumsum(isnan, axis=0)
+
+  idx = np.arange(nepochs)
+  context = np.zeros((nepochs, nfeat, 2*len(horizons)))
+  for h,time_diff in enumerate(horizons):
+    window = max(1, int(time_diff / float(time_interval)))
+    # Mean of previous window (shorter at the start of the recording)
+    prev_mean = window_mean(cumsum, nancount, np.maximum(0, idx-window), idx)
+    context[1:,:,2*h] = features[1:] - prev_mean[1:]
+    # Mean of next window (shorter at the end of the recording)
+    next_mean = window_mean(cumsum, nancount, idx+1, np.minimum(nepochs, idx+1+window))
+    context[:-1,:,2*h+1] = next_mean[:-1] - features[:-1]
+
+  if squeeze:
+    context = context[:,0,:]
+  return context
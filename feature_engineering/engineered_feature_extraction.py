@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 import sys,os
+import time
+import shutil
 import h5py
 import numpy as np
 import math
 import pandas as pd
-from scipy.stats import entropy
-from collections import Counter
+from multiprocessing import Pool
+
+from epoch_stats import get_epochs, get_epoch_stats, get_epoch_categ
+from context_feat import get_context_feat
+from lids import get_LIDS
+from manifest import Manifest, get_code_version
+from feature_store import save_features
+from timestamp_io import read_timestamp
 
 # Get Euclidean Norm minus One
 def get_ENMO(x,y,z):
@@ -20,201 +28,174 @@ def get_tilt_angles(x,y,z):
   angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
   return angle_x, angle_y, angle_z
 
-# Get Locomotor Inactivity During Sleep   
-def get_LIDS(timestamp, ENMO):
-  df = pd.concat((timestamp, pd.Series(ENMO)), axis=1)
-  df.columns = ['timestamp','ENMO']
-  df.set_index('timestamp', inplace=True)
-  
-  df['ENMO_sub'] = np.where(ENMO < 0.02, 0, ENMO-0.02) # assuming ENMO is in g
-  # 10-minute rolling sum
-  ENMO_sub_smooth = df['ENMO_sub'].rolling('600s').sum()
-  df['LIDS_unfiltered'] = 100.0 / (ENMO_sub_smooth + 1.0)
-  # 30-minute rolling average
-  LIDS = df['LIDS_unfiltered'].rolling('1800s').mean().values
-  return LIDS
-  
-def mad(data):
-  out = np.mean(np.absolute(data - np.mean(data)))
-  return out  
-
-def compute_entropy(data, bins=20):
-  bins = int(bins)
-  hist, bin_edges = np.histogram(data, bins=bins)
-  p = hist/float(hist.sum())
-  ent = entropy(p)
-  return ent 
-
-# Get difference of feature with respect to prev or next interval
-def get_diff_feat(feature, direction, time_diff, time_interval=30):
-  window = int(time_diff / float(time_interval))
-  mean_feature = feature.rolling(window).mean().values
-  feature = feature.values.reshape(-1,1)
-  mean_feature = mean_feature.reshape(-1,1)
-  diff = np.zeros(feature.shape)
-  if direction == 'prev':
-    # Compute mean for border conditions
-    for i in range(0,window-1):
-      mean_feature[i] = np.mean(feature[:i+1])
-  else:
-    # Shift mean feature by window
-    mean_feature = np.vstack((mean_feature[window-1:].reshape(-1,1),\
-                              mean_feature[:window-1].reshape(-1,1)))
-    # Compute mean for border conditions
-    for i in range(len(feature)-window+1,len(feature)):
-      mean_feature[i] = np.mean(feature[i:])
-  if direction == 'prev':
-    diff[1:] = feature[1:] - mean_feature[:-1]
-  else:
-    diff[:-1] = mean_feature[1:] - feature[:-1]
-
-  return diff.reshape(-1,)
-    
 # Aggregate statistics of features over a given time interval
-def get_stats(timestamp, feature, time_interval):
-  feat_df = pd.DataFrame(data={'timestamp':timestamp, 'feature':feature})
-  feat_df.set_index('timestamp', inplace=True)
-  feat_mean = feat_df.resample(str(time_interval)+'S').mean()
-  feat_std = feat_df.resample(str(time_interval)+'S').std()
-  feat_min = feat_df.resample(str(time_interval)+'S').min()
-  feat_max = feat_df.resample(str(time_interval)+'S').max()
-  feat_range = feat_max['feature'] - feat_min['feature']
-  feat_mad = feat_df.resample(str(time_interval)+'S').apply(mad)
-  feat_ent1 = feat_df.resample(str(time_interval)+'S')\
-                              .apply(compute_entropy, bins=20)
-  feat_ent2 = feat_df.resample(str(time_interval)+'S')\
-                              .apply(compute_entropy, bins=200)
-  feat_prev30diff = get_diff_feat(feat_mean['feature'], 'prev', 30, time_interval)
-  feat_next30diff = get_diff_feat(feat_mean['feature'], 'next', 30, time_interval)
-  feat_prev60diff = get_diff_feat(feat_mean['feature'], 'prev', 60, time_interval)
-  feat_next60diff = get_diff_feat(feat_mean['feature'], 'next', 60, time_interval)
-  feat_prev120diff = get_diff_feat(feat_mean['feature'], 'prev', 120, time_interval)
-  feat_next120diff = get_diff_feat(feat_mean['feature'], 'next', 120, time_interval)
-  stats = np.vstack((feat_mean['feature'], feat_std['feature'], feat_range, 
-                     feat_mad['feature'], feat_ent1['feature'], feat_ent2['feature'],
-                     feat_prev30diff, feat_next30diff, feat_prev60diff, 
-                     feat_next60diff, feat_prev120diff, feat_next120diff)).T
+def get_stats(timestamp, feature, time_interval, horizons=(30,60,120)):
+  epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+  epoch_stats = get_epoch_stats(feature, epoch_idx, len(epoch_start))
+  # Differences of mean with respect to prev/next intervals for each horizon
+  context = get_context_feat(epoch_stats[:,0], horizons, time_interval)
+  stats = np.hstack((epoch_stats, context))
 
   # return index and stats
-  return np.array(feat_mean.index.values, dtype='str'), stats
-
-def get_categ(df, default='NaN'):
-  ctr = Counter(df)
-  for key in ctr:
-    ctr[key] = ctr[key]/float(len(df))
-  dom_categ = ctr.most_common()[0]
-  # If a category occurs more than 70% of time interval,
-  # mark that as dominant category
-  if dom_categ[1] >= 0.7: 
-    dom_categ = dom_categ[0]
-  else:
-    dom_categ = default
-  return dom_categ
-    
+  return np.array(epoch_start, dtype='str'), stats
+
 def get_dominant_categ(timestamp, categ, time_interval, default='NaN'):
-  categ_df = pd.DataFrame(data={'timestamp':timestamp, 'category':categ})
-  categ_df.set_index('timestamp', inplace=True)
-  dom_categ = categ_df.resample(str(time_interval)+'S')\
-                               .apply(get_categ, default=default)
-  return np.array(dom_categ['category'])   
+  epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+  return get_epoch_categ(categ, epoch_idx, len(epoch_start), default=default)
+
+def process_file(fname, time_interval, states, dataset):
+  filename = os.path.basename(fname)
+  fh = h5py.File(fname, 'r')
+  x = np.array(fh['X'])
+  y = np.array(fh['Y'])
+  z = np.array(fh['Z'])
+  timestamp = read_timestamp(fh)
+ 
+  # Get ENMO and acceleration angles
+  ENMO = get_ENMO(x,y,z)
+  angle_x, angle_y, angle_z = get_tilt_angles(x,y,z)
+  # Get LIDS (Locomotor Inactivity During Sleep)
+  LIDS = get_LIDS(timestamp, ENMO)
+  
+  # Get statistics of features for given time intervals
+  _, ENMO_stats = get_stats(timestamp, ENMO, time_interval)
+  _, angle_z_stats = get_stats(timestamp, angle_z, time_interval)
+  timestamp_agg, LIDS_stats = get_stats(timestamp, LIDS, time_interval)
+  feat = np.hstack((ENMO_stats, angle_z_stats, LIDS_stats))
+
+  # Get nonwear for each interval
+  nonwear = np.array(fh['Nonwear'])
+  nonwear_agg = get_dominant_categ(timestamp, nonwear, time_interval, default=True)
+  
+  # Standardize label names for both datasets
+  # Get label for each interval
+  label = np.array([x.decode('utf8') for x in np.array(fh['SleepState'])],
+                   dtype=object)
+  fh.close()
+  label[label == 'W'] = 'Wake'
+  label[label == 'N1'] = 'NREM 1'
+  label[label == 'N2'] = 'NREM 2'
+  label[label == 'N3'] = 'NREM 3'
+  label[label == 'R'] = 'REM'
+  label[label == 'Wakefulness'] = 'Wake'
+  label_agg = get_dominant_categ(timestamp, label, time_interval)
+  label_agg[(np.isin(label_agg, states, invert=True))
+            & (nonwear_agg == True)] = 'Nonwear'
+
+  # Get valid timestamps, features and labels
+  timestamp_valid = timestamp_agg[label_agg != 'NaN'].reshape(-1,1)
+  feat_valid = feat[label_agg != 'NaN',:]
+  label_valid = label_agg[label_agg != 'NaN'].reshape(-1,1)
+  
+  # Build features with typed columns - float features, string timestamps and labels
+  cols = ['ENMO_mean','ENMO_std','ENMO_range','ENMO_mad',
+          'ENMO_entropy1','ENMO_entropy2','ENMO_prev30diff','ENMO_next30diff',
+          'ENMO_prev60diff', 'ENMO_next60diff', 'ENMO_prev120diff', 'ENMO_next120diff',  
+          'angz_mean','angz_std','angz_range','angz_mad',
+          'angz_entropy1','angz_entropy2','angz_prev30diff','angz_next30diff', 
+          'angz_prev60diff', 'angz_next60diff', 'angz_prev120diff', 'angz_next120diff',  
+          'LIDS_mean','LIDS_std','LIDS_range','LIDS_mad',
+          'LIDS_entropy1','LIDS_entropy2','LIDS_prev30diff','LIDS_next30diff',
+          'LIDS_prev60diff', 'LIDS_next60diff', 'LIDS_prev120diff', 'LIDS_next120diff']
+  df = pd.DataFrame(data=feat_valid, columns=cols)
+  df.insert(0, 'timestamp', timestamp_valid.ravel())
+  df['label'] = label_valid.ravel()
+  
+  if dataset == 'Newcastle':
+    user = filename.split('_')[0]
+    position = filename.split('_')[1]
+  elif dataset == 'UPenn':
+    user = filename.split('.h5')[0][-4:]
+    position = 'NaN'
+  elif dataset == 'AMC':
+    user = '_'.join(part for part in filename.split('.h5')[0].split('_')[0:2])
+    position = 'NaN'
+
+  df['user'] = user  
+  df['position'] = position
+  df['dataset'] = dataset
+  df['filename'] = filename
+
+  return df, len(x)
+
+# Extract features of one file and save them to a CSV shard in shard directory
+# or to the feature store if output format is parquet
+def process_shard(args):
+  fname, time_interval, states, dataset, sharddir, out_format = args
+  df, nsamples = process_file(fname, time_interval, states, dataset)
+  if out_format == 'parquet':
+    return fname, save_features(df, sharddir, os.path.basename(fname)), nsamples
+  shard_fname = os.path.join(sharddir, os.path.basename(fname) + '.csv')
+  # Write to temporary file first so that an interrupted run leaves no partial shard
+  df.to_csv(shard_fname + '.tmp', sep=',', mode='w', index=False, header=True)
+  os.replace(shard_fname + '.tmp', shard_fname)
+  return fname, [shard_fname], nsamples
+
+# Concatenate shards in the order of given files into a single CSV
+def merge_shards(files, sharddir, outfile):
+  with open(outfile, 'w') as out_fp:
+    for idx,fname in enumerate(files):
+      with open(os.path.join(sharddir, fname + '.csv'), 'r') as shard_fp:
+        header = shard_fp.readline()
+        if idx == 0:
+          out_fp.write(header)
+        shutil.copyfileobj(shard_fp, out_fp)
 
 def main(argv):
   indir = argv[0]
   time_interval = float(argv[1]) # time interval of feature aggregation in seconds
   dataset = argv[2]
   outdir = argv[3]
+  num_workers = int(argv[4]) if len(argv) > 4 else 1 # number of files processed in parallel
+  out_format = argv[5] if len(argv) > 5 else 'csv' # csv or parquet (feature store)
   
-  if not os.path.exists(outdir):
-    os.makedirs(outdir)
+  if out_format == 'parquet':
+    # Feature store is a directory partitioned by dataset and user
+    sharddir = os.path.join(outdir, 'features_' + str(time_interval) + 's')
+  else:
+    sharddir = os.path.join(outdir, 'shards_' + str(time_interval) + 's')
+  if not os.path.exists(sharddir):
+    os.makedirs(sharddir)
   
   # Sleep states
   states = ['Wake','NREM 1','NREM 2','NREM 3','REM']
   
-  files = os.listdir(indir)
-  for idx,fname in enumerate(files):
-    print('Processing ' + fname)
-    
-    fh = h5py.File(os.path.join(indir,fname), 'r')
-    x = np.array(fh['X'])
-    y = np.array(fh['Y'])
-    z = np.array(fh['Z'])
-    timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-    timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
-   
-    # Get ENMO and acceleration angles
-    ENMO = get_ENMO(x,y,z)
-    angle_x, angle_y, angle_z = get_tilt_angles(x,y,z)
-    # Get LIDS (Locomotor Inactivity During Sleep)
-    LIDS = get_LIDS(timestamp, ENMO)
-    
-    # Get statistics of features for given time intervals
-    _, ENMO_stats = get_stats(timestamp, ENMO, time_interval)
-    _, angle_z_stats = get_stats(timestamp, angle_z, time_interval)
-    timestamp_agg, LIDS_stats = get_stats(timestamp, LIDS, time_interval)
-    feat = np.hstack((ENMO_stats, angle_z_stats, LIDS_stats))
-    end = time.time()
-
-    # Get nonwear for each interval
-    nonwear = np.array(fh['Nonwear'])
-    nonwear_agg = get_dominant_categ(timestamp, nonwear, time_interval, default=True)
-    
-    # Standardize label names for both datasets
-    # Get label for each interval
-    label = np.array([x.decode('utf8') for x in np.array(fh['SleepState'])],
-                     dtype=object)
-    label[label == 'W'] = 'Wake'
-    label[label == 'N1'] = 'NREM 1'
-    label[label == 'N2'] = 'NREM 2'
-    label[label == 'N3'] = 'NREM 3'
-    label[label == 'R'] = 'REM'
-    label[label == 'Wakefulness'] = 'Wake'
-    label_agg = get_dominant_categ(timestamp, label, time_interval)
-    label_agg[(np.isin(label_agg, states, invert=True))
-              & (nonwear_agg == True)] = 'Nonwear'
-
-    # Get valid timestamps, features and labels
-    timestamp_valid = timestamp_agg[label_agg != 'NaN'].reshape(-1,1)
-    feat_valid = feat[label_agg != 'NaN',:]
-    label_valid = label_agg[label_agg != 'NaN'].reshape(-1,1)
-    
-    # Write features to CSV file
-    data = np.hstack((timestamp_valid.reshape(-1,1), feat_valid, label_valid.reshape(-1,1)))
-    cols = ['timestamp','ENMO_mean','ENMO_std','ENMO_range','ENMO_mad',
-            'ENMO_entropy1','ENMO_entropy2','ENMO_prev30diff','ENMO_next30diff',
-            'ENMO_prev60diff', 'ENMO_next60diff', 'ENMO_prev120diff', 'ENMO_next120diff',  
-            'angz_mean','angz_std','angz_range','angz_mad',
-            'angz_entropy1','angz_entropy2','angz_prev30diff','angz_next30diff', 
-            'angz_prev60diff', 'angz_next60diff', 'angz_prev120diff', 'angz_next120diff',  
-            'LIDS_mean','LIDS_std','LIDS_range','LIDS_mad',
-            'LIDS_entropy1','LIDS_entropy2','LIDS_prev30diff','LIDS_next30diff',
-            'LIDS_prev60diff', 'LIDS_next60diff', 'LIDS_prev120diff', 'LIDS_next120diff', 'label']
-    df = pd.DataFrame(data=data, columns=cols)
-    
-    if dataset == 'Newcastle':
-      user = fname.split('_')[0]
-      position = fname.split('_')[1]
-      dataset = 'Newcastle'        
-    elif dataset == 'UPenn':
-      user = fname.split('.h5')[0][-4:]
-      position = 'NaN'
-      dataset = 'UPenn'
-    elif dataset == 'AMC':
-      user = '_'.join(part for part in fname.split('.h5')[0].split('_')[0:2])
-      position = 'NaN'
-      dataset = 'AMC'
-  
-    df['user'] = user  
-    df['position'] = position
-    df['dataset'] = dataset
-    df['filename'] = fname
-  
-    # Save data to CSV
-    if idx == 0:
-      df.to_csv(os.path.join(outdir,'features_' + str(time_interval) + 's.csv'),
-                sep=',', mode='w', index=False, header=True)
-    else:
-      df.to_csv(os.path.join(outdir,'features_' + str(time_interval) + 's.csv'),
-                sep=',', mode='a', index=False, header=False)
+  # Skip files already processed with same content, parameters and code
+  src_files = [__file__] + [sys.modules[func.__module__].__file__ 
+                            for func in [get_epoch_stats, get_context_feat, get_LIDS, save_features, read_timestamp]]
+  manifest = Manifest(os.path.join(sharddir, 'manifest.json'),
+                      params={'time_interval': time_interval, 'dataset': dataset,
+                              'format': out_format},
+                      version=get_code_version(src_files))
+
+  # Sort files so that merged features are in the same order for every run
+  files = sorted(os.listdir(indir))
+  manifest.prune(files)
+  pending = [fname for fname in files if not manifest.is_done(os.path.join(indir,fname))]
+  print('%d/%d files already processed' % (len(files)-len(pending), len(files)))
+  jobs = [(os.path.join(indir,fname), time_interval, states, dataset, sharddir, out_format)
+          for fname in pending]
+  if num_workers > 1:
+    pool = Pool(processes=num_workers)
+    results = pool.imap_unordered(process_shard, jobs)
+  else:
+    results = map(process_shard, jobs)
+
+  start = time.time(); total_samples = 0
+  for idx,(fname,out_files,nsamples) in enumerate(results):
+    manifest.update(fname, out_files)
+    total_samples += nsamples
+    elapsed = time.time() - start
+    print('Processed %s (%d/%d) - %0.2f files/s, %0.0f samples/s' % 
+          (os.path.basename(fname), idx+1, len(pending), (idx+1)/elapsed, total_samples/elapsed))
+  if num_workers > 1:
+    pool.close()
+    pool.join()
+
+  # Merge shards into features file
+  # Shards are kept so that later runs only process new or changed files
+  if out_format == 'csv':
+    merge_shards(files, sharddir, os.path.join(outdir,'features_' + str(time_interval) + 's.csv'))
     
 if __name__ == "__main__":
   main(sys.argv[1:])
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import sys,os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Sharded container for per-epoch arrays, replacing one .npy file per epoch.
+# Epochs are appended as raw C-order bytes to shard files of about shard_size
+# bytes (shard_<n>.bin) and shard_index.csv maps every epoch name (e.g.
+# <file>_<k> as in labels.txt) to its shard, byte offset, shape and dtype.
+# Shards are memory-mapped by the reader, so epochs are read without copying.
+
+index_name = 'shard_index.csv'
+index_cols = ['filename', 'shard', 'offset', 'seqlen', 'channels', 'dtype']
+
+def get_shard_fname(sharddir, shard):
+  return os.path.join(sharddir, 'shard_{:05d}.bin'.format(shard))
+
+def load_index(sharddir):
+  index_fname = os.path.join(sharddir, index_name)
+  if not os.path.exists(index_fname):
+    return pd.DataFrame(columns=index_cols)
+  return pd.read_csv(index_fname, dtype={'filename': str, 'dtype': str})
+
+# Writer of epochs to shards - epochs already in the index are skipped, so an
+# interrupted conversion can be continued. The index is saved whenever a shard
+# is completed and after every checkpoint_epochs written epochs, and a reopened
+# writer starts a new shard after the last indexed one, so only epochs written
+# after the last save are written again.
+class ShardWriter(object):
+  def __init__(self, sharddir, shard_size=256*2**20, checkpoint_epochs=10000):
+    'Initialization'
+    self.sharddir = sharddir
+    self.shard_size = shard_size
+    self.checkpoint_epochs = checkpoint_epochs
+    self.unsaved = 0
+    if not os.path.exists(sharddir):
+      os.makedirs(sharddir)
+    index = load_index(sharddir)
+    self.rows = index.values.tolist()
+    self.names = set(index['filename'])
+    self.shard = int(index['shard'].max()) + 1 if len(index) else 0
+    self.fp = None
+
+  def __contains__(self, name):
+    return name in self.names
+
+  def new_shard(self):
+    'Close current shard and start next one'
+    if self.fp is not None:
+      self.save_index()
+      self.fp.close()
+      self.shard += 1
+    self.fp = open(get_shard_fname(self.sharddir, self.shard), 'wb')
+
+  def save_index(self):
+    'Flush current shard and atomically replace index with all written epochs'
+    if self.fp is not None:
+      self.fp.flush()
+      os.fsync(self.fp.fileno())
+    index_fname = os.path.join(self.sharddir, index_name)
+    pd.DataFrame(self.rows, columns=index_cols).to_csv(index_fname + '.tmp', index=False)
+    os.replace(index_fname + '.tmp', index_fname)
+    self.unsaved = 0
+
+  def write(self, names, data):
+    'Append epochs (num_epochs x seqlen x channels) with given names'
+    data = np.ascontiguousarray(data)
+    rec_bytes = data[0].nbytes if len(data) else 0
+    pos = 0
+    while pos < len(data):
+      if self.fp is None:
+        self.new_shard()
+      # Number of epochs that fit into current shard - at least one per shard
+      nfit = (self.shard_size - self.fp.tell()) // rec_bytes
+      if nfit <= 0 and self.fp.tell() > 0:
+        self.new_shard()
+        continue
+      num = min(len(data) - pos, max(1, nfit))
+      offset = self.fp.tell()
+      self.fp.write(data[pos:pos+num].tobytes())
+      for k in range(num):
+        self.rows.append([names[pos+k], self.shard, offset + k*rec_bytes,
+                          data.shape[1], data.shape[2], data.dtype.str])
+        self.names.add(names[pos+k])
+      pos += num
+      self.unsaved += num
+    if self.unsaved >= self.checkpoint_epochs:
+      self.save_index()
+
+  def close(self):
+    'Close shard and save index'
+    self.save_index()
+    if self.fp is not None:
+      self.fp.close()
+      self.fp = None
+      self.shard += 1 # never append to a closed shard
+
+# Reader for random access to epochs by name or position in the index
+class ShardReader(object):
+  def __init__(self, sharddir):
+    'Initialization'
+    self.sharddir = sharddir
+    self.index = load_index(sharddir)
+    self.positions = pd.Index(self.index['filename'])
+    self.shard = self.index['shard'].values
+    self.offset = self.index['offset'].values
+    self.shape = self.index[['seqlen', 'channels']].values
+    self.dtype = self.index['dtype'].values
+    self.shards = {}
+
+  def __len__(self):
+    return len(self.index)
+
+  def get_shard(self, shard):
+    'Memory map of shard'
+    if shard not in self.shards:
+      self.shards[shard] = np.memmap(get_shard_fname(self.sharddir, shard), mode='r', dtype=np.uint8)
+    return self.shards[shard]
+
+  def get(self, pos):
+    'Get epoch at given position as read-only view of its shard'
+    return np.ndarray(tuple(self.shape[pos]), dtype=np.dtype(self.dtype[pos]),
+                      buffer=self.get_shard(self.shard[pos]), offset=self.offset[pos])
+
+  def get_positions(self, names):
+    'Get positions of epochs with given names'
+    positions = self.positions.get_indexer(names)
+    if (positions < 0).any():
+      raise KeyError('Epochs not found in shards: ' + ', '.join(np.asarray(names)[positions < 0][:5]))
+    return positions
+
+  def read(self, positions, out=None):
+    'Read epochs at given positions (of same shape) as batch'
+    positions = np.asarray(positions, dtype=int)
+    if out is None:
+      out = np.zeros((len(positions),) + tuple(self.shape[positions[0]]), dtype=np.dtype(self.dtype[positions[0]]))
+    # Read epochs in shard order for sequential disk access
+    for k in np.lexsort((self.offset[positions], self.shard[positions])):
+      out[k] = self.get(positions[k])
+    return out
+
+  def read_names(self, names, out=None):
+    'Read epochs with given names as batch'
+    return self.read(self.get_positions(names), out=out)
+
+# Migrate a directory of per-epoch .npy files listed in labels.txt to shards
+# in the same directory, optionally removing the .npy files afterwards
+def migrate(indir, sharddir=None, remove=False, shard_size=256*2**20):
+  sharddir = indir if sharddir is None else sharddir
+  labels = pd.read_csv(os.path.join(indir, 'labels.txt'), sep='\t', dtype={'filename': str})
+  writer = ShardWriter(sharddir, shard_size=shard_size)
+  names = [name for name in labels['filename'] if name not in writer]
+  for idx,name in enumerate(names):
+    writer.write([name], np.load(os.path.join(indir, name + '.npy'))[np.newaxis])
+    if (idx+1) % 10000 == 0:
+      print('Migrated %d/%d epochs' % (idx+1, len(names)))
+  writer.close()
+  if sharddir != indir:
+    labels.to_csv(os.path.join(sharddir, 'labels.txt'), sep='\t', index=False)
+  if remove:
+    for name in labels['filename']:
+      fname = os.path.join(indir, name + '.npy')
+      if os.path.exists(fname):
+        os.remove(fname)
+
+# Unpack shards to per-epoch .npy files (e.g. for readers of .npy files),
+# skipping epochs whose .npy file already exists
+def unpack(sharddir, outdir=None):
+  outdir = sharddir if outdir is None else outdir
+  if not os.path.exists(outdir):
+    os.makedirs(outdir)
+  reader = ShardReader(sharddir)
+  for pos,name in enumerate(reader.index['filename']):
+    fname = os.path.join(outdir, name + '.npy')
+    if not os.path.exists(fname):
+      np.save(fname, reader.get(pos))
+    if (pos+1) % 10000 == 0:
+      print('Unpacked %d/%d epochs' % (pos+1, len(reader)))
+  if outdir != sharddir:
+    shutil.copy(os.path.join(sharddir, 'labels.txt'), os.path.join(outdir, 'labels.txt'))
+
+def main(argv):
+  indir = argv[0] # directory with labels.txt and per-epoch .npy files (or shards with --unpack)
+  outdir = argv[1] if len(argv) > 1 and not argv[1].startswith('--') else None
+  if '--unpack' in argv:
+    unpack(indir, outdir=outdir)
+  else:
+    migrate(indir, sharddir=outdir, remove='--remove' in argv)
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# Get start times (int64 ns) of all epochs spanned by sorted timestamps (int64 ns)
+# Epochs are aligned to midnight of the first day, same as pandas resample,
+# so that epoch start times match those of DataFrame.resample(str(interval)+'S')
+def get_epoch_grid(ts, time_interval):
+  freq = int(round(float(time_interval) * 1e9))
+  day_ns = 24 * 3600 * 10**9
+  origin = (ts[0] // day_ns) * day_ns
+  first = (ts[0] - origin) // freq
+  nepochs = int((ts[-1] - origin) // freq - first) + 1
+  epoch_start = origin + (first + np.arange(nepochs)) * freq
+  return epoch_start, freq
+
+# Assign every sample to an epoch of the given time interval
+def get_epochs(timestamp, time_interval):
+  ts = np.asarray(timestamp, dtype='datetime64[ns]').astype(np.int64)
+  epoch_start, freq = get_epoch_grid(ts, time_interval)
+  epoch_idx = (ts - epoch_start[0]) // freq
+  return epoch_start.astype('datetime64[ns]'), epoch_idx
+
+# Get number of samples and offset of first sample for each epoch
+def get_epoch_bounds(epoch_idx, nepochs):
+  counts = np.bincount(epoch_idx, minlength=nepochs)
+  starts = np.zeros(nepochs, dtype=np.int64)
+  starts[1:] = np.cumsum(counts)[:-1]
+  return starts, counts
+
+# Get raw data of every epoch as (num_epochs x num_timesteps x num_channels)
+# channels: list of 1-D arrays or (num_samples x num_channels) array
+# Epoch boundaries are found with searchsorted on the sorted timestamps. Epochs
+# shorter than num_timesteps (default: median epoch length) are zero-padded at
+# the end and longer ones are truncated. If all epochs have exactly num_timesteps
+# samples and data is a 2-D array, a view of data is returned instead of a copy.
+def get_epoch_slices(timestamp, channels, time_interval, num_timesteps=None):
+  ts = np.asarray(timestamp, dtype='datetime64[ns]').astype(np.int64)
+  epoch_start, freq = get_epoch_grid(ts, time_interval)
+  bounds = np.searchsorted(ts, np.append(epoch_start, epoch_start[-1] + freq))
+  starts = bounds[:-1]; counts = np.diff(bounds)
+  if num_timesteps is None:
+    num_timesteps = int(np.median(counts))
+  nepochs = len(starts)
+
+  if isinstance(channels, np.ndarray) and channels.ndim == 2:
+    channels_list = [channels[:,ch] for ch in range(channels.shape[1])]
+    if (counts == num_timesteps).all():
+      return channels[starts[0]:starts[0]+nepochs*num_timesteps]\
+                     .reshape(nepochs, num_timesteps, channels.shape[1])
+  else:
+    channels_list = [np.asarray(chan) for chan in channels]
+
+  dtype = np.result_type(*channels_list)
+  slices = np.zeros((nepochs, num_timesteps, len(channels_list)), dtype=dtype)
+  steps = np.arange(num_timesteps)
+  valid = steps < np.minimum(counts, num_timesteps).reshape(-1,1)
+  samp_idx = (starts.reshape(-1,1) + steps)[valid]
+  for ch,chan in enumerate(channels_list):
+    slices[:,:,ch][valid] = chan[samp_idx]
+  return slices
+
+# Entropy of equal-width histogram of every epoch (same binning as np.histogram)
+def get_epoch_entropy(data, epoch_idx, feat_min, feat_max, counts, bins=20):
+  nepochs = len(counts)
+  lo = feat_min.copy(); hi = feat_max.copy()
+  flat = lo == hi
+  lo[flat] -= 0.5; hi[flat] += 0.5
+  step = (hi - lo) / bins
+  samp_lo = lo[epoch_idx]; samp_step = step[epoch_idx]
+  bin_idx = ((data - samp_lo) * (bins / (hi - lo))[epoch_idx]).astype(np.intp)
+  bin_idx[bin_idx == bins] -= 1
+  # Correct for floating point errors at bin edges
+  bin_idx[data < bin_idx * samp_step + samp_lo] -= 1
+  incr = (data >= (bin_idx + 1) * samp_step + samp_lo) & (bin_idx != bins - 1)
+  bin_idx[incr] += 1
+  hist = np.bincount(epoch_idx * bins + bin_idx, minlength=nepochs * bins)
+  p = hist.reshape(nepochs, bins) / counts.reshape(-1,1).astype(float)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ent = -np.sum(np.where(p > 0, p * np.log(p), 0.0), axis=1)
+  return ent
+
+# Compute mean, std, range, mad and entropies of a signal for all epochs at once
+def get_epoch_stats(data, epoch_idx, nepochs):
+  data = np.asarray(data, dtype=np.float64)
+  starts, counts = get_epoch_bounds(epoch_idx, nepochs)
+  valid = counts > 0
+  nsamp = counts.astype(float)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    feat_mean = np.bincount(epoch_idx, weights=data, minlength=nepochs) / nsamp
+    dev = data - feat_mean[epoch_idx]
+    feat_std = np.sqrt(np.bincount(epoch_idx, weights=dev*dev, minlength=nepochs) / (nsamp - 1))
+    feat_mad = np.bincount(epoch_idx, weights=np.absolute(dev), minlength=nepochs) / nsamp
+  feat_std[counts < 2] = np.nan
+  del dev
+
+  feat_min = np.full(nepochs, np.nan); feat_max = np.full(nepochs, np.nan)
+  if valid.any():
+    feat_min[valid] = np.minimum.reduceat(data, starts[valid])
+    feat_max[valid] = np.maximum.reduceat(data, starts[valid])
+  feat_range = feat_max - feat_min
+
+  feat_ent1 = np.full(nepochs, np.nan); feat_ent2 = np.full(nepochs, np.nan)
+  if valid.any():
+    feat_ent1[valid] = get_epoch_entropy(data, epoch_idx, feat_min, feat_max, counts, bins=20)[valid]
+    feat_ent2[valid] = get_epoch_entropy(data, epoch_idx, feat_min, feat_max, counts, bins=200)[valid]
+
+  return np.vstack((feat_mean, feat_std, feat_range, feat_mad, feat_ent1, feat_ent2)).T
+
+# Get dominant category of every epoch, or default if no category occurs in at
+# least threshold fraction of the epoch or the epoch has no samples
+# Categories are integer coded and counted for all epochs with one bincount
+def get_epoch_categ(categ, epoch_idx, nepochs, default='NaN', threshold=0.7):
+  codes, uniques = pd.factorize(np.asarray(categ), use_na_sentinel=False)
+  ncateg = max(1, len(uniques))
+  counts = np.bincount(epoch_idx * ncateg + codes, minlength=nepochs * ncateg)
+  counts = counts.reshape(nepochs, ncateg)
+  best = counts.argmax(axis=1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    frac = counts[np.arange(nepochs), best] / counts.sum(axis=1).astype(float)
+  dominant = frac >= threshold
+  dom_categ = np.empty(nepochs, dtype=object)
+  dom_categ[:] = default
+  dom_categ[dominant] = np.asarray(uniques, dtype=object)[best[dominant]]
+  return dom_categ
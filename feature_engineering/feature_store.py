@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+# Columnar feature store - one Parquet file per input file, partitioned by
+# dataset and user: <storedir>/dataset=<dataset>/user=<user>/<filename>.parquet
+# Features are stored as float64, timestamps as datetime64 and the remaining
+# columns as strings, so no values are round-tripped through text.
+
+str_cols = ['label', 'user', 'position', 'dataset', 'filename']
+
+# Convert feature data frame to typed columns
+def get_typed_features(df):
+  df = df.copy()
+  for col in df.columns:
+    if col == 'timestamp':
+      df[col] = pd.to_datetime(df[col])
+    elif col in str_cols:
+      df[col] = df[col].astype(str)
+    else:
+      df[col] = df[col].astype(np.float64)
+  return df
+
+def get_partition_dir(storedir, dataset, user):
+  return os.path.join(storedir, 'dataset=' + str(dataset), 'user=' + str(user))
+
+# Save features of one input file to feature store and return saved files
+def save_features(df, storedir, name):
+  df = get_typed_features(df)
+  out_files = []
+  for (dataset, user), part_df in df.groupby(['dataset', 'user'], sort=False):
+    partdir = get_partition_dir(storedir, dataset, user)
+    if not os.path.exists(partdir):
+      os.makedirs(partdir)
+    out_fname = os.path.join(partdir, name + '.parquet')
+    # Write to temporary file first so that an interrupted run leaves no partial file
+    part_df.reset_index(drop=True).to_parquet(out_fname + '.tmp', index=False)
+    os.replace(out_fname + '.tmp', out_fname)
+    out_files.append(out_fname)
+  return out_files
+
+# Get feature files in store for given datasets and users
+def list_feature_files(storedir, datasets=None, users=None):
+  files = []
+  for partdir in sorted(glob.glob(os.path.join(storedir, 'dataset=*', 'user=*'))):
+    dataset = os.path.basename(os.path.dirname(partdir))[len('dataset='):]
+    user = os.path.basename(partdir)[len('user='):]
+    if datasets is not None and dataset not in datasets:
+      continue
+    if users is not None and user not in users:
+      continue
+    files.extend(sorted(glob.glob(os.path.join(partdir, '*.parquet'))))
+  return files
+
+# Read only the given columns of the given datasets and users from store
+def read_features(storedir, columns=None, datasets=None, users=None):
+  files = list_feature_files(storedir, datasets=datasets, users=users)
+  if len(files) == 0:
+    return pd.DataFrame(columns=columns)
+  return pd.concat([pd.read_parquet(fname, columns=columns) for fname in files],
+                   ignore_index=True)
+
+# Load features either from a feature store directory or from a CSV file
+def load_features(path, columns=None, datasets=None, users=None):
+  if os.path.isdir(path):
+    return read_features(path, columns=columns, datasets=datasets, users=users)
+  usecols = None
+  if columns is not None: # also read columns needed for selecting datasets and users
+    usecols = list(columns)
+    if datasets is not None and 'dataset' not in usecols:
+      usecols.append('dataset')
+    if users is not None and 'user' not in usecols:
+      usecols.append('user')
+  df = pd.read_csv(path, usecols=usecols, dtype={col:object for col in str_cols})
+  if datasets is not None:
+    df = df[df['dataset'].isin(datasets)].reset_index(drop=True)
+  if users is not None:
+    df = df[df['user'].isin(users)].reset_index(drop=True)
+  if columns is not None:
+    df = df[list(columns)]
+  return df
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import multiprocessing
+from multiprocessing.connection import wait
+import numpy as np
+import joblib
+from joblib.externals.loky import get_reusable_executor
+
+# Scheduler for outer cross-validation folds
+# Every pending fold runs in its own (non-daemonic) process, so that a crash
+# only loses that fold and inner parallel steps (SMOTE, hyperparameter search)
+# can still use joblib workers. Up to core_budget // fold_jobs folds run
+# concurrently with fold_jobs cores each. The result of a fold is saved to
+# resultdir as soon as the fold finishes, together with a key of its split and
+# parameters, so that a rerun loads completed folds instead of running them again.
+# Processes are forked, so fold functions can use data of the calling process.
+
+# Get hash of the contents of arrays (e.g. features and labels)
+def get_array_hash(*arrays):
+  sha = hashlib.sha1()
+  for arr in arrays:
+    arr = np.asarray(arr)
+    if arr.dtype == object:
+      arr = arr.astype(str)
+    sha.update(str((arr.shape, arr.dtype.str)).encode())
+    sha.update(np.ascontiguousarray(arr).tobytes())
+  return sha.hexdigest()[:16]
+
+# Run fold function and save its result atomically
+def run_fold(fold_fn, fold, train_indices, test_indices, n_jobs, fname, key):
+  try:
+    result = fold_fn(fold, train_indices, test_indices, n_jobs)
+    joblib.dump({'key': key, 'result': result}, fname + '.tmp')
+    os.replace(fname + '.tmp', fname)
+  finally:
+    # Stop joblib workers of the fold, otherwise the fold process waits for them on exit
+    get_reusable_executor().shutdown(wait=True)
+
+class FoldScheduler(object):
+  def __init__(self, resultdir, name, core_budget=None, fold_jobs=None, params=None):
+    'Initialization - fold_jobs defaults to an equal share of core_budget per fold'
+    self.resultdir = resultdir
+    self.name = name
+    self.core_budget = os.cpu_count() if core_budget is None else core_budget
+    self.fold_jobs = fold_jobs
+    self.params = {} if params is None else params
+    if not os.path.exists(resultdir):
+      os.makedirs(resultdir)
+
+  def get_fold_file(self, fold):
+    return os.path.join(self.resultdir, 'fold'+str(fold)+'_'+self.name+'_result.sav')
+
+  def get_fold_key(self, train_indices, test_indices):
+    'Get key identifying split and parameters of a fold'
+    sha = hashlib.sha1()
+    sha.update(json.dumps(self.params, sort_keys=True, default=str).encode())
+    sha.update(np.ascontiguousarray(train_indices, dtype=np.int64).tobytes())
+    sha.update(np.ascontiguousarray(test_indices, dtype=np.int64).tobytes())
+    return sha.hexdigest()
+
+  def load_result(self, fold, key):
+    'Load saved result of a fold if it was computed with the same key'
+    fname = self.get_fold_file(fold)
+    if not os.path.exists(fname):
+      return None
+    try:
+      saved = joblib.load(fname)
+    except Exception:
+      return None
+    return saved if saved['key'] == key else None
+
+  def run(self, fold_fn, splits):
+    '''Run fold_fn(fold, train_indices, test_indices, n_jobs) for every split
+       not completed yet and return results of all folds in split order'''
+    splits = list(splits)
+    keys = [self.get_fold_key(train_indices, test_indices) for train_indices, test_indices in splits]
+    pending = []
+    for fold in range(1, len(splits)+1):
+      if self.load_result(fold, keys[fold-1]) is None:
+        pending.append(fold)
+      else:
+        print('Fold'+str(fold)+' - loaded completed fold')
+    fold_jobs = self.fold_jobs
+    if fold_jobs is None:
+      fold_jobs = max(1, self.core_budget // max(1, len(pending)))
+    max_folds = max(1, self.core_budget // fold_jobs)
+
+    ctx = multiprocessing.get_context('fork')
+    running = {}; failed = []
+    while pending or running:
+      while pending and len(running) < max_folds:
+        fold = pending.pop(0)
+        train_indices, test_indices = splits[fold-1]
+        proc = ctx.Process(target=run_fold, args=(fold_fn, fold, train_indices, test_indices,
+                                                  fold_jobs, self.get_fold_file(fold), keys[fold-1]))
+        proc.start()
+        running[proc.sentinel] = (fold, proc)
+      for sentinel in wait(list(running.keys())):
+        fold, proc = running.pop(sentinel)
+        proc.join()
+        if proc.exitcode != 0:
+          print('Fold'+str(fold)+' - failed with exit code '+str(proc.exitcode))
+          failed.append(fold)
+    if failed:
+      raise RuntimeError('Folds ' + ', '.join(str(fold) for fold in sorted(failed)) +
+                         ' failed - rerun to resume from completed folds')
+    return [self.load_result(fold, keys[fold-1])['result'] for fold in range(1, len(splits)+1)]
@@ -12,6 +12,7 @@ from sklearn_hierarchical_classification.metrics import multi_labeled, fill_ance
 
 sys.path.append('../analysis/')
 from analysis import cv_save_classification_result
+from feature_store import load_features
 
 def main(argv):
   infile = argv[0]
@@ -20,7 +21,7 @@ def main(argv):
   ensemble = int(argv[3]) # 0 - use best model, 1 - use ensemble
   outdir = argv[4]
 
-  df = pd.read_csv(infile)
+  df = load_features(infile)
   method = 'feat_eng'
   if mode == 'binary':
     states = ['Wake', 'Sleep']
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from collections import Counter
+from sklearn.base import clone
+from joblib import Parallel, delayed
+
+# Oversampling of the data of every group (e.g. user) separately with an
+# imblearn sampler such as SMOTE. Samples are sorted by group once, so every
+# group is a contiguous slice, and resampled groups are written into output
+# arrays preallocated from the class counts of the groups instead of growing
+# the output with one concatenation per group.
+
+# Get number of samples after resampling data with given class counts using
+# a sampling strategy that resamples classes to the size of the majority class
+def get_resampled_size(counts, sampling_strategy):
+  counts = counts[counts > 0]
+  if sampling_strategy in ['all', 'auto', 'not majority']:
+    return len(counts) * counts.max()
+  if sampling_strategy == 'not minority':
+    return (len(counts)-1) * counts.max() + counts.min()
+  if sampling_strategy == 'minority':
+    return counts.sum() - counts.min() + counts.max()
+  raise ValueError('Sampling strategy ' + str(sampling_strategy) + ' is not supported for group resampling')
+
+# Resample data of one group, returning None if the sampler fails
+def resample_group(sampler, X, y):
+  try:
+    return sampler.fit_resample(X, y)
+  except Exception:
+    return None
+
+# Resample data of every group with more than one class and return resampled
+# data, labels and groups. Groups are resampled by n_jobs parallel workers.
+def resample_groups(sampler, X, y, groups, n_jobs=1):
+  X = np.asarray(X); y = np.asarray(y); groups = np.asarray(groups)
+  order = np.argsort(groups, kind='stable')
+  X = X[order]; y = y[order]; groups = groups[order]
+  grp_names, grp_starts, grp_sizes = np.unique(groups, return_index=True, return_counts=True)
+  classes, y_idx = np.unique(y, return_inverse=True)
+  grp_ids = np.repeat(np.arange(len(grp_names)), grp_sizes)
+  counts = np.bincount(grp_ids*len(classes) + y_idx,
+                       minlength=len(grp_names)*len(classes)).reshape(len(grp_names), len(classes))
+
+  tasks = []; num_samples = 0
+  for i,name in enumerate(grp_names):
+    if (counts[i] > 0).sum() == 1:
+      print('%d/%d: %s has only one class' % (i+1,len(grp_names),name))
+      print(Counter(y[grp_starts[i]:grp_starts[i]+grp_sizes[i]]))
+      continue
+    tasks.append(i)
+    num_samples += get_resampled_size(counts[i], sampler.sampling_strategy)
+
+  X_resamp = np.empty((num_samples,) + X.shape[1:], dtype=X.dtype)
+  y_resamp = np.empty((num_samples,), dtype=y.dtype)
+  groups_resamp = np.empty((num_samples,), dtype=groups.dtype)
+  pos = 0
+  batch_size = max(1, n_jobs) * 4
+  with Parallel(n_jobs=n_jobs) as parallel:
+    for st_idx in range(0, len(tasks), batch_size):
+      batch = tasks[st_idx:st_idx+batch_size]
+      results = parallel(delayed(resample_group)(clone(sampler),
+                                                 X[grp_starts[i]:grp_starts[i]+grp_sizes[i]],
+                                                 y[grp_starts[i]:grp_starts[i]+grp_sizes[i]]) for i in batch)
+      for i,result in zip(batch, results):
+        if result is None:
+          print('%d/%d: %s failed to fit' % (i+1,len(grp_names),grp_names[i]))
+          print(Counter(y[grp_starts[i]:grp_starts[i]+grp_sizes[i]]))
+          continue
+        grp_X, grp_y = result
+        X_resamp[pos:pos+len(grp_X)] = grp_X
+        y_resamp[pos:pos+len(grp_X)] = grp_y
+        groups_resamp[pos:pos+len(grp_X)] = grp_names[i]
+        pos += len(grp_X)
+  # Groups that failed to fit leave unused space at the end
+  return X_resamp[:pos], y_resamp[:pos], groups_resamp[:pos]
@@ -6,7 +6,6 @@ import joblib
 
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import RandomizedSearchCV
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, make_scorer
 from sklearn.model_selection import GroupKFold, StratifiedKFold
@@ -18,6 +17,10 @@ from sklearn_hierarchical_classification.metrics import h_fbeta_score, multi_lab
 
 sys.path.append('../analysis/')
 from analysis import cv_save_classification_result, custom_h_fbeta
+from feature_store import load_features
+from fold_scheduler import FoldScheduler, get_array_hash
+from hyperparam_search import get_search, fit_search
+from manifest import get_code_version
 from tqdm import tqdm
 import networkx as nx
 from networkx import DiGraph
@@ -31,14 +34,19 @@ def main(argv):
   infile = argv[0]
   dataset = argv[1]
   outdir = argv[2]
+  num_cores = int(argv[3]) if len(argv) > 3 else os.cpu_count() # core budget for all outer folds
+  fold_jobs = int(argv[4]) if len(argv) > 4 else None # cores per fold - default: equal share of budget
+  search = argv[5] if len(argv) > 5 else 'random' # hyperparameter search: random or halving
+  if search not in ['random', 'halving']:
+    # Warm-start search grows forests directly, not the base forests of the hierarchical classifier
+    raise ValueError('Unknown search ' + search + ' - use random or halving for hierarchical classification')
 
   resultdir = os.path.join(outdir, 'models')
   if not os.path.exists(resultdir):
     os.makedirs(resultdir)
 
-  # Read data file and retain data only corresponding to 5 sleep states
-  df = pd.read_csv(infile, dtype={'label':object, 'user':object,\
-                   'position':object, 'dataset':object})
+  # Read data file (CSV or feature store) and retain data only corresponding to 5 sleep states
+  df = load_features(infile)
   states = ['Wake','NREM 1','NREM 2','NREM 3','REM','Nonwear']
   df = df[df['label'].isin(states)].reset_index()
   
@@ -80,12 +88,9 @@ def main(argv):
   outer_cv_splits = 5; inner_cv_splits = 5
   factor = 10.0
   
-  # Outer CV
+  # Outer CV - folds run in parallel processes and completed folds are saved
   group_kfold = GroupKFold(n_splits=outer_cv_splits)
-  out_fold = 0
-  hierarchical_pred = []
-  for train_indices, test_indices in group_kfold.split(X,y,groups):
-    out_fold += 1
+  def process_fold(out_fold, train_indices, test_indices, n_jobs):
     print('Processing fold ' + str(out_fold))
     out_fold_X_train = X[train_indices,:]; out_fold_X_test = X[test_indices,:]
     out_fold_y_train = y[train_indices]; out_fold_y_test = y[test_indices]
@@ -96,7 +101,7 @@ def main(argv):
     # Create a pipeline with scaler and hierarchical classifier
     pipe = Pipeline([('scaler', StandardScaler()),
                      ('clf', HierarchicalClassifier(
-                        base_estimator=RandomForestClassifier(random_state=0, n_estimators=100, n_jobs=-1),
+                        base_estimator=RandomForestClassifier(random_state=0, n_estimators=100, n_jobs=1), # search uses the fold's cores
                         class_hierarchy=class_hierarchy,
                         prediction_depth='mlnp',
                         progress_wrapper=tqdm,
@@ -115,10 +120,9 @@ def main(argv):
     print('Training')        
     search_params = {'clf__base_estimator__n_estimators':[50,100,200,300,500,700], \
          'clf__base_estimator__max_depth': [5,10,15,None]}
-    cv_clf = RandomizedSearchCV(estimator=pipe, param_distributions=search_params, \
-                       cv=custom_cv_indices, scoring=make_scorer(custom_h_fbeta,graph=graph), n_iter=5, \
-                       n_jobs=-1, verbose=1)
-    cv_clf.fit(out_fold_X_train, out_fold_y_train)
+    cv_clf = get_search(pipe, search_params, custom_cv_indices, make_scorer(custom_h_fbeta,graph=graph),
+                        n_iter=5, search=search, n_jobs=n_jobs, verbose=1)
+    fit_search(cv_clf, out_fold_X_train, out_fold_y_train, name='Fold'+str(out_fold)+':')
     joblib.dump(cv_clf, os.path.join(resultdir,\
                 'fold'+str(out_fold)+'_hierarchical_RF.sav'))
     print('Predicting')
@@ -138,8 +142,20 @@ def main(argv):
         old_idx = classes.index(label)
         y_pred_prob_[:,new_idx] = out_fold_y_pred_prob[:,old_idx]
 
-      hierarchical_pred.append((out_fold_users_test, out_fold_ts_test, out_fold_fnames_test,
-                                y_test_, y_pred_prob_))
+      return {'pred': (out_fold_users_test, out_fold_ts_test, out_fold_fnames_test,
+                       y_test_, y_pred_prob_), 'states': states}
+
+  # Fold results are kept apart from models, as scripts select models by mode in their name
+  folddir = os.path.join(outdir, 'folds')
+  # Completed folds are reused only if the driver and the modules that compute them are unchanged
+  src_files = [__file__] + [sys.modules[func.__module__].__file__
+                            for func in [get_search, FoldScheduler]]
+  scheduler = FoldScheduler(folddir, 'hierarchical_RF', core_budget=num_cores, fold_jobs=fold_jobs,
+                            params={'feat_cols': feat_cols, 'search': search, 'data': get_array_hash(X, y, groups),
+                                    'version': get_code_version(src_files)})
+  fold_results = scheduler.run(process_fold, group_kfold.split(X,y,groups))
+  hierarchical_pred = [result['pred'] for result in fold_results]
+  states = fold_results[-1]['states']
 
   cv_save_classification_result(hierarchical_pred, states,
                                 os.path.join(outdir, 'hierarchical_classification_results.csv'),
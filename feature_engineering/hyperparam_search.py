@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import RandomizedSearchCV, ParameterGrid
+from sklearn.experimental import enable_halving_search_cv # noqa - enables HalvingRandomSearchCV
+from sklearn.model_selection import HalvingRandomSearchCV
+
+# Get hyperparameter search over n_iter random configurations of param_distributions
+# - random:  every configuration is evaluated on all training samples of the inner folds
+# - halving: successive halving - all configurations are evaluated on a fraction
+#            of the training samples of every inner fold and only the best 1/factor
+#            of them are evaluated again on factor times more samples, until the
+#            remaining configurations are evaluated on all samples
+# - warmstart: all combinations of the parameters are evaluated, growing one
+#            forest per combination of the other parameters and inner fold
+#            (see WarmStartForestSearchCV) - for forests only. n_iter is only
+#            used to report the trees fitted compared to the random search.
+# All use the same inner folds (e.g. group splits as list of indices) and scorer.
+def get_search(estimator, param_distributions, cv, scoring, n_iter=10, search='random',
+               factor=3, n_jobs=None, verbose=0):
+  if search == 'random':
+    return RandomizedSearchCV(estimator=estimator, param_distributions=param_distributions,
+                              cv=cv, scoring=scoring, n_iter=n_iter, n_jobs=n_jobs, verbose=verbose)
+  elif search == 'halving':
+    return HalvingRandomSearchCV(estimator=estimator, param_distributions=param_distributions,
+                                 cv=cv, scoring=scoring, n_candidates=n_iter, factor=factor,
+                                 resource='n_samples', min_resources='exhaust',
+                                 n_jobs=n_jobs, verbose=verbose)
+  elif search == 'warmstart':
+    return WarmStartForestSearchCV(estimator, param_distributions, cv, scoring,
+                                   n_iter=n_iter, n_jobs=n_jobs, verbose=verbose)
+  raise ValueError('Unknown search ' + search + ' - use random, halving or warmstart')
+
+# Grow forest on training samples of an inner fold to every number of trees
+# in n_estimators (ascending) and score it on the test samples after every step
+def grow_forest(estimator, params, n_estimators, X, y, train_idx, test_idx, scorer):
+  forest = clone(estimator).set_params(warm_start=True, **params)
+  X_train = X[train_idx]; y_train = y[train_idx]
+  X_test = X[test_idx]; y_test = y[test_idx]
+  scores = []
+  for n in n_estimators:
+    forest.set_params(n_estimators=n)
+    forest.fit(X_train, y_train)
+    scores.append(scorer(forest, X_test, y_test))
+  return scores
+
+# Grid search over parameters of a forest (e.g. RandomForestClassifier) that
+# fits the largest forest only once per combination of the other parameters
+# and inner fold. The forest is grown with warm start through the n_estimators
+# candidates and scored after every step. Trees are seeded in sequence from
+# random_state, so the first n trees of a forest are the forest fitted with
+# n_estimators=n and scores equal those of separately fitted forests.
+# n_iter is the number of combinations of the random search that is replaced,
+# for which the expected number of fitted trees is reported.
+class WarmStartForestSearchCV(object):
+  def __init__(self, estimator, param_grid, cv, scoring, n_iter=10, n_jobs=None, verbose=0):
+    'Initialization - param_grid must contain n_estimators'
+    self.estimator = estimator
+    self.param_grid = param_grid
+    self.cv = cv
+    self.scoring = scoring
+    self.n_iter = n_iter
+    self.n_jobs = n_jobs
+    self.verbose = verbose
+
+  def fit(self, X, y):
+    'Evaluate all parameter combinations on inner folds and refit best one on all samples'
+    n_estimators = sorted(self.param_grid['n_estimators'])
+    other_grid = list(ParameterGrid({key: val for key, val in self.param_grid.items()
+                                     if key != 'n_estimators'}))
+    splits = list(self.cv)
+    scorer = check_scoring(self.estimator, scoring=self.scoring)
+    scores = Parallel(n_jobs=self.n_jobs, verbose=self.verbose)(
+                delayed(grow_forest)(self.estimator, params, n_estimators, X, y,
+                                     train_idx, test_idx, scorer)
+                for params in other_grid for train_idx, test_idx in splits)
+    # Scores of every parameter combination (other params x n_estimators) on every fold
+    scores = np.array(scores).reshape(len(other_grid), len(splits), len(n_estimators))
+    scores = scores.transpose(0, 2, 1).reshape(-1, len(splits))
+    self.cv_results_ = {'params': [dict(params, n_estimators=n) for params in other_grid for n in n_estimators],
+                        'mean_test_score': scores.mean(axis=1), 'std_test_score': scores.std(axis=1)}
+    for k in range(len(splits)):
+      self.cv_results_['split%d_test_score' % k] = scores[:,k]
+    order = np.argsort(-self.cv_results_['mean_test_score'], kind='stable')
+    self.cv_results_['rank_test_score'] = np.empty(len(order), dtype=int)
+    self.cv_results_['rank_test_score'][order] = np.arange(1, len(order)+1)
+    self.best_index_ = order[0]
+    self.best_params_ = self.cv_results_['params'][self.best_index_]
+    self.best_score_ = self.cv_results_['mean_test_score'][self.best_index_]
+    # Trees fitted compared to fitting combinations separately - random search
+    # samples n_iter combinations without replacement, so it fits n_iter times
+    # the mean number of trees of all combinations per fold on average
+    self.n_trees_fitted_ = len(other_grid) * len(splits) * n_estimators[-1]
+    self.n_trees_grid_ = len(other_grid) * len(splits) * sum(n_estimators)
+    self.n_trees_random_ = min(self.n_iter, len(self.cv_results_['params'])) * len(splits) * np.mean(n_estimators)
+    start = time.time()
+    self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+    self.refit_time_ = time.time() - start
+    return self
+
+  def predict(self, X):
+    return self.best_estimator_.predict(X)
+
+  def predict_proba(self, X):
+    return self.best_estimator_.predict_proba(X)
+
+# Estimate time of random search over the same configurations from the results
+# of a halving search. The fit and score time of every configuration on all
+# samples is extrapolated linearly from the largest number of samples it was
+# evaluated on, and the search time is scaled by the resulting amount of work.
+def get_random_search_time(cv_clf, search_time):
+  results = cv_clf.cv_results_
+  times = results['mean_fit_time'] + results['mean_score_time']
+  full_times = {}
+  for params, n_resources, cand_time in zip(results['params'], results['n_resources'], times):
+    full_times[str(params)] = cand_time * cv_clf.max_resources_ / float(n_resources)
+  return search_time * sum(full_times.values()) / times.sum()
+
+# Fit hyperparameter search and report time of search
+# For a halving search, the time saved compared to random search is reported
+def fit_search(cv_clf, X, y, name=''):
+  start = time.time()
+  cv_clf.fit(X, y)
+  refit_time = getattr(cv_clf, 'refit_time_', 0.0)
+  search_time = time.time() - start - refit_time
+  if isinstance(cv_clf, HalvingRandomSearchCV):
+    random_time = get_random_search_time(cv_clf, search_time)
+    print('%s Halving search: %0.1fs (samples per iteration: %s), estimated random search: %0.1fs, saved: %0.1fs (%0.1f%%)'
+          % (name, search_time, cv_clf.n_resources_, random_time,
+             random_time - search_time, (random_time - search_time)*100.0/random_time))
+  elif isinstance(cv_clf, WarmStartForestSearchCV):
+    print('%s Warm-start search: %0.1fs over %d combinations, trees fitted: %d, random search over %d combinations: %d on average (%0.2fx), grid search: %d'
+          % (name, search_time, len(cv_clf.cv_results_['params']), cv_clf.n_trees_fitted_,
+             min(cv_clf.n_iter, len(cv_clf.cv_results_['params'])), cv_clf.n_trees_random_,
+             cv_clf.n_trees_random_/float(cv_clf.n_trees_fitted_), cv_clf.n_trees_grid_))
+  else:
+    print('%s Random search: %0.1fs' % (name, search_time))
+  return cv_clf
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+
+# Get content hash of a file, reading it in blocks
+def get_file_hash(fname, blocksize=2**20):
+  sha = hashlib.sha1()
+  with open(fname, 'rb') as fp:
+    block = fp.read(blocksize)
+    while block:
+      sha.update(block)
+      block = fp.read(blocksize)
+  return sha.hexdigest()
+
+# Get version of the code used for processing as hash of its source files
+def get_code_version(src_files):
+  sha = hashlib.sha1()
+  for fname in sorted(set(os.path.abspath(f) for f in src_files)):
+    with open(fname, 'rb') as fp:
+      sha.update(fp.read())
+  return sha.hexdigest()[:12]
+
+# Manifest of processed input files, saved as JSON in the output directory
+# An input file is considered processed when its content hash, processing
+# parameters and code version match the manifest and its outputs exist
+class Manifest(object):
+  def __init__(self, path, params, version):
+    'Initialization'
+    self.path = path
+    self.params = params
+    self.version = version
+    self.entries = {}
+    if os.path.exists(self.path):
+      with open(self.path, 'r') as fp:
+        self.entries = json.load(fp)
+
+  def get_hash(self, fname):
+    'Get content hash, reusing the saved one if size and mtime are unchanged'
+    name = os.path.basename(fname)
+    fstat = os.stat(fname)
+    entry = self.entries.get(name)
+    if entry is not None and entry['size'] == fstat.st_size and entry['mtime'] == fstat.st_mtime_ns:
+      return entry['hash']
+    return get_file_hash(fname)
+
+  def is_done(self, fname):
+    'Check if file has already been processed with same content, params and code'
+    entry = self.entries.get(os.path.basename(fname))
+    if entry is None:
+      return False
+    if entry['params'] != self.params or entry['version'] != self.version:
+      return False
+    if not all(os.path.exists(out) for out in entry['outputs']):
+      return False
+    if entry['hash'] != self.get_hash(fname):
+      return False
+    # Content is unchanged, refresh size and mtime to avoid rehashing next time
+    fstat = os.stat(fname)
+    if entry['size'] != fstat.st_size or entry['mtime'] != fstat.st_mtime_ns:
+      entry['size'] = fstat.st_size; entry['mtime'] = fstat.st_mtime_ns
+      self.save()
+    return True
+
+  def update(self, fname, outputs):
+    'Record a processed file and save manifest'
+    fstat = os.stat(fname)
+    self.entries[os.path.basename(fname)] = {'hash': self.get_hash(fname),
+                                             'size': fstat.st_size, 'mtime': fstat.st_mtime_ns,
+                                             'params': self.params, 'version': self.version,
+                                             'outputs': outputs}
+    self.save()
+
+  def prune(self, fnames):
+    'Remove entries and outputs of files that are no longer in the input'
+    names = set(os.path.basename(fname) for fname in fnames)
+    for name in [name for name in self.entries if name not in names]:
+      for out in self.entries[name]['outputs']:
+        if os.path.exists(out):
+          os.remove(out)
+      del self.entries[name]
+    self.save()
+
+  def save(self):
+    'Write manifest atomically so that a crash does not corrupt it'
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as fp:
+      json.dump(self.entries, fp, indent=2, sort_keys=True)
+    os.replace(tmp_path, self.path)
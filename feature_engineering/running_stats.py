@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import numpy as np
+import h5py
+from multiprocessing import Pool
+from tensor_store import is_store, open_store
+
+# Streaming mean and standard deviation over samples (first axis)
+# Every batch is reduced to its count, mean and sum of squared deviations (M2),
+# which are merged with the running values (Chan et al.), so the variance is
+# not computed as the difference of two large sums as with sum(X^2)/N - mean^2.
+class RunningStats(object):
+  def __init__(self):
+    'Initialization'
+    self.count = 0
+    self.mean = None
+    self.M2 = None
+
+  def update(self, X):
+    'Add batch of samples'
+    X = np.asarray(X, dtype=np.float64)
+    if len(X) == 0:
+      return self
+    mean = X.mean(axis=0)
+    M2 = ((X - mean)**2).sum(axis=0)
+    return self.merge_moments(len(X), mean, M2)
+
+  def merge(self, other):
+    'Add samples summarized by another RunningStats'
+    return self.merge_moments(other.count, other.mean, other.M2)
+
+  def merge_moments(self, count, mean, M2):
+    'Add count samples with given mean and M2'
+    if count == 0:
+      return self
+    if self.count == 0:
+      self.count = count; self.mean = np.array(mean, dtype=np.float64); self.M2 = np.array(M2, dtype=np.float64)
+      return self
+    total = self.count + count
+    delta = mean - self.mean
+    self.mean = self.mean + delta * (count / float(total))
+    self.M2 = self.M2 + M2 + delta**2 * (self.count * float(count) / total)
+    self.count = total
+    return self
+
+  @property
+  def var(self):
+    return self.M2 / self.count
+
+  @property
+  def std(self):
+    return np.sqrt(self.var)
+
+  def save(self, fname):
+    'Save statistics atomically to npz file'
+    with open(fname + '.tmp', 'wb') as fp:
+      np.savez(fp, count=self.count, mean=self.mean, M2=self.M2, std=self.std)
+    os.replace(fname + '.tmp', fname)
+
+  @classmethod
+  def load(cls, fname):
+    'Load statistics saved with save'
+    stats = cls()
+    with np.load(fname) as data:
+      stats.count = int(data['count']); stats.mean = data['mean']; stats.M2 = data['M2']
+    return stats
+
+# Split sorted sample indices into blocks of whole HDF5 chunks of about
+# block_size samples, so that no chunk is read by more than one block
+def get_chunk_blocks(indices, chunk_len, block_size):
+  chunk_ids = indices // chunk_len
+  chunk_starts = np.flatnonzero(np.diff(chunk_ids)) + 1
+  blocks = []; st_idx = 0
+  for end_idx in list(chunk_starts) + [len(indices)]:
+    if end_idx - st_idx >= block_size or end_idx == len(indices):
+      blocks.append(indices[st_idx:end_idx])
+      st_idx = end_idx
+  return blocks
+
+# HDF5 files and tensor stores opened by the current process
+open_files = {}
+
+# Open dataset of an HDF5 file or data of a tensor store
+def open_dataset(fname, name):
+  if is_store(fname):
+    return open_store(fname)
+  return h5py.File(fname, 'r')[name]
+
+# Get statistics of samples at given (sorted) indices of an HDF5 dataset or tensor store
+def get_block_stats(args):
+  fname, name, indices, n_channels, chunk_len = args
+  if (fname, name) not in open_files:
+    open_files[(fname, name)] = open_dataset(fname, name)
+  dset = open_files[(fname, name)]
+  # Read every run of consecutive chunks that contain selected samples with one
+  # slice, so that chunks between sparse indices are not read
+  chunk_ids = indices // chunk_len
+  run_starts = np.flatnonzero(np.diff(chunk_ids) > 1) + 1
+  samples = []
+  for run in np.split(indices, run_starts):
+    run_data = dset[run[0]:run[-1]+1]
+    if n_channels is not None:
+      run_data = run_data[...,:n_channels]
+    samples.append(run_data[run - run[0]])
+  return RunningStats().update(np.concatenate(samples))
+
+# Get statistics of samples of an HDF5 dataset or tensor store (all or given
+# indices) over the first axis. Blocks of chunks are processed in parallel by workers and merged
+# in order, so the result does not depend on the number of workers.
+def get_dataset_stats(fname, name, indices=None, n_channels=None, workers=1, block_size=1000):
+  dset = open_dataset(fname, name)
+  num_samples = dset.shape[0]
+  chunk_len = dset.chunks[0] if getattr(dset, 'chunks', None) is not None else 1
+  del dset
+  indices = np.arange(num_samples) if indices is None else np.unique(indices)
+  blocks = get_chunk_blocks(indices, chunk_len, block_size)
+  tasks = [(fname, name, block, n_channels, chunk_len) for block in blocks]
+  stats = RunningStats()
+  if workers > 1:
+    pool = Pool(processes=workers)
+    for block_stats in pool.imap(get_block_stats, tasks):
+      stats.merge(block_stats)
+    pool.close(); pool.join()
+  else:
+    for task in tasks:
+      stats.merge(get_block_stats(task))
+  return stats
+
+# Get key identifying statistics of a dataset file, its sample indices and
+# other parameters - the file is identified by path, size and mtime
+def get_stats_key(fname, name, indices=None, **params):
+  sha = hashlib.sha1()
+  fstat = os.stat(fname)
+  sha.update(json.dumps([os.path.abspath(fname), fstat.st_size, fstat.st_mtime_ns, name,
+                         sorted(params.items())]).encode())
+  if indices is not None:
+    sha.update(np.ascontiguousarray(indices, dtype=np.int64).tobytes())
+  return sha.hexdigest()[:16]
+
+# Get statistics of an HDF5 dataset or tensor store, loading them from cache_dir if they have
+# already been computed for the same file and indices
+def get_cached_stats(fname, name, indices=None, n_channels=None, cache_dir=None, workers=1, block_size=1000):
+  cache_file = None
+  if cache_dir is not None:
+    key = get_stats_key(fname, name, None if indices is None else np.unique(indices), n_channels=n_channels)
+    cache_file = os.path.join(cache_dir, 'stats_' + key + '.npz')
+    if os.path.exists(cache_file):
+      return RunningStats.load(cache_file)
+  stats = get_dataset_stats(fname, name, indices=indices, n_channels=n_channels,
+                            workers=workers, block_size=block_size)
+  if cache_file is not None:
+    stats.save(cache_file)
+  return stats
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import sys,os
+import json
+import h5py
+import numpy as np
+import pandas as pd
+
+# Uncompressed tensor store for raw epoch data (num_samples x num_timesteps x
+# num_channels) that can be memory-mapped for zero-copy random access.
+# A store consists of
+#   <name>.npz       - raw C-order array data without header (e.g. rawdata_30.0s.npz)
+#   <name>.json      - shape, dtype, channels and other attributes
+#   <name>_meta.npz  - per-sample labels, users, timestamps and filenames
+# The data file is named .npz for compatibility with existing readers that
+# memory-map rawdata_<interval>s.npz with the shape from datashape_<interval>s.csv
+
+meta_cols = ['label', 'user', 'timestamp', 'filename']
+
+def get_store_files(data_file):
+  base = os.path.splitext(data_file)[0]
+  return base + '.json', base + '_meta.npz'
+
+# Create data file of a store to be filled with samples
+# Data is written to a temporary file until the store is finalized
+def create_store(data_file, shape, dtype=np.float32):
+  return np.memmap(data_file + '.tmp', mode='w+', dtype=dtype, shape=tuple(shape))
+
+# Write sidecar files and move data file of a store created with create_store in place
+def finalize_store(data_file, data, channels=None, meta=None, **attrs):
+  header_file, meta_file = get_store_files(data_file)
+  header = {'shape': list(data.shape), 'dtype': np.dtype(data.dtype).str, 'order': 'C',
+            'channels': channels}
+  header.update(attrs)
+  data.flush()
+  if meta is not None:
+    with open(meta_file + '.tmp', 'wb') as fp:
+      np.savez(fp, **get_sample_meta(meta))
+    os.replace(meta_file + '.tmp', meta_file)
+  os.replace(data_file + '.tmp', data_file)
+  with open(header_file + '.tmp', 'w') as fp:
+    json.dump(header, fp, indent=2)
+  os.replace(header_file + '.tmp', header_file)
+  # Shape file used by analysis scripts
+  if 'rawdata_' in os.path.basename(data_file):
+    shape_file = os.path.join(os.path.dirname(data_file),
+                              os.path.basename(data_file).replace('rawdata_', 'datashape_').replace('.npz', '.csv'))
+    pd.DataFrame({'num_samples': [data.shape[0]], 'num_timesteps': [data.shape[1]],
+                  'num_channels': [data.shape[2]]}).to_csv(shape_file, index=False)
+
+# Get per-sample metadata arrays from a data frame with feature file columns
+# Timestamps are stored as int64 nanoseconds and the other columns as strings
+def get_sample_meta(df):
+  meta = {}
+  for col in meta_cols:
+    if col not in df.columns:
+      continue
+    if col == 'timestamp':
+      meta[col] = pd.DatetimeIndex(pd.to_datetime(df[col])).asi8
+    else:
+      meta[col] = np.asarray(df[col].astype(str).values, dtype=str)
+  return meta
+
+# Open data of a store as read-only memory map
+def open_store(data_file, mode='r'):
+  header = load_store_header(data_file)
+  return np.memmap(data_file, mode=mode, dtype=np.dtype(header['dtype']), shape=tuple(header['shape']))
+
+def load_store_header(data_file):
+  header_file, _ = get_store_files(data_file)
+  with open(header_file, 'r') as fp:
+    return json.load(fp)
+
+# Load per-sample metadata of a store as data frame
+def load_store_meta(data_file):
+  _, meta_file = get_store_files(data_file)
+  with np.load(meta_file) as meta:
+    df = pd.DataFrame({col: meta[col] for col in meta.files})
+  if 'timestamp' in df.columns:
+    df['timestamp'] = df['timestamp'].values.view('datetime64[ns]')
+  return df
+
+# Check if a store exists for given data file
+def is_store(data_file):
+  return os.path.exists(data_file) and os.path.exists(get_store_files(data_file)[0])
+
+# Convert raw data of an HDF5 file to a store, copying blocks of samples so that
+# the data does not need to fit in memory
+def convert_h5(h5_file, data_file, feat_file=None, channels=None, dtype=np.float32, block_size=10000):
+  with h5py.File(h5_file, 'r') as fp:
+    dset = fp['data']
+    data = create_store(data_file, dset.shape, dtype=dtype)
+    for st_idx in range(0, dset.shape[0], block_size):
+      end_idx = min(dset.shape[0], st_idx+block_size)
+      data[st_idx:end_idx] = dset[st_idx:end_idx]
+  meta = None
+  if feat_file is not None:
+    meta = pd.read_csv(feat_file, usecols=lambda col: col in meta_cols, dtype=str)
+    assert len(meta) == data.shape[0], 'Feature file does not match raw data'
+  finalize_store(data_file, data, channels=channels, meta=meta)
+
+def main(argv):
+  h5_file = argv[0] # e.g. rawdata_30.0s.h5
+  feat_file = argv[1] if len(argv) > 1 else None # e.g. features_30.0s.csv for labels, users and timestamps
+  data_file = argv[2] if len(argv) > 2 else os.path.splitext(h5_file)[0] + '.npz'
+  convert_h5(h5_file, data_file, feat_file=feat_file)
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# Timestamps in preprocessed HDF5 files are stored as int64 nanoseconds since
+# the Unix epoch, so that they can be read without parsing every sample.
+# Older files store them as byte strings in timestamp_fmt, these are still read.
+
+timestamp_fmt = '%Y-%m-%d %H:%M:%S.%f'
+
+# Write timestamps (datetime-like sequence) as int64 nanoseconds
+def write_timestamp(hf, name, timestamp, **kwargs):
+  ts = pd.DatetimeIndex(timestamp).asi8
+  dset = hf.create_dataset(name, data=ts, dtype=np.int64, **kwargs)
+  dset.attrs['units'] = 'ns'
+  return dset
+
+# Read timestamps as a datetime64[ns] Series from int64 or legacy string dataset
+def read_timestamp(fh, name='DateTime', fmt=timestamp_fmt):
+  dset = fh[name]
+  if dset.dtype.kind in ('i','u'):
+    return pd.Series(np.asarray(dset, dtype=np.int64).view('datetime64[ns]'))
+  # Legacy files with timestamp strings
+  if dset.dtype.kind == 'S': # fixed-length byte strings are decoded at once
+    timestamp = np.asarray(dset).astype(str)
+  else:
+    timestamp = np.asarray(dset.asstr()[()], dtype=str)
+  return pd.Series(pd.to_datetime(timestamp, format=fmt))
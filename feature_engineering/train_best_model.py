@@ -5,9 +5,10 @@ import joblib
 from sklearn.metrics import precision_recall_fscore_support, average_precision_score
 from imblearn.over_sampling import SMOTE
 
+from feature_store import load_features
+
 def get_features(featfile, mode):
-  df = pd.read_csv(featfile, dtype={'label':object, 'user':object,
-                   'position':object, 'dataset':object})
+  df = load_features(featfile)
   if mode == 'binary':
     states = ['Wake', 'Sleep']
     collate_states = ['NREM 1', 'NREM 2', 'NREM 3', 'REM']
@@ -15,8 +15,10 @@ from imblearn.over_sampling import SMOTE
 sys.path.append('../analysis/')
 from analysis import cv_save_feat_importances_result, cv_save_classification_result
 
+from feature_store import load_features
+
 def get_data(fname, feat_cols, sleep_states, mode='binary'):
-  df = pd.read_csv(fname)  
+  df = load_features(fname, columns=['timestamp','label','user','filename'] + feat_cols)
   if mode == 'binary':
     df.loc[df['label'].isin(['REM','NREM 1','NREM 2','NREM 3']), 'label'] = 'Sleep'
   elif mode == 'nonwear':
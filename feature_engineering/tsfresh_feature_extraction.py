@@ -5,10 +5,13 @@ import numpy as np
 import math
 import pandas as pd
 from scipy.stats import entropy
-from collections import Counter
 from tsfresh import extract_features
 from tsfresh.feature_extraction import ComprehensiveFCParameters, EfficientFCParameters, MinimalFCParameters
 
+from lids import get_LIDS
+from epoch_stats import get_epochs, get_epoch_categ
+from timestamp_io import read_timestamp
+
 # Get Euclidean Norm minus One
 def get_ENMO(x,y,z):
     enorm = np.sqrt(x*x + y*y + z*z)
@@ -22,34 +25,9 @@ def get_tilt_angles(x,y,z):
     angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
     return angle_x, angle_y, angle_z
 
-# Get Locomotor Inactivity During Sleep   
-def get_LIDS(timestamp, ENMO):
-    df = pd.concat((timestamp, pd.Series(ENMO)), axis=1)
-    df.columns = ['timestamp','ENMO']
-    df.set_index('timestamp', inplace=True)
-    
-    df['ENMO_sub'] = np.where(ENMO < 0.02, 0, ENMO-0.02) # assuming ENMO is in g
-    ENMO_sub_smooth = df['ENMO_sub'].rolling('600s').sum() # 10-minute rolling sum
-    df['LIDS_unfiltered'] = 100.0 / (ENMO_sub_smooth + 1.0)
-    LIDS = df['LIDS_unfiltered'].rolling('1800s').mean().values # 30-minute rolling average
-    return LIDS
-
-def get_categ(df, default='NaN'):
-    ctr = Counter(df)
-    for key in ctr:
-        ctr[key] = ctr[key]/float(len(df))
-    dom_categ = ctr.most_common()[0]
-    if dom_categ[1] >= 0.7: # If a category occurs more than 70% of time interval, mark that as dominant category
-        dom_categ = dom_categ[0]
-    else:
-        dom_categ = default
-    return dom_categ
-    
 def get_dominant_categ(timestamp, categ, time_interval, default='NaN'):
-    categ_df = pd.DataFrame(data={'timestamp':timestamp, 'category':categ})
-    categ_df.set_index('timestamp', inplace=True)
-    dom_categ = categ_df.resample(str(time_interval)+'S').apply(get_categ, default=default)
-    return np.array(dom_categ['category'])   
+    epoch_start, epoch_idx = get_epochs(timestamp, time_interval)
+    return get_epoch_categ(categ, epoch_idx, len(epoch_start), default=default)
 
 def get_tsfresh_feat(df, colName=None):
     df = df.reset_index()
@@ -86,8 +64,7 @@ def main(argv):
         x = np.array(fh['X'])
         y = np.array(fh['Y'])
         z = np.array(fh['Z'])
-        timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-        timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+        timestamp = read_timestamp(fh)
         
         # Get ENMO and acceleration angles
         ENMO = get_ENMO(x,y,z)
@@ -4,8 +4,33 @@ import pandas as pd
 import joblib
 
 from features import compute_features
+from rf_ensemble import load_ensemble, get_ensemble_files
 from collections import Counter
 
+# Get class probabilities averaged over the models of given mode, using the
+# ensemble exported with rf_ensemble.py (e.g. nonwear_RF.json and .bin) if it
+# exists in modeldir and the fold model files saved with joblib otherwise
+def predict_mode(feat, modeldir, mode, name):
+  ensemble_name = os.path.join(modeldir, mode + '_RF')
+  if os.path.exists(get_ensemble_files(ensemble_name)[0]):
+    print('Predicting ' + name + ' with ensemble of ' + mode + ' models')
+    return load_ensemble(ensemble_name).predict_proba(feat)
+
+  model_files = [fname for fname in os.listdir(modeldir) if mode in fname and
+                 os.path.splitext(fname)[1] not in ['.json', '.bin']]
+  nfolds = len(model_files)
+  pred = None
+  for fold,fname in enumerate(model_files):
+    print('Predicting ' + name + ' with model ' + str(fold+1))
+    scaler, cv_clf = joblib.load(os.path.join(modeldir, fname))
+    feat_sc = scaler.transform(feat)
+    fold_pred = cv_clf.predict_proba(feat_sc)
+    if fold == 0:
+      pred = fold_pred
+    else:
+      pred = pred + fold_pred
+  return pred/float(nfolds)
+
 def get_sleep_stage(data, time_interval, modeldir, mode):
   if mode == 'binary':
     states = ['Wake', 'Sleep']
@@ -20,38 +45,11 @@ def get_sleep_stage(data, time_interval, modeldir, mode):
   N = feat.shape[0]
 
   # Load nonwear models from given path and make predictions
-  model_files = os.listdir(modeldir)
-  nonwear_files = [fname for fname in model_files if 'nonwear' in fname]
-  nfolds = len(nonwear_files)
-
-  nw_pred = None
-  for fold,fname in enumerate(nonwear_files):
-    print('Predicting nonwear with model ' + str(fold+1))
-    scaler, cv_clf = joblib.load(os.path.join(modeldir, fname))
-    feat_sc = scaler.transform(feat)
-    fold_nw_pred = cv_clf.predict_proba(feat_sc)
-    if fold == 0:
-      nw_pred = fold_nw_pred
-    else:
-      nw_pred = nw_pred + fold_nw_pred
-  nw_pred = nw_pred/float(nfolds)
+  nw_pred = predict_mode(feat, modeldir, 'nonwear', 'nonwear')
   nw_pred = np.argmax(nw_pred, axis=1)
 
   # Load models from given path and make predictions for given mode
-  model_files = [fname for fname in model_files if mode in fname]
-  nfolds = len(model_files)
-
-  y_pred = None
-  for fold,fname in enumerate(model_files):
-    print('Predicting sleep states with model ' + str(fold+1))
-    scaler, cv_clf = joblib.load(os.path.join(modeldir, fname))
-    feat_sc = scaler.transform(feat)
-    fold_y_pred = cv_clf.predict_proba(feat_sc)
-    if fold == 0:
-      y_pred = fold_y_pred
-    else:
-      y_pred = y_pred + fold_y_pred
-  y_pred = y_pred/float(nfolds)
+  y_pred = predict_mode(feat, modeldir, mode, 'sleep states')
   y_pred = np.argmax(y_pred, axis=1)
   y_pred = np.array([states[i] for i in y_pred])
 
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# Locomotor Inactivity During Sleep (LIDS) computed on plain arrays
+# ENMO_sub is summed over a 10-minute rolling window, converted to 100/(sum+1)
+# and averaged over a 30-minute rolling window. Windows are right-closed like
+# pandas time-based rolling windows, i.e. (t-window, t].
+# Data is processed in chunks and only the samples still inside the rolling
+# windows are carried over to the next chunk, so memory use does not grow
+# with the length of the recording.
+class LIDSFilter(object):
+  def __init__(self, sample_rate=None, sum_window=600, mean_window=1800):
+    'Initialization'
+    self.sample_rate = sample_rate
+    self.sum_window = sum_window
+    self.mean_window = mean_window
+    self.reset()
+
+  def reset(self):
+    'Clear samples carried over from previous chunks'
+    self.sub_tail = np.zeros((0,))
+    self.sub_ts = np.zeros((0,), dtype=np.int64)
+    self.lids_tail = np.zeros((0,))
+    self.lids_ts = np.zeros((0,), dtype=np.int64)
+
+  def window_start(self, ts, ntail, nsamp, window):
+    '''Get number of samples in rolling window if it is fixed (sample rate or
+       evenly spaced timestamps), else index of first sample in window of each new sample'''
+    if ts is None: # fixed sample rate
+      return int(np.ceil(round(window * self.sample_rate, 6)))
+    win_ns = int(window * 1e9)
+    step = np.diff(ts)
+    if len(step) == 0 or step[0] <= 0 or (step != step[0]).any():
+      pos = np.arange(ntail, ntail+nsamp)
+      return np.searchsorted(ts, ts[pos] - win_ns, side='right')
+    # Evenly spaced timestamps - window spans a fixed number of samples
+    return -(-win_ns // int(step[0]))
+
+  def rolling(self, tail, tail_ts, data, ts, window):
+    'Get rolling sum and number of samples over window for new data'
+    ext = np.concatenate((tail, data))
+    ext_ts = None if ts is None else np.concatenate((tail_ts, ts))
+    cumsum = np.zeros((len(ext)+1,))
+    np.cumsum(ext, out=cumsum[1:])
+    ntail = len(tail); nsamp = len(data)
+    start = self.window_start(ext_ts, ntail, nsamp, window)
+    if np.isscalar(start):
+      # Fixed window of win_len samples - windows of the first nfirst new samples
+      # start at the first sample, the others are contiguous slices of cumsum
+      win_len = start
+      nfirst = min(nsamp, max(0, win_len-ntail-1))
+      sums = np.empty((nsamp,)); counts = np.full((nsamp,), win_len)
+      sums[:nfirst] = cumsum[ntail+1:ntail+1+nfirst]
+      sums[nfirst:] = cumsum[ntail+1+nfirst:] - cumsum[ntail+1+nfirst-win_len:ntail+1+nsamp-win_len]
+      counts[:nfirst] = np.arange(ntail+1, ntail+1+nfirst)
+      keep = max(0, ntail+nsamp-win_len)
+    else:
+      end = np.arange(ntail+1, ntail+nsamp+1)
+      sums = cumsum[end] - cumsum[start]; counts = end - start
+      keep = start[-1] if nsamp else 0
+    # Carry over samples that can still be part of the next window
+    new_tail = ext[keep:]
+    new_tail_ts = np.zeros((0,), dtype=np.int64) if ext_ts is None else ext_ts[keep:]
+    return sums, counts, new_tail, new_tail_ts
+
+  def update(self, ENMO, timestamp=None):
+    'Get LIDS for the next chunk of ENMO (in g) and optional timestamps'
+    if timestamp is None and self.sample_rate is None:
+      raise ValueError('Either sample rate or timestamps are required for LIDS')
+    ENMO = np.asarray(ENMO, dtype=np.float64)
+    ts = None
+    if timestamp is not None:
+      ts = np.asarray(timestamp, dtype='datetime64[ns]').astype(np.int64)
+    ENMO_sub = np.maximum(ENMO - 0.02, 0.0) # assuming ENMO is in g
+    # 10-minute rolling sum
+    ENMO_sub_smooth, _, self.sub_tail, self.sub_ts = \
+          self.rolling(self.sub_tail, self.sub_ts, ENMO_sub, ts, self.sum_window)
+    LIDS_unfiltered = 100.0 / (ENMO_sub_smooth + 1.0)
+    # 30-minute rolling average
+    LIDS_sum, LIDS_count, self.lids_tail, self.lids_ts = \
+          self.rolling(self.lids_tail, self.lids_ts, LIDS_unfiltered, ts, self.mean_window)
+    return LIDS_sum / LIDS_count
+
+# Get Locomotor Inactivity During Sleep
+# Drop-in replacement for the pandas implementation using timestamps
+# By default, chunks span two of the longest rolling windows (derived from the
+# timestamp spacing), so that the samples carried over from the previous chunk
+# are at most a third of the samples summed for every chunk while the chunk
+# still fits in cache
+def get_LIDS(timestamp, ENMO, chunk_size=None, windows_per_chunk=2):
+  ts = np.asarray(timestamp, dtype='datetime64[ns]')
+  lids_filter = LIDSFilter()
+  if chunk_size is None:
+    step = np.median(np.diff(ts[:1000]).astype(np.int64)) if len(ts) > 1 else 0
+    win_len = int(max(lids_filter.sum_window, lids_filter.mean_window) * 1e9 // step) if step > 0 else 0
+    chunk_size = max(10**5, windows_per_chunk * win_len)
+  LIDS = np.zeros((len(ENMO),))
+  for st_idx in range(0, len(ENMO), chunk_size):
+    end_idx = min(len(ENMO), st_idx+chunk_size)
+    LIDS[st_idx:end_idx] = lids_filter.update(ENMO[st_idx:end_idx], ts[st_idx:end_idx])
+  return LIDS
@@ -0,0 +1,208 @@
+import sys, os
+import json
+import numpy as np
+
+# Compact format for ensembles of random forests (e.g. the fold models of
+# classical_ml.py) that are applied jointly by averaging their predictions.
+# An ensemble consists of
+#   <name>.json - metadata (mode, feature columns, states) and the offset,
+#                 shape and dtype of every array in the data file
+#   <name>.bin  - scaler parameters and trees of all models as raw arrays
+# Trees of all models are stored as one set of flat node arrays (feature,
+# threshold, first child and leaf index of every node) and the class
+# probabilities of all leaves. The data file is memory-mapped when
+# the ensemble is first used, so loading takes milliseconds and prediction
+# needs only numpy, not the scikit-learn version the models were trained with.
+
+feat_cols = ['ENMO_mean','ENMO_std','ENMO_range','ENMO_mad',
+             'ENMO_entropy1','ENMO_entropy2', 'ENMO_prev30diff', 'ENMO_next30diff',
+             'ENMO_prev60diff', 'ENMO_next60diff', 'ENMO_prev120diff', 'ENMO_next120diff',
+             'angz_mean','angz_std','angz_range','angz_mad',
+             'angz_entropy1','angz_entropy2', 'angz_prev30diff', 'angz_next30diff',
+             'angz_prev60diff', 'angz_next60diff', 'angz_prev120diff', 'angz_next120diff',
+             'LIDS_mean','LIDS_std','LIDS_range','LIDS_mad',
+             'LIDS_entropy1','LIDS_entropy2', 'LIDS_prev30diff', 'LIDS_next30diff',
+             'LIDS_prev60diff', 'LIDS_next60diff', 'LIDS_prev120diff', 'LIDS_next120diff']
+
+mode_states = {'binary': ['Wake', 'Sleep'],
+               'multiclass': ['Wake', 'NREM 1', 'NREM 2', 'NREM 3', 'REM'],
+               'nonwear': ['Wear', 'Nonwear']}
+
+def get_ensemble_files(name):
+  return name + '.json', name + '.bin'
+
+# Get flat node arrays and leaf class probabilities of a fitted decision tree
+# Nodes are numbered in breadth-first order, so the children of a node are
+# adjacent and the next node of a sample is child + (feature value > threshold).
+# A leaf is its own child with an infinite threshold, so samples stay in leaves
+# and all samples can be passed down for the depth of the tree.
+# Thresholds are rounded down to float32, as trees compare float32 feature
+# values and x <= threshold for a float32 x exactly if x <= rounded threshold.
+# For multiple outputs (one-hot labels of multiclass models), the probability
+# of the positive class of every output is kept, as in classical_ml.py
+def get_tree_arrays(tree):
+  nodes = tree.tree_
+  is_leaf = nodes.children_left == -1
+  order = [0]; child = np.zeros(nodes.node_count, dtype=np.int64)
+  for node in order: # order grows while it is traversed
+    if not is_leaf[node]:
+      child[node] = len(order)
+      order += [nodes.children_left[node], nodes.children_right[node]]
+  order = np.array(order)
+  is_leaf = is_leaf[order]
+  child = np.where(is_leaf, np.arange(len(order)), child[order])
+  feature = np.where(is_leaf, 0, nodes.feature[order])
+  threshold = nodes.threshold[order].astype(np.float32)
+  rounded_up = threshold > nodes.threshold[order]
+  threshold[rounded_up] = np.nextafter(threshold[rounded_up], -np.inf)
+  threshold[is_leaf] = np.inf
+  leaf = np.where(is_leaf, np.cumsum(is_leaf) - 1, 0)
+  value = nodes.value[order][is_leaf]
+  normalizer = value.sum(axis=2, keepdims=True)
+  normalizer[normalizer == 0.0] = 1.0
+  value = value / normalizer
+  value = value[:,0,:] if value.shape[1] == 1 else value[:,:,1]
+  return feature, threshold, child, leaf, value, nodes.max_depth
+
+# Export scaler and best random forest of every model file ([scaler, search or
+# forest] saved with joblib) as an ensemble with given name
+def export_ensemble(model_files, name, mode, feat_cols=feat_cols, states=None):
+  import joblib
+  states = mode_states[mode] if states is None else states
+  arrays = []; models = []
+  nodes = {key: [] for key in ['feature', 'threshold', 'child', 'leaf', 'value']}
+  num_nodes = 0; num_leaves = 0
+  for fname in model_files:
+    scaler, clf = joblib.load(fname)
+    clf = getattr(clf, 'best_estimator_', clf)
+    roots = []; depth = 0
+    for tree in clf.estimators_:
+      feature, threshold, child, leaf, value, tree_depth = get_tree_arrays(tree)
+      # Make node and leaf indices refer to the arrays of all trees
+      for key, arr in zip(['feature', 'threshold', 'child', 'leaf', 'value'],
+                          [feature, threshold, child + num_nodes, leaf + num_leaves, value]):
+        nodes[key].append(arr)
+      roots.append(num_nodes); depth = max(depth, tree_depth)
+      num_nodes += len(feature); num_leaves += len(value)
+    mean = scaler.mean_ if scaler.with_mean else np.zeros((len(feat_cols),))
+    scale = scaler.scale_ if scaler.with_std else np.ones((len(feat_cols),))
+    models.append({'file': os.path.basename(fname), 'depth': int(depth),
+                   'params': {'n_estimators': len(roots), 'max_depth': clf.max_depth}})
+    arrays += [('model%d_mean' % len(models), np.asarray(mean, dtype=np.float64)),
+               ('model%d_scale' % len(models), np.asarray(scale, dtype=np.float64)),
+               ('model%d_roots' % len(models), np.array(roots, dtype=np.int64))]
+  arrays += [('feature', np.concatenate(nodes['feature']).astype(np.int32)),
+             ('threshold', np.concatenate(nodes['threshold']).astype(np.float32)),
+             ('child', np.concatenate(nodes['child']).astype(np.int32)),
+             ('leaf', np.concatenate(nodes['leaf']).astype(np.int32)),
+             ('value', np.concatenate(nodes['value']).astype(np.float32))]
+
+  header_file, data_file = get_ensemble_files(name)
+  header = {'mode': mode, 'feat_cols': list(feat_cols), 'states': list(states),
+            'models': models, 'arrays': {}}
+  with open(data_file + '.tmp', 'wb') as fp:
+    for key, arr in arrays:
+      fp.write(b'\0' * (-fp.tell() % 64)) # align arrays to 64 bytes
+      header['arrays'][key] = {'offset': fp.tell(), 'shape': list(arr.shape), 'dtype': arr.dtype.str}
+      fp.write(np.ascontiguousarray(arr).tobytes())
+  os.replace(data_file + '.tmp', data_file)
+  with open(header_file + '.tmp', 'w') as fp:
+    json.dump(header, fp, indent=2)
+  os.replace(header_file + '.tmp', header_file)
+
+# Ensemble loaded from files written by export_ensemble
+# Only metadata is read on loading, arrays are mapped when first accessed
+class RFEnsemble(object):
+  def __init__(self, name):
+    'Initialization'
+    header_file, self.data_file = get_ensemble_files(name)
+    with open(header_file, 'r') as fp:
+      header = json.load(fp)
+    self.mode = header['mode']
+    self.feat_cols = header['feat_cols']
+    self.states = header['states']
+    self.models = header['models']
+    self.array_info = header['arrays']
+    self.data = None
+
+  def __len__(self):
+    return len(self.models)
+
+  def get_array(self, key):
+    'Get array as read-only view of data file'
+    if self.data is None:
+      self.data = np.memmap(self.data_file, mode='r', dtype=np.uint8)
+    info = self.array_info[key]
+    return np.ndarray(tuple(info['shape']), dtype=np.dtype(info['dtype']),
+                      buffer=self.data, offset=info['offset'])
+
+  def predict_model_proba(self, model, X, batch_size=2**18):
+    'Get class probabilities of given model (index) for unscaled samples'
+    X = (np.asarray(X, dtype=np.float64) - self.get_array('model%d_mean' % (model+1))) \
+          / self.get_array('model%d_scale' % (model+1))
+    X = X.astype(np.float32) # trees compare features as float32 like scikit-learn
+    roots = self.get_array('model%d_roots' % (model+1)).astype(np.int32)
+    depth = self.models[model]['depth']
+    feature = self.get_array('feature'); threshold = self.get_array('threshold')
+    child = self.get_array('child'); leaf = self.get_array('leaf'); value = self.get_array('value')
+    proba = np.zeros((len(X), value.shape[1]))
+    # Samples are passed down groups of trees at once, in batches of at most
+    # batch_size (tree, sample) pairs, so that the nodes of a batch stay in cache
+    chunk_len = min(len(X), batch_size)
+    for st_idx in range(0, len(X), chunk_len):
+      X_chunk = X[st_idx:st_idx+chunk_len]
+      X_flat = X_chunk.ravel()
+      num_trees = max(1, batch_size // len(X_chunk))
+      for tree_idx in range(0, len(roots), num_trees):
+        tree_roots = roots[tree_idx:tree_idx+num_trees]
+        node = np.repeat(tree_roots, len(X_chunk))
+        # Position of first feature of the sample of every (tree, sample) pair in X_flat
+        sample_pos = np.tile(np.arange(0, X_flat.size, X_chunk.shape[1], dtype=np.int32), len(tree_roots))
+        pair = np.arange(len(node)); leaves = np.zeros(len(node), dtype=np.int32)
+        for level in range(depth):
+          go_right = X_flat.take(sample_pos + feature.take(node)) > threshold.take(node)
+          node = child.take(node) + go_right
+          if level % 4 == 3: # regularly drop pairs that reached a leaf
+            done = child.take(node) == node
+            if done.sum() * 4 > len(node):
+              leaves[pair[done]] = node[done]
+              active = ~done
+              node = node[active]; sample_pos = sample_pos[active]; pair = pair[active]
+        leaves[pair] = node
+        proba[st_idx:st_idx+len(X_chunk)] += value.take(leaf.take(leaves), axis=0) \
+                                               .reshape(len(tree_roots), len(X_chunk), -1).sum(axis=0)
+    return proba / len(roots)
+
+  def predict_proba(self, X):
+    'Get class probabilities averaged over models'
+    X = np.asarray(X)
+    if X.shape[1] != len(self.feat_cols):
+      raise ValueError('Expected %d features, got %d' % (len(self.feat_cols), X.shape[1]))
+    proba = self.predict_model_proba(0, X)
+    for model in range(1, len(self.models)):
+      proba += self.predict_model_proba(model, X)
+    return proba / float(len(self.models))
+
+# Ensembles loaded by the current process
+ensembles = {}
+
+# Get ensemble with given name, loading it only once
+def load_ensemble(name):
+  if name not in ensembles:
+    ensembles[name] = RFEnsemble(name)
+  return ensembles[name]
+
+def main(argv):
+  modeldir = argv[0] # directory with fold models (e.g. fold1_nonwear_balanced_RF.sav)
+  outdir = argv[1] if len(argv) > 1 else modeldir
+  if not os.path.exists(outdir):
+    os.makedirs(outdir)
+  for mode in mode_states:
+    model_files = sorted(os.path.join(modeldir, fname) for fname in os.listdir(modeldir)
+                         if mode in fname and fname.endswith('.sav'))
+    if model_files:
+      print('Exporting %d %s models' % (len(model_files), mode))
+      export_ensemble(model_files, os.path.join(outdir, mode + '_RF'), mode)
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -6,6 +6,8 @@ import pandas as pd
 from scipy.stats import entropy
 from collections import Counter
 
+from lids import get_LIDS
+
 # Get Euclidean Norm minus One
 def get_ENMO(x,y,z):
   enorm = np.sqrt(x*x + y*y + z*z)
@@ -19,20 +21,6 @@ def get_tilt_angles(x,y,z):
   angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
   return angle_x, angle_y, angle_z
 
-# Get Locomotor Inactivity During Sleep   
-def get_LIDS(timestamp, ENMO):
-  df = pd.concat((timestamp, pd.Series(ENMO)), axis=1)
-  df.columns = ['timestamp','ENMO']
-  df.set_index('timestamp', inplace=True)
-  
-  df['ENMO_sub'] = np.where(ENMO < 0.02, 0, ENMO-0.02) # assuming ENMO is in g
-  # 10-minute rolling sum
-  ENMO_sub_smooth = df['ENMO_sub'].rolling('600s').sum()
-  df['LIDS_unfiltered'] = 100.0 / (ENMO_sub_smooth + 1.0)
-  # 30-minute rolling average
-  LIDS = df['LIDS_unfiltered'].rolling('1800s').mean().values
-  return LIDS
-  
 def mad(data):
   out = np.mean(np.absolute(data - np.mean(data)))
   return out  
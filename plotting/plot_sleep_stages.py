@@ -5,6 +5,9 @@ import pandas as pd
 import itertools, operator
 import matplotlib.pyplot as plt
 
+sys.path.append('../feature_engineering/')
+from timestamp_io import read_timestamp
+
 def plot_intervals(ax, bin_data, facecolor='white', alpha=0.5, label=None):
   handle = None
   intervals = [[i for i,val in it] for key,it in itertools.groupby(enumerate(bin_data),\
@@ -58,8 +61,7 @@ def main(argv):
     #y = (y-y.mean())/(y.std())
     #z = (z-z.mean())/(z.std())
   
-    timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-    timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+    timestamp = read_timestamp(fh)
     #nonwear = np.array(fh['Nonwear'])
     nonwear = estimate_nonwear(timestamp, x, y, z)
     
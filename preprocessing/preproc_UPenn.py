@@ -6,6 +6,9 @@ import math
 import h5py
 import linecache
 from datetime import datetime, timedelta, time
+
+sys.path.append('../feature_engineering/')
+from timestamp_io import write_timestamp, read_timestamp
     
 # Calibrate data given the calibration parameters saved using GGIR
 def calibrate(x, y, z, temperature, calib_df):
@@ -95,8 +98,9 @@ def get_sleep_states(lbl_data, pd_datetime):
 def save_output(out_fname, params):
     hf = h5py.File(out_fname,'w')
     for paramStr, paramData in params:
-        if paramStr == 'DateTime':
-            paramData = np.array([dt.strftime('%Y-%m-%d %H:%M:%S.%f').encode('utf8') for dt in paramData])
+        if paramStr == 'DateTime': # int64 nanoseconds since epoch
+            write_timestamp(hf, paramStr, paramData)
+            continue
         elif paramStr == 'SleepState':
             paramData = [st.encode('utf8') for st in paramData]   
         hf.create_dataset(paramStr, data=paramData)
@@ -123,8 +127,7 @@ def preproc_axivity(data_fname=None, lbl_fname=None, calib_fname=None, \
     light = np.array(fh['light'])
     battery = np.array(fh['battery'])
     temp = np.array(fh['temp'])
-    timestamp = pd.Series(fh['timestamp']).apply(lambda x: x.decode('utf8'))
-    timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+    timestamp = read_timestamp(fh, 'timestamp')
     nsamples = len(x)
     print('... Preprocessing %d samples' % nsamples)
 
@@ -7,6 +7,10 @@ import argparse
 import random
 from collections import Counter 
 
+sys.path.append('../feature_engineering/')
+from lids import get_LIDS
+from timestamp_io import read_timestamp
+
 # Get Euclidean Norm minus One
 def get_ENMO(x,y,z):
   enorm = np.sqrt(x*x + y*y + z*z)
@@ -20,20 +24,6 @@ def get_tilt_angles(x,y,z):
   angle_z = np.arctan2(z, np.sqrt(x*x + y*y)) * 180.0/math.pi
   return angle_x, angle_y, angle_z
 
-# Get Locomotor Inactivity During Sleep   
-def get_LIDS(timestamp, ENMO):
-  df = pd.concat((timestamp, pd.Series(ENMO)), axis=1)
-  df.columns = ['timestamp','ENMO']
-  df.set_index('timestamp', inplace=True)
-  
-  df['ENMO_sub'] = np.where(ENMO < 0.02, 0, ENMO-0.02) # assuming ENMO is in g
-  # 10-minute rolling sum
-  ENMO_sub_smooth = df['ENMO_sub'].rolling('600s').sum()
-  df['LIDS_unfiltered'] = 100.0 / (ENMO_sub_smooth + 1.0)
-  # 30-minute rolling average
-  LIDS = df['LIDS_unfiltered'].rolling('1800s').mean().values
-  return LIDS
-
 def rand_sample_timesteps(X, steps=1000):
   tt = np.zeros((steps,), dtype=int)
   tt[:] = np.sort(np.random.randint(1,X.shape[0]-1,steps),axis=0)
@@ -119,8 +109,7 @@ def main(args):
     x = np.array(fh['X'])
     y = np.array(fh['Y'])
     z = np.array(fh['Z'])
-    timestamp = pd.Series(fh['DateTime']).apply(lambda x: x.decode('utf8'))
-    timestamp = pd.to_datetime(timestamp, format='%Y-%m-%d %H:%M:%S.%f')
+    timestamp = read_timestamp(fh)
   
     if args.channels == 3:
       df = pd.DataFrame({'timestamp':timestamp, 'x':x, 'y':y, 'z':z}) 
@@ -71,8 +71,8 @@ class DataGenerator(Sequence):
     # X : (n_samples, *dim, channels)
     if self.augment == True:
       # Initialization
-      X1 = np.zeros((self.batch_size, self.seqlen, self.channels))
-      X2 = np.zeros((self.batch_size, self.seqlen, self.channels))
+      X1 = np.zeros((self.batch_size, self.seqlen, self.channels), dtype=np.float32)
+      X2 = np.zeros((self.batch_size, self.seqlen, self.channels), dtype=np.float32)
       y = np.ones((self.batch_size), dtype=int) * -1
   
       # Get number of samples per class after augmentation
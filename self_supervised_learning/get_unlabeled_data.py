@@ -3,6 +3,9 @@ import h5py
 import numpy as np
 import pandas as pd
 
+sys.path.append('../feature_engineering/')
+from timestamp_io import read_timestamp, write_timestamp
+
 def main(argv):
   indir = argv[0]
   outdir = argv[1]
@@ -17,7 +20,7 @@ def main(argv):
     x = np.array(fh['X'])
     y = np.array(fh['Y'])
     z = np.array(fh['Z'])
-    timestamp = pd.Series(fh['DateTime'])
+    timestamp = read_timestamp(fh)
    
     label = np.array([x.decode('utf8') for x in np.array(fh['SleepState'])],
                      dtype=object)
@@ -37,7 +40,7 @@ def main(argv):
       fw.create_dataset('X', data=x)
       fw.create_dataset('Y', data=y)
       fw.create_dataset('Z', data=z)
-      fw.create_dataset('DateTime', data=timestamp)
+      write_timestamp(fw, 'DateTime', timestamp)
    
 if __name__ == "__main__":
   main(sys.argv[1:])
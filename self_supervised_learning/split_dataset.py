@@ -5,41 +5,21 @@ import h5py
 from tqdm import tqdm
 from collections import Counter
 
-def get_stats(infile, indices, batchsize=1000):
-  with h5py.File(infile,'r') as fp:
-    samples1 = fp['samp1']
-    samples2 = fp['samp2']
-    labels = fp['label']
-    [num_samples, seqlen, channels] = samples1.shape
-    
-    num_indices = len(indices)
-    num_batches = num_indices // batchsize
-    if num_batches % batchsize:
-      num_batches += 1
-
-    sumX1 = None; sumX2 = None  
-    sumXX1 = None; sumXX2 = None  
-    for i in tqdm(range(num_batches)):
-      batch_indices = indices[i*batchsize:min(num_indices,(i+1)*batchsize)]
-      if i == 0:
-        sumX1 = np.array(samples1[batch_indices]).sum(axis=0)
-        sumXX1 = (np.array(samples1[batch_indices])**2).sum(axis=0)
-        sumX2 = np.array(samples2[batch_indices]).sum(axis=0)
-        sumXX2 = (np.array(samples2[batch_indices])**2).sum(axis=0)
-      else:
-        sumX1 = sumX1 + np.array(samples1[batch_indices]).sum(axis=0)
-        sumXX1 = sumXX1 + (np.array(samples1[batch_indices])**2).sum(axis=0)
-        sumX2 = sumX2 + np.array(samples2[batch_indices]).sum(axis=0)
-        sumXX2 = sumXX2 + (np.array(samples2[batch_indices])**2).sum(axis=0)
+sys.path.append('../feature_engineering/')
+from running_stats import get_cached_stats
 
-    mean1 = sumX1/float(num_indices)
-    std1 = np.sqrt(sumXX1/float(num_indices) - mean1**2)
-    mean2 = sumX2/float(num_indices)
-    std2 = np.sqrt(sumXX2/float(num_indices) - mean2**2)
-    mean = (mean1 + mean2) / 2.0
-    std = (std1 + std2) / 2.0
+# Get mean and standard deviation of both samples of given indices
+# Statistics are computed in a streaming way over blocks of HDF5 chunks, in
+# parallel if workers > 1, and cached in cache_dir if given
+def get_stats(infile, indices, batchsize=1000, workers=1, cache_dir=None):
+  stats1 = get_cached_stats(infile, 'samp1', indices=indices, cache_dir=cache_dir,
+                            workers=workers, block_size=batchsize)
+  stats2 = get_cached_stats(infile, 'samp2', indices=indices, cache_dir=cache_dir,
+                            workers=workers, block_size=batchsize)
+  mean = (stats1.mean + stats2.mean) / 2.0
+  std = (stats1.std + stats2.std) / 2.0
 
-    return mean, std
+  return mean, std
 
 def save_partition(infile, indices, mean, std, partition, outdir, batchsize=1000):
   with h5py.File(infile,'r') as fp:
@@ -55,8 +35,9 @@ def save_partition(infile, indices, mean, std, partition, outdir, batchsize=1000
       num_batches += 1
     for i in tqdm(range(num_batches)):
       batch_indices = indices[i*batchsize:min(num_indices,(i+1)*batchsize)]
-      batch_samples1_norm = (samples1[batch_indices] - mean)/std
-      batch_samples2_norm = (samples2[batch_indices] - mean)/std
+      # Normalized samples are stored as float32 as used for training
+      batch_samples1_norm = ((samples1[batch_indices] - mean)/std).astype(np.float32)
+      batch_samples2_norm = ((samples2[batch_indices] - mean)/std).astype(np.float32)
       if i == 0:
         with h5py.File(os.path.join(outdir, partition+'_dataset.h5'),'w') as fp:
           fp.create_dataset('samp1', data=batch_samples1_norm, chunks=True,\
@@ -79,6 +60,7 @@ def main(args):
   val_perc = float(args[1])
   test_perc = float(args[2])
   outdir = args[3]
+  workers = int(args[4]) if len(args) > 4 else 1 # processes computing statistics
 
   batchsize = 100
 
@@ -99,7 +81,7 @@ def main(args):
     test_indices = np.sort(indices[num_train+num_val:])
 
     # Get stats
-    mean, std = get_stats(infile, train_indices, batchsize=batchsize)
+    mean, std = get_stats(infile, train_indices, batchsize=batchsize, workers=workers, cache_dir=outdir)
     np.savez(os.path.join(outdir, 'stats_dataset.npz'), mean=mean, std=std)
    
     # Save partitions